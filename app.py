@@ -1,37 +1,65 @@
-import bisect
-import datetime
-from typing import Optional
+from urllib.parse import parse_qs
 
 import dash
 import dash_bootstrap_components as dbc
 import dash_html_components as html
 import humanize
-import numpy as np
 import pandas as pd
-from dash.dependencies import Input, Output, State
-
-from lib import update_csv_via_rest
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+
+from lib import http_cache, rollup_via_rest, update_csv_via_rest
+from lib.annotations import annotation_index
+from lib.dataset_registry import DatasetRegistry, DEFAULT_USER
+from lib.figure_cache import FigureCache, window_start
+from lib.figure_json import encode_figure
 from lib.interface import construct_page_content
 from lib.my_plotter import (
     get_plotted_fig_all,
     get_xaxis_zoomed_range,
-    _get_resampled_df,
+    get_yaxis_autoscaled_range,
     get_fig_body_composite_trend,
+    WEBGL_POINT_THRESHOLD,
+    YAXIS_MARGIN,
 )
-from lib.utils import md5, get_df_after_given_date
+from lib.prewarm import FigureWarmer, component_values
+from lib.sqlite_store import MeasurementDB
 
 ############################################
 CSV_FILE_NAME = "data/mifit.csv"
-
-fig_to_plot = {}
-composite_trend_fig_to_plot = {}
-cur_file_hash = None
-cur_df: Optional[pd.DataFrame] = None
-cur_resampled_df: Optional[pd.DataFrame] = None
+USERS_DIR = "data/users"
+# budget for the loaded frames of all users
+MAX_LOADED_BYTES = 512 * 1024 ** 2
+# set to e.g. "data/measurements.sqlite" to serve windowed views from SQLite
+# instead of keeping every user's whole history in memory
+SQLITE_DB_FILE = None
+# points sent per trace for the visible x-range (about two per pixel of a
+# wide figure); zooming in refines the traces
+MAX_POINTS_PER_TRACE = 2000
+# budget for the cached figures of all users
+MAX_FIGURE_CACHE_BYTES = 64 * 1024 ** 2
+# budget for the JSON text of the cached figures, as sent to the browser
+MAX_FIGURE_JSON_CACHE_BYTES = 64 * 1024 ** 2
+# budget for the compressed bodies of the responses (see `http_cache`)
+MAX_COMPRESSED_CACHE_BYTES = 16 * 1024 ** 2
+# besides the default controls, warm the figures of this many of the most
+# frequent recent requests of a user whenever its data changes
+WARM_TOP_REQUESTS = 4
+
+registry = DatasetRegistry(
+    CSV_FILE_NAME,
+    USERS_DIR,
+    max_bytes=MAX_LOADED_BYTES,
+    db=MeasurementDB(SQLITE_DB_FILE) if SQLITE_DB_FILE else None,
+)
+figure_cache = FigureCache(max_bytes=MAX_FIGURE_CACHE_BYTES)
+figure_json_cache = FigureCache(max_bytes=MAX_FIGURE_JSON_CACHE_BYTES, sizeof=len)
 ############################################
 
 app = dash.Dash(
     external_stylesheets=[dbc.themes.BOOTSTRAP],
+    # compressed (with brotli if available) by `http_cache` instead
+    compress=False,
     meta_tags=[
         # tag to make mobile more zoomed-in
         {"name": "viewport", "content": "width=device-width, " "initial-scale=1"}
@@ -40,232 +68,528 @@ app = dash.Dash(
 sidebar, content = construct_page_content(app)
 
 app.layout = html.Div([sidebar, content])
+# compress the responses, answer conditional GETs of the layout and assets
+compressed_cache = http_cache.build_hooks(
+    app, max_cache_bytes=MAX_COMPRESSED_CACHE_BYTES
+)
 
-_EMW_SPAN_GLOBAL_VARIABLE = 24
+# the stats of the last measurement shown on the cards
+CARD_LABELS = ["WEIGHT", "BODY_FAT", "MUSCLE", "MOISTURE"]
+# and the derived metric (see `DERIVED_METRICS`) shown below each of them
+CARD_DERIVED = {
+    "WEIGHT": "WEIGHT_WEEKLY_DELTA",
+    "BODY_FAT": "FAT_MASS",
+    "MUSCLE": "FFMI",
+    "MOISTURE": "WATER_MASS",
+}
 
 
-def _plot_fig(df, resampled_df, labels_to_plot):
+def _plot_fig(dataset, plot_since, labels_to_plot, emw_span, x_range, source="raw"):
     print("Plotting...")
+    df, resampled_df = dataset.frames_since(plot_since, columns=labels_to_plot)
+    if source != "raw":
+        # plot the rollup table of the given granularity
+        fig = get_plotted_fig_all(
+            df,
+            resampled_df,
+            labels_to_plot,
+            emw_span=emw_span,
+            rollup=dataset.rollup(source, plot_since),
+            webgl_threshold=WEBGL_POINT_THRESHOLD,
+        )
+        set_tight_margin(fig)
+        return fig
     fig = get_plotted_fig_all(
-        df, resampled_df, labels_to_plot, emw_span=_EMW_SPAN_GLOBAL_VARIABLE
+        df,
+        resampled_df,
+        labels_to_plot,
+        emw_span=emw_span,
+        smoothed=dataset.smoothed_since(labels_to_plot, emw_span, plot_since),
+        x_range=x_range,
+        max_points=MAX_POINTS_PER_TRACE,
+        # the pyramids are kept for the whole history only
+        pyramids=dataset.pyramids if plot_since is None else None,
+        webgl_threshold=WEBGL_POINT_THRESHOLD,
     )
     # setup margin for the plot
     set_tight_margin(fig)
     return fig
 
 
-def get_fig(labels_to_plot, force_update=False, plot_since=None):
-    # first check if file content had changed
-    global cur_file_hash, cur_df, cur_resampled_df
-    if md5(CSV_FILE_NAME) != cur_file_hash:
-        # remove all existing plot.
-        fig_to_plot.clear()
-        composite_trend_fig_to_plot.clear()
-        # reset the file hash
-        cur_file_hash = md5(CSV_FILE_NAME)
-        cur_df = pd.read_csv(CSV_FILE_NAME)
-        cur_df.index = (
-            pd.to_datetime(cur_df.TIMESTAMP, unit="ms")
-            # .dt.tz_localize("UTC")
-            # .dt.tz_convert("Australia/Sydney")
-        )
+def get_fig(
+    dataset,
+    labels_to_plot,
+    recent_months,
+    emw_span,
+    force_update=False,
+    plot_since=None,
+    x_range=None,
+    source="raw",
+):
+    """The key and the figure of the given stats, smoothed over `emw_span`
+    measurements, with its traces at full
+    resolution for the `recent_months` initially shown, or for `x_range` if
+    given (when the user zoomed; these are not cached). `source` is "raw" to
+    plot the measurements, or the granularity of the rollup table to plot.
+
+    The figure is shared by every request with the same key and must not be
+    modified; per-request changes are sent as a layout patch instead (see
+    `get_fig_patch`)."""
+    if x_range is not None:
+        if source != "raw":
+            # rollups are plotted whole, there is nothing to refine
+            raise PreventUpdate
+        key = ("zoom", dataset.user, dataset.data_version, emw_span, x_range)
+        return key, _plot_fig(dataset, plot_since, labels_to_plot, emw_span, x_range)
+
+    def plot():
+        x_range = get_xaxis_zoomed_range(dataset.latest().name, recent_months)[
+            "xaxis_range"
+        ]
+        return _plot_fig(dataset, plot_since, labels_to_plot, emw_span, x_range, source)
+
+    # plot if necessary
+    key = (
+        "stats",
+        dataset.user,
+        dataset.data_version,
+        tuple(labels_to_plot),
+        recent_months,
+        plot_since,
+        source,
+        emw_span,
+        annotation_index().version,
+    )
+    return key, figure_cache.get(key, plot, force_update=force_update)
+
+
+def _plot_since(recent_months, only_plot_in_range):
+    return window_start(30 * recent_months) if only_plot_in_range else None
+
+
+def get_fig_json(key, fig, force_update=False):
+    """The JSON text of the figure `get_fig` returned under `key` (see
+    `encode_figure`), encoded once per cached figure."""
+    if key[0] == "zoom":
+        return encode_figure(fig)
+    return figure_json_cache.get(
+        key, lambda: encode_figure(fig), force_update=force_update
+    )
 
-        cur_resampled_df = _get_resampled_df(cur_df)
 
-    if plot_since:
-        df = get_df_after_given_date(cur_df, plot_since)
-        resampled_df = get_df_after_given_date(cur_resampled_df, plot_since)
+def get_fig_view(fig_key, fig, dataset, labels, recent_months, x_range, source):
+    """What the browser needs to know of the figure `get_fig` returned (and
+    sent to it): its key, what it shows initially, the x-range its traces
+    are detailed for (None if they cannot be refined), and, of the same
+    snapshot of the data, the y-ranges that fit the initial x-range and the
+    last measurement (and its derived metrics), shown by the cards."""
+    latest = dataset.latest()
+    last_measurement_time = latest.name
+    derived, _ = dataset.derived_since(
+        list(CARD_DERIVED.values()), last_measurement_time
+    )
+    if x_range is None:
+        xaxis_range = get_xaxis_zoomed_range(last_measurement_time, recent_months)[
+            "xaxis_range"
+        ]
+    elif x_range[0] is None:
+        xaxis_range = [pd.Timestamp(fig["data"][0]["x"][0]), last_measurement_time]
     else:
-        df = cur_df
+        # keep the view the user zoomed to
+        xaxis_range = list(x_range)
+    return dict(
+        key=repr(fig_key),
+        user=dataset.user,
+        labels=labels,
+        recent_months=recent_months,
+        x_range=xaxis_range,
+        detail_range=xaxis_range if source == "raw" else None,
+        last_measurement_time=last_measurement_time,
+        # make sure the y-zoom level are correct on the part that we are
+        # interested in
+        y_ranges={
+            axis: [float(lo), float(hi)]
+            for axis, (lo, hi) in get_yaxis_autoscaled_range(
+                dataset.y_range, labels, xaxis_range
+            ).items()
+        },
+        latest={
+            **{label: float(latest[label]) for label in CARD_LABELS},
+            **{
+                name: float(derived[name].iat[-1]) if name in derived else None
+                for name in CARD_DERIVED.values()
+            },
+        },
+    )
 
-    # plot if necessary
-    _hash = hash((plot_since, tuple(labels_to_plot)))
-    if force_update or _hash not in fig_to_plot:
-        fig_to_plot[_hash] = _plot_fig(df, resampled_df, labels_to_plot)
 
-    return fig_to_plot[_hash]
+def get_fig_patch(view):
+    """The changes to the (shared) figure of the stats with the given view: a
+    layout patch, with plotly's "magic underscore" keys, with the y-axes
+    fitted to the initial x-range (see `get_fig_view`). These are applied to a copy of the figure
+    by the clientside `figure.apply_patch` (see assets/figure_patch.js),
+    which also applies the height and the fill, and fits the y-axes to the
+    x-range the user pans to, without asking the server."""
+    recent_months = view["recent_months"]
+    # the view had been sent to the browser, its dates are strings now
+    xaxis_range = [pd.Timestamp(t) for t in view["x_range"]]
+
+    title = f"This month" if recent_months == 1 else f"Recent {recent_months} months"
+    last_measurement_time = pd.Timestamp(view["last_measurement_time"])
+    last_update_time = humanize.naturaltime(last_measurement_time.replace(tzinfo=None))
+    layout = dict(
+        xaxis_range=xaxis_range,
+        title_text=f"{title} (last update: {last_update_time})",
+        **view["y_ranges"],
+    )
+    return dict(layout=layout, y_margin=YAXIS_MARGIN)
+
+
+def _relayout_x_range(relayout_data):
+    """The x-range the user zoomed or panned to, (None, None) if the axes
+    were reset, or None if the x-range did not change."""
+    for key, value in (relayout_data or {}).items():
+        # the x axes are shared, any of them will do
+        if not key.startswith("xaxis"):
+            continue
+        axis, _, prop = key.partition(".")
+        if prop == "range":
+            return pd.Timestamp(value[0]), pd.Timestamp(value[1])
+        if prop == "range[0]":
+            return (
+                pd.Timestamp(value),
+                pd.Timestamp(relayout_data[f"{axis}.range[1]"]),
+            )
+        if prop == "autorange" and value:
+            return None, None
+    return None
 
 
-# get_fig(["WEIGHT"])
+def _stats_request(labels, recent_months, check_list, source, emw_span):
+    """What `update_figure_cb` plots, as warmed by the `warmer`."""
+    return (
+        "stats",
+        tuple(labels),
+        recent_months,
+        "only_plot_in_range" in check_list,
+        source,
+        emw_span,
+    )
+
+
+def _trend_request(last_x_days, trend_smoothing_span):
+    """What `update_composite_trend_cb` plots, as warmed by the `warmer`."""
+    return ("trend", last_x_days, trend_smoothing_span)
+
+
+def warm_figures(dataset, request):
+    """Plot and encode the figures of a request (see `_stats_request` and
+    `_trend_request`) into the caches, ahead of the callbacks asking for
+    them."""
+    if dataset.latest() is None:
+        # no measurements yet
+        return
+    if request[0] == "stats":
+        _, labels, recent_months, only_plot_in_range, source, emw_span = request
+        fig_key, fig = get_fig(
+            dataset,
+            list(labels),
+            recent_months,
+            emw_span,
+            plot_since=_plot_since(recent_months, only_plot_in_range),
+            source=source,
+        )
+        get_fig_json(fig_key, fig)
+    else:
+        _, last_x_days, trend_smoothing_span = request
+        get_composit_trend_fig(dataset, last_x_days, trend_smoothing_span)
+
+
+def _warm_defaults():
+    values = component_values(sidebar, content)
+    return [
+        _stats_request(
+            values["dropdown"],
+            values["recent_months_to_dis"],
+            values["check_list"],
+            values["plot_source"],
+            values["stat_smoothing_span"],
+        ),
+        _trend_request(
+            values["trend_show_past_x_days"], values["trend_smoothing_span"]
+        ),
+    ]
+
+
+# warm the figures of the default controls (and of the frequent requests)
+# after startup and whenever a user's data changes
+warmer = FigureWarmer(
+    registry,
+    warm_figures,
+    defaults=_warm_defaults(),
+    top=WARM_TOP_REQUESTS,
+)
+
+
+# get_fig(registry.get(DEFAULT_USER), ["WEIGHT"])
+
+
+def _default_user(users):
+    return DEFAULT_USER if DEFAULT_USER in users or not users else users[0]
+
+
+@app.callback(
+    [Output("user_dropdown", "options"), Output("user_dropdown", "value")],
+    [Input("url", "search")],
+)
+def select_user_cb(search):
+    # the user can be pre-selected with ?user=<id>
+    users = registry.users()
+    requested = parse_qs((search or "").lstrip("?")).get("user", [None])[0]
+    if requested not in users:
+        requested = _default_user(users)
+    return [{"label": u, "value": u} for u in users], requested
 
 
 ############################################
 
 
-# cache fig to plot
+# Every output depends on its own inputs only: the figure of the stats is
+# re-plotted (or taken from the cache) when what it plots changes, and sent
+# to the browser if it does not have it yet; its ranges and title are a
+# patch on top of it, its height, fill and the y-ranges while panning are
+# set in the browser; the cards and the composite trend are computed per
+# version of the data.
+
+
+def _triggered():
+    return [t["prop_id"].split(".")[0] for t in dash.callback_context.triggered]
 
 
 @app.callback(
-    [
-        Output("graph_all", "figure"),
-        Output("composite_trend", "figure"),
-        Output("card_weight_text", "children"),
-        Output("card_body_fat_text", "children"),
-        Output("card_muscle_text", "children"),
-        Output("card_moisture_text", "children"),
-    ],
+    [Output("graph_all_base", "data"), Output("graph_all_view", "data")],
     [
         Input("refresh_button", "n_clicks"),
-        Input("fig_height", "value"),
         Input("recent_months_to_dis", "value"),
         Input("check_list", "value"),
         Input("dropdown", "value"),
         Input("stat_smoothing_span", "value"),
-        Input("trend_show_past_x_days", "value"),
-        Input("trend_smoothing_span", "value"),
+        Input("user_dropdown", "value"),
+        Input("graph_all_refine", "data"),
+        Input("plot_source", "value"),
     ],
-    [],
+    [State("graph_all_view", "data")],
 )
 def update_figure_cb(
     n_clicks,
-    fig_height,
     recent_months_to_dis,
     check_list_value,
     dropdown_value,
     stat_smoothing_span,
-    trend_show_past_x_days,
-    trend_smoothing_span,
+    user,
+    relayout_data,
+    plot_source,
+    sent_view,
 ):
-    force_update = False
-    ctx = dash.callback_context
-    triggered = []
-    if ctx.triggered:
-        triggered = [t["prop_id"].split(".")[0] for t in ctx.triggered]
-        if "refresh_button" in triggered:
-            force_update = True
-
-        if "stat_smoothing_span" in triggered:
-            force_update = True
-            global _EMW_SPAN_GLOBAL_VARIABLE
-            _EMW_SPAN_GLOBAL_VARIABLE = stat_smoothing_span
-
-    fig = get_fig(
+    triggered = _triggered()
+    # the span is part of the key of the figure, which is plotted (or taken
+    # from the cache) for it like for any other control
+    force_update = "refresh_button" in triggered
+
+    if user is None:
+        # the user is only known after the url had been read
+        raise PreventUpdate
+    x_range = None
+    if triggered == ["graph_all_refine"]:
+        # zoomed or panned out of the detailed x-range (see the clientside
+        # `figure.refine`): refine the traces to the new x-range
+        x_range = _relayout_x_range(relayout_data)
+        if x_range is None:
+            raise PreventUpdate
+    else:
+        warmer.record(
+            user,
+            _stats_request(
+                dropdown_value,
+                recent_months_to_dis,
+                check_list_value,
+                plot_source,
+                stat_smoothing_span,
+            ),
+        )
+    dataset = registry.get(user)
+    if dataset.latest() is None:
+        # no measurements yet (e.g. an empty csv), nothing to plot
+        raise PreventUpdate
+
+    fig_key, fig = get_fig(
+        dataset,
         dropdown_value,
+        recent_months_to_dis,
+        stat_smoothing_span,
         force_update=force_update,
-        plot_since=datetime.datetime.now()
-        - datetime.timedelta(days=30 * recent_months_to_dis)
-        if "only_plot_in_range" in check_list_value
-        else None,
+        plot_since=_plot_since(
+            recent_months_to_dis, "only_plot_in_range" in check_list_value
+        ),
+        x_range=x_range,
+        source=plot_source,
     )
+    assert fig["data"][1]["name"] == "Actual Measurement", fig["data"][1]["name"]
 
-    if not ctx.triggered:
-        # initial call when no fig had been created yet
-        composite_fig = get_composit_trend_fig(
-            trend_show_past_x_days, trend_smoothing_span, force_update=force_update
-        )
-    elif any(
-        token in triggered
-        for token in ["trend_show_past_x_days", "trend_smoothing_span"]
-    ):
-        composite_fig = get_composit_trend_fig(
-            trend_show_past_x_days, trend_smoothing_span, force_update=force_update
-        )
-        return (
-            dash.no_update,
-            composite_fig,
-            dash.no_update,
-            dash.no_update,
-            dash.no_update,
-            dash.no_update,
-        )
-    else:
-        composite_fig = dash.no_update
+    # only send the traces if the browser does not have them yet (e.g. only
+    # the fill was toggled)
+    if not force_update and sent_view and sent_view["key"] == repr(fig_key):
+        raise PreventUpdate
+    return (
+        get_fig_json(fig_key, fig, force_update=force_update),
+        get_fig_view(
+            fig_key,
+            fig,
+            dataset,
+            dropdown_value,
+            recent_months_to_dis,
+            x_range,
+            plot_source,
+        ),
+    )
 
-    # if not ctx.triggered:
-    #     button_id = 'No clicks yet'
-    # else:
-    #     button_id = ctx.triggered[0]['prop_id'].split('.')[0]
 
-    ##########################################################
+@app.callback(Output("graph_all_patch", "data"), [Input("graph_all_view", "data")])
+def update_figure_patch_cb(view):
+    if view is None:
+        raise PreventUpdate
+    # of the snapshot the figure was plotted from, not the current one
+    return get_fig_patch(view)
 
-    assert fig.data[1].name == "Actual Measurement", fig.data[1]
-    last_measurement_time = fig.data[0].x[-1]
 
-    fig.update_layout(height=int(fig_height))
-    fig.update_layout(
-        **get_xaxis_zoomed_range(last_measurement_time, recent_months_to_dis)
-    )
+def _card(stat, derived):
+    # the stat, and a derived metric below it
+    return [stat, html.Br(), html.Small(derived)]
 
-    title = (
-        f"This month"
-        if recent_months_to_dis == 1
-        else f"Recent {recent_months_to_dis} months"
-    )
 
-    # make the data fill to zero
-    if "fill_under" in check_list_value:
-        for d in fig.data:
-            if d.name and d.name.startswith("Moving"):
-                d.fill = "tozeroy"
-
-    # make sure the y-zoom level are correct on the part that we are interested in
-    currently_in_range = fig.layout.xaxis.range
-    _margin = 0.5
-    for d in fig.data:
-        if d.name and d.name.startswith("Actual"):
-            # find the first index that our target is greater than x
-            _yaxis_start_idx = bisect.bisect_left(d.x, currently_in_range[0])
-            _yaxis_end_idx = bisect.bisect_left(d.x, currently_in_range[1])
-            _currently_inrange_yvalues = d.y[_yaxis_start_idx:_yaxis_end_idx]
-            # compute the yrange for this subplot
-            yrange = (
-                np.nanmin(_currently_inrange_yvalues) - _margin,
-                np.nanmax(_currently_inrange_yvalues) + _margin,
-            )
-            # find the corresponding yaxis in the layout object and set the yrange
-            fig.layout[f'yaxis{d["yaxis"][1:]}'].range = yrange
+@app.callback(
+    [
+        Output("card_weight_text", "children"),
+        Output("card_body_fat_text", "children"),
+        Output("card_muscle_text", "children"),
+        Output("card_moisture_text", "children"),
+    ],
+    # the view changes with the version of the data, as does the figure
+    [Input("graph_all_view", "data")],
+)
+def update_cards_cb(view):
+    if view is None:
+        raise PreventUpdate
+    # of the same version of the data as the figure (NaN was sent as null)
+    latest = {
+        label: float("nan") if value is None else value
+        for label, value in view["latest"].items()
+    }
+    return (
+        _card(
+            f"{latest['WEIGHT']:.1f} KG",
+            f"{latest['WEIGHT_WEEKLY_DELTA']:+.1f} KG / 7 days",
+        ),
+        _card(f"{latest['BODY_FAT']:.1f} %", f"{latest['FAT_MASS']:.1f} KG fat"),
+        _card(f"{latest['MUSCLE']:.1f} KG", f"FFMI {latest['FFMI']:.1f}"),
+        _card(f"{latest['MOISTURE']:.1f} %", f"{latest['WATER_MASS']:.1f} KG water"),
+    )
 
-    # update title and the latest data point
-    last_update_time = humanize.naturaltime(last_measurement_time.replace(tzinfo=None))
-    fig.update_layout(title=f"{title} (last update: {last_update_time})")
-
-    ############################################################
-
-    def zoom(layout, xrange):
-        print("hiiii")
-        for d in fig.data:
-            if d.name and d.name.startswith("Actual"):
-                # find the first index that our target is greater than x
-                _yaxis_start_idx = bisect.bisect_left(d.x, currently_in_range[0])
-                _yaxis_end_idx = bisect.bisect_left(d.x, currently_in_range[1])
-                _currently_inrange_yvalues = d.y[_yaxis_start_idx:_yaxis_end_idx]
-                # compute the yrange for this subplot
-                yrange = (
-                    np.nanmin(_currently_inrange_yvalues) - _margin,
-                    np.nanmax(_currently_inrange_yvalues) + _margin,
-                )
-                # find the corresponding yaxis in the layout object and set the yrange
-                fig.layout[f'yaxis{d["yaxis"][1:]}'].range = yrange
 
-    return (
-        fig,
-        composite_fig,
-        f"{cur_df['WEIGHT'][-1]:.1f} KG",
-        f"{cur_df['BODY_FAT'][-1]:.1f} %",
-        f"{cur_df['MUSCLE'][-1]:.1f} KG",
-        f"{cur_df['MOISTURE'][-1]:.1f} %",
+@app.callback(
+    Output("composite_trend_json", "data"),
+    [
+        Input("refresh_button", "n_clicks"),
+        Input("trend_show_past_x_days", "value"),
+        Input("trend_smoothing_span", "value"),
+        Input("user_dropdown", "value"),
+    ],
+)
+def update_composite_trend_cb(
+    n_clicks, trend_show_past_x_days, trend_smoothing_span, user
+):
+    if user is None:
+        raise PreventUpdate
+    warmer.record(user, _trend_request(trend_show_past_x_days, trend_smoothing_span))
+    dataset = registry.get(user)
+    if dataset.latest() is None:
+        raise PreventUpdate
+    return get_composit_trend_fig(
+        dataset,
+        trend_show_past_x_days,
+        trend_smoothing_span,
+        force_update="refresh_button" in _triggered(),
     )
 
 
-def get_composit_trend_fig(last_x_days, trend_smoothing_span, force_update=False):
+# combine the base figure with its patch in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace="figure", function_name="apply_patch"),
+    Output("graph_all", "figure"),
+    [
+        Input("graph_all_base", "data"),
+        Input("graph_all_patch", "data"),
+        Input("graph_all_view", "data"),
+        Input("graph_all", "relayoutData"),
+        Input("fig_height", "value"),
+        Input("check_list", "value"),
+    ],
+)
+app.clientside_callback(
+    ClientsideFunction(namespace="figure", function_name="refine"),
+    Output("graph_all_refine", "data"),
+    [Input("graph_all", "relayoutData")],
+    [State("graph_all_view", "data")],
+)
+app.clientside_callback(
+    ClientsideFunction(namespace="figure", function_name="parse"),
+    Output("composite_trend", "figure"),
+    [Input("composite_trend_json", "data")],
+)
+
+
+def get_composit_trend_fig(
+    dataset, last_x_days, trend_smoothing_span, force_update=False
+):
+    """The JSON text of the composite trend figure (see `encode_figure`)."""
     # plot if necessary
-    # NOTE that we do not need to handle file-changing here as it's handled by the
-    # main stat plotting.
-    _hash = hash((last_x_days, trend_smoothing_span))
-    if force_update or _hash not in composite_trend_fig_to_plot:
-        composite_trend_fig_to_plot[_hash] = _plot_composit_trend_fig(
-            last_x_days, trend_smoothing_span, force_update
-        )
-    return composite_trend_fig_to_plot[_hash]
+    # NOTE that we do not need to handle file-changing here as the key has the
+    # version of the dataset's data (and of the annotations).
+    beginning_date = window_start(last_x_days)
+    key = (
+        "trend",
+        dataset.user,
+        dataset.data_version,
+        beginning_date,
+        trend_smoothing_span,
+        annotation_index().version,
+    )
+    return figure_json_cache.get(
+        key,
+        lambda: encode_figure(
+            _plot_composit_trend_fig(dataset, beginning_date, trend_smoothing_span)
+        ),
+        force_update=force_update,
+    )
 
 
-def _plot_composit_trend_fig(last_x_days, trend_smoothing_span, force_update=False):
-    beginning_date = datetime.datetime.now() - datetime.timedelta(days=last_x_days)
+def _plot_composit_trend_fig(dataset, beginning_date, trend_smoothing_span):
+    df, resampled_df = dataset.frames_since(
+        beginning_date, columns=["WEIGHT", "BODY_FAT", "MUSCLE", "BONE_MASS"]
+    )
+    smoothed = dataset.smoothed_since(
+        ["FAT_MASS", "MUSCLE", "BONE_MASS"], trend_smoothing_span, beginning_date
+    )
+    if smoothed is not None:
+        smoothed["BODY_FAT"] = smoothed.pop("FAT_MASS")
     composite_fig = get_fig_body_composite_trend(
-        cur_df,
-        cur_resampled_df,
+        df,
+        resampled_df,
         beginning_date=beginning_date,
         trend_smoothing_span=trend_smoothing_span,
+        smoothed=smoothed,
+        derived=dataset.derived_since(["FAT_MASS"], beginning_date),
+        webgl_threshold=WEBGL_POINT_THRESHOLD,
     )
     set_tight_margin(composite_fig)
     composite_fig.update_layout(
@@ -275,7 +599,12 @@ def _plot_composit_trend_fig(last_x_days, trend_smoothing_span, force_update=Fal
 
 
 def set_tight_margin(fig):
-    fig.update_layout(margin=dict(l=0, r=0, t=80, b=80), dragmode="pan")
+    layout = dict(margin=dict(l=0, r=0, t=80, b=80), dragmode="pan")
+    if isinstance(fig, dict):
+        # plotly json, see `get_plotted_fig_all`
+        fig["layout"].update(layout)
+    else:
+        fig.update_layout(**layout)
 
 
 ############################################
@@ -307,8 +636,28 @@ def get_tasks():
 
 ############################################
 
-# build route to upload csv content
-update_csv_via_rest.build_route(app, CSV_FILE_NAME)
+@app.server.route("/cache_stats", methods=["GET"])
+def get_cache_stats():
+    return jsonify(
+        {
+            "datasets": registry.stats(),
+            "figures": figure_cache.stats(),
+            "figure_json": figure_json_cache.stats(),
+            "warmer": warmer.stats(),
+            "compressed": compressed_cache.stats(),
+        }
+    )
+
+
+# build route to upload csv content, warming the figures of every upload
+update_csv_via_rest.build_route(app, registry, on_update=warmer.notify)
+# build route to serve the rollup tables
+rollup_via_rest.build_route(app, registry)
+
+if registry.users():
+    # the first user shown after startup
+    warmer.notify(_default_user(registry.users()))
+warmer.start()
 
 if __name__ == "__main__":
     app.run_server(
@@ -0,0 +1,218 @@
+// Clientside callbacks of the figures.
+(function () {
+    // the name of the traces of the measurements (see `my_plotter`)
+    var MEASUREMENT_TRACE = "Actual Measurement";
+
+    // the x values of the traces as times, parsed once per (shared) array
+    var parsedX = new WeakMap();
+
+    function toTime(value) {
+        if (typeof value !== "string") {
+            // the traces' dates are epoch milliseconds (see `encode_figure`)
+            return +value;
+        }
+        // plotly's dates are "YYYY-MM-DD[ HH:MM[:SS[.f]]]", the server's
+        // are ISO; both are timezone-naive like the milliseconds
+        value = value.replace(" ", "T");
+        return Date.parse((value.length === 10 ? value + "T00:00" : value) + "Z");
+    }
+
+    // the base figure, parsed once (the same text is patched again and again)
+    var parsedBase = { json: null, figure: null };
+
+    function parseBase(json) {
+        if (parsedBase.json !== json) {
+            parsedBase = { json: json, figure: JSON.parse(json) };
+        }
+        return parsedBase.figure;
+    }
+
+    function traceTimes(trace) {
+        var times = parsedX.get(trace.x);
+        if (times === undefined) {
+            times = Float64Array.from(trace.x, toTime);
+            parsedX.set(trace.x, times);
+        }
+        return times;
+    }
+
+    // the x-range the user zoomed or panned to, null if the axes were reset,
+    // or undefined if the x-range did not change (see `_relayout_x_range`)
+    function relayoutXRange(relayout) {
+        var keys = Object.keys(relayout || {});
+        for (var i = 0; i < keys.length; i++) {
+            // the x axes are shared, any of them will do
+            var key = keys[i];
+            if (key.indexOf("xaxis") !== 0) {
+                continue;
+            }
+            var axis = key.split(".")[0];
+            var prop = key.slice(axis.length + 1);
+            if (prop === "range") {
+                return relayout[key].slice();
+            }
+            if (prop === "range[0]") {
+                return [relayout[key], relayout[axis + ".range[1]"]];
+            }
+            if (prop === "autorange" && relayout[key]) {
+                return null;
+            }
+        }
+        return undefined;
+    }
+
+    // the y-range of every subplot that fits its measurements within [start, end]
+    function autoscaledYRanges(data, start, end, margin) {
+        var ranges = {};
+        data.forEach(function (trace) {
+            // fitted to the measurements only, as on the server (see
+            // `get_yaxis_autoscaled_range`), not to the smoothed lines
+            if (trace.name !== MEASUREMENT_TRACE || !trace.x || !trace.y) {
+                return;
+            }
+            var times = traceTimes(trace);
+            var errors = trace.error_y || {};
+            var axis = "yaxis" + (trace.yaxis || "y").slice(1);
+            var range = ranges[axis] || [Infinity, -Infinity];
+            for (var i = 0; i < times.length; i++) {
+                var y = trace.y[i];
+                if (times[i] < start || times[i] > end || y === null) {
+                    continue;
+                }
+                // the min/max of the rollups are error bars
+                var lo = errors.arrayminus ? y - errors.arrayminus[i] : y;
+                var hi = errors.array ? y + errors.array[i] : y;
+                range[0] = Math.min(range[0], lo);
+                range[1] = Math.max(range[1], hi);
+            }
+            ranges[axis] = range;
+        });
+        Object.keys(ranges).forEach(function (axis) {
+            if (ranges[axis][0] > ranges[axis][1]) {
+                // nothing measured in range
+                delete ranges[axis];
+            } else {
+                ranges[axis] = [ranges[axis][0] - margin, ranges[axis][1] + margin];
+            }
+        });
+        return ranges;
+    }
+
+    function setPath(layout, key, value) {
+        // plotly's "magic underscores": yaxis2_range is yaxis2.range
+        var path = key.split("_");
+        var parent = layout;
+        for (var i = 0; i < path.length - 1; i++) {
+            if (typeof parent[path[i]] !== "object" || parent[path[i]] === null) {
+                parent[path[i]] = {};
+            }
+            parent = parent[path[i]];
+        }
+        parent[path[path.length - 1]] = value;
+    }
+
+    // the x-range the user moved the figure of the current view to, if any
+    var userXRange = { key: null, range: undefined };
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        figure: {
+            // The figure of the stats is sent once (the base), together with
+            // what it shows (the view) and a small patch of its layout. The
+            // height, the fill and the y-ranges of the x-range the user panned
+            // to are applied here, to a copy of the base such that the base
+            // can be patched again, without asking the server.
+            apply_patch: function (baseJson, patch, view, relayout, height, checks) {
+                if (!baseJson || !patch || !view) {
+                    return window.dash_clientside.no_update;
+                }
+                var base = parseBase(baseJson);
+                var context = window.dash_clientside.callback_context || {};
+                var triggered = (context.triggered || []).map(function (t) {
+                    return t.prop_id;
+                });
+                if (userXRange.key !== view.key) {
+                    // a new figure, shown as the server set it up
+                    userXRange = { key: view.key, range: undefined };
+                }
+                if (triggered.indexOf("graph_all.relayoutData") !== -1) {
+                    var range = relayoutXRange(relayout);
+                    if (range === undefined) {
+                        return window.dash_clientside.no_update;
+                    }
+                    userXRange.range = range;
+                }
+
+                // plotly writes e.g. the autoranges into the layout it is given
+                var layout = JSON.parse(JSON.stringify(base.layout || {}));
+                Object.keys(patch.layout || {}).forEach(function (key) {
+                    setPath(layout, key, patch.layout[key]);
+                });
+                layout.height = height;
+                if (userXRange.range === null) {
+                    // reset until the server sent the whole figure
+                    layout.xaxis.range = undefined;
+                    layout.xaxis.autorange = true;
+                } else if (userXRange.range !== undefined) {
+                    layout.xaxis.range = userXRange.range;
+                }
+                var fill = (checks || []).indexOf("fill_under") !== -1;
+
+                // the trace arrays are shared with the base
+                var data = (base.data || []).map(function (trace) {
+                    trace = Object.assign({}, trace);
+                    if (fill && trace.name && trace.name.indexOf("Moving") === 0) {
+                        trace.fill = "tozeroy";
+                    }
+                    return trace;
+                });
+
+                if (userXRange.range) {
+                    // fit the y-axes to what is visible now
+                    var ranges = autoscaledYRanges(
+                        data,
+                        toTime(userXRange.range[0]),
+                        toTime(userXRange.range[1]),
+                        patch.y_margin
+                    );
+                    Object.keys(ranges).forEach(function (axis) {
+                        setPath(layout, axis + "_range", ranges[axis]);
+                    });
+                }
+                return { data: data, layout: layout };
+            },
+
+            // Ask the server to refine the traces only if the user moved out
+            // of the x-range the traces are detailed for, or zoomed in so far
+            // that finer details could be shown.
+            refine: function (relayout, view) {
+                var range = relayoutXRange(relayout);
+                if (!view || !view.detail_range || range === undefined) {
+                    return window.dash_clientside.no_update;
+                }
+                if (range !== null) {
+                    var start = toTime(range[0]);
+                    var end = toTime(range[1]);
+                    var detailStart = toTime(view.detail_range[0]);
+                    var detailEnd = toTime(view.detail_range[1]);
+                    if (
+                        start >= detailStart &&
+                        end <= detailEnd &&
+                        // the levels of detail are a factor of 4 apart
+                        (end - start) * 4 > detailEnd - detailStart
+                    ) {
+                        return window.dash_clientside.no_update;
+                    }
+                }
+                return relayout;
+            },
+
+            // The figures are sent as JSON text (see `encode_figure`).
+            parse: function (json) {
+                if (!json) {
+                    return window.dash_clientside.no_update;
+                }
+                return JSON.parse(json);
+            },
+        },
+    });
+})();
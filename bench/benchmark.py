@@ -0,0 +1,489 @@
+"""Timings of the data and figure pipeline.
+
+Run from the root of the repository, all of them or the named ones:
+
+    python -m bench.benchmark [annotations|column_cache|...]
+
+The results are checked by the tests (see tests/), this only times them.
+"""
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from lib.my_plotter import MI_FIT_LABELS, _get_resampled_df, get_plotted_fig_all
+from lib.fixtures import SAMPLE_CSV, make_subplots_figure, measurements, sample_rows
+
+BENCHMARKS = {}
+
+
+def benchmark(f):
+    BENCHMARKS[f.__name__] = f
+    return f
+
+
+def timed(f, repeat=1):
+    """The result of `f()` and the mean seconds it took."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = f()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def as_plotly_figure(fig):
+    # the figures were plotly objects, with the dates of the traces given as
+    # an index
+    import plotly.graph_objects as go
+
+    return go.Figure(
+        dict(fig, data=[dict(t, x=pd.DatetimeIndex(t["x"])) for t in fig["data"]])
+    )
+
+
+@benchmark
+def annotations():
+    import dateutil.parser
+
+    from lib.annotations import AnnotationIndex
+    from lib.my_plotter import _annotation, add_annotations
+
+    df = measurements(365 * 8, start="2020-01-01")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "annotation.csv")
+        dates = pd.date_range("2019-06-01", "2020-12-31", periods=100)
+        with open(path, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["date", "text"])
+            for i, date in enumerate(dates[::-1]):
+                writer.writerow([date.strftime("%Y-%m-%d %H:%M"), f"note {i}"])
+
+        def add_annotations_per_row(fig, xrefs, yrefs):
+            # the file read and parsed once per subplot, one `add_annotation`
+            # per annotation
+            for xref, yref in zip(xrefs, yrefs):
+                with open(path, "r") as f:
+                    reader = csv.reader(f)
+                    next(reader)
+                    for date, text in reader:
+                        date = dateutil.parser.parse(date)
+                        if date >= fig.data[0].x[0]:
+                            fig.add_annotation(**_annotation(date, text, xref, yref))
+
+        index = AnnotationIndex(path)
+        for n_stats in (6, 10):
+            refs = (
+                [f"x{i}" for i in range(1, n_stats + 1)],
+                [f"y{i}" for i in range(1, n_stats + 1)],
+            )
+            timings = {}
+            for name, add in [
+                ("per row", lambda fig: add_annotations_per_row(fig, *refs)),
+                ("index", lambda fig: add_annotations(fig, *refs, index=index)),
+            ]:
+                fig = as_plotly_figure(
+                    get_plotted_fig_all(
+                        df, df, MI_FIT_LABELS[:n_stats], emw_span=24, max_points=2000
+                    )
+                )
+                fig.layout.annotations = ()
+                _, timings[name] = timed(lambda: add(fig))
+            print(
+                f"{n_stats:>2} subplots, {len(dates)} annotations: "
+                f"per row {timings['per row'] * 1000:.0f} ms, "
+                f"index {timings['index'] * 1000:.0f} ms"
+            )
+
+
+@benchmark
+def column_cache():
+    from lib.column_cache import load_measurements_cached
+    from lib.ingest import load_measurements
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in (10_000, 100_000, 1_000_000):
+            csv_name = os.path.join(tmp, f"mifit_{n_rows}.csv")
+            rows = sample_rows(n_rows, step=pd.Timedelta(minutes=10))
+            rows.to_csv(csv_name, index=False)
+            _, t_csv = timed(lambda: load_measurements(csv_name))
+            _, t_cold = timed(lambda: load_measurements_cached(csv_name))
+            _, t_warm = timed(lambda: load_measurements_cached(csv_name))
+            print(
+                f"{n_rows:>9} rows: csv {t_csv * 1000:8.1f} ms | "
+                f"cold (csv + write cache) {t_cold * 1000:8.1f} ms | "
+                f"warm (memmap) {t_warm * 1000:8.1f} ms"
+            )
+
+
+@benchmark
+def dataset_registry():
+    from lib.dataset_registry import DEFAULT_USER, DatasetRegistry
+
+    # three years of a measurement every 4 hours
+    n = 3 * 365 * 6
+    rows = sample_rows(n)
+    n_appended = 50
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_name = os.path.join(tmp, "mifit.csv")
+        rows.iloc[:-n_appended].to_csv(csv_name, index=False)
+        registry = DatasetRegistry(csv_name, os.path.join(tmp, "users"))
+        dataset = registry.dataset(DEFAULT_USER)
+        registry.get(DEFAULT_USER)
+
+        # appends one row at a time, while 4 readers take snapshots
+        done = threading.Event()
+        reads = []
+
+        def read():
+            while not done.is_set():
+                snapshot = registry.get(DEFAULT_USER)
+                snapshot.smoothed_since(["WEIGHT"], 10)
+                snapshot.rollup("week")
+                reads.append(snapshot.data_version)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        _, t_append = timed(
+            lambda: [
+                dataset.append_rows(rows.iloc[[n - n_appended + i]])
+                for i in range(n_appended)
+            ]
+        )
+        done.set()
+        for reader in readers:
+            reader.join()
+        print(
+            f"{n_appended} appends under 4 readers: "
+            f"{t_append / n_appended * 1000:.1f} ms per append, "
+            f"{len(reads)} reads of {len(set(reads))} versions"
+        )
+
+        # readers are served the previous snapshot while the replaced csv is
+        # reloaded in the background
+        appended = registry.get(DEFAULT_USER)
+        rows["WEIGHT"] += 1
+        rows.to_csv(csv_name + ".tmp", index=False)
+        os.replace(csv_name + ".tmp", csv_name)
+        latencies = []
+        start = time.perf_counter()
+        while True:
+            snapshot, latency = timed(lambda: registry.get(DEFAULT_USER))
+            latencies.append(latency)
+            if snapshot.data_version != appended.data_version:
+                break
+            time.sleep(0.001)
+        print(
+            f"reload of {n} rows: {(time.perf_counter() - start) * 1000:.0f} ms "
+            f"in the background, {len(latencies)} reads meanwhile, slowest "
+            f"{max(latencies) * 1000:.1f} ms"
+        )
+
+        # which a reader waited for before
+        rows["WEIGHT"] -= 1
+        rows.to_csv(csv_name + ".tmp", index=False)
+        os.replace(csv_name + ".tmp", csv_name)
+        _, t_wait = timed(lambda: dataset.snapshot(wait=True))
+        print(f"waiting for the reload: {t_wait * 1000:.0f} ms")
+
+
+@benchmark
+def derived():
+    from lib.derived import DERIVED_METRICS, compute_derived
+    from lib.ingest import load_measurements
+    from lib.schema import compact_measurements
+
+    df = compact_measurements(load_measurements(SAMPLE_CSV), report=False)
+    for frame in (df, _get_resampled_df(df)):
+        _, t_all = timed(lambda: compute_derived(frame), repeat=20)
+        _, t_one = timed(lambda: compute_derived(frame, ["FAT_MASS"]), repeat=20)
+        print(
+            f"{len(frame)} rows: {len(DERIVED_METRICS)} metrics "
+            f"{t_all * 1000:.2f} ms, FAT_MASS only {t_one * 1000:.2f} ms"
+        )
+
+
+@benchmark
+def downsample():
+    from lib.downsample import MinMaxPyramid, downsample
+
+    # twenty years of 3-hourly points
+    n = 20 * 365 * 8
+    frame = measurements(n, labels=["WEIGHT"], start="2000-01-01", nan_fraction=0.01)
+    x, y = frame.index, frame["WEIGHT"].to_numpy(dtype=float)
+    pyramid, t_build = timed(lambda: MinMaxPyramid(x, y))
+    print(
+        f"built {len(pyramid.levels)} levels over {n} points in "
+        f"{t_build * 1000:.1f} ms ({pyramid.nbytes} bytes)"
+    )
+    for months in (1, 6, 12 * 5, None):
+        window = (None, None)
+        if months is not None:
+            window = (x[-1] - pd.Timedelta(days=30 * months), x[-1])
+        (xs, _), t_select = timed(lambda: downsample(x, y, window, 2000, pyramid))
+        print(
+            f"{months or 'all':>4} months visible: {len(xs)} of {n} points "
+            f"in {t_select * 1000:.2f} ms"
+        )
+
+
+@benchmark
+def ewm():
+    from lib.ewm import ewm_mean_2d
+
+    # ten years of 3-hourly resampled values
+    frame = measurements(10 * 365 * 8, dtype=float)
+    for n_labels in (1, 6, 10):
+        labels = MI_FIT_LABELS[:n_labels]
+        _, t_pandas = timed(
+            lambda: [frame[label].ewm(span=10).mean() for label in labels], repeat=20
+        )
+        _, t_batched = timed(
+            lambda: ewm_mean_2d(
+                np.vstack([frame[label].to_numpy() for label in labels]), 10, axis=1
+            ),
+            repeat=20,
+        )
+        print(
+            f"{n_labels:>2} labels x {len(frame)} rows: "
+            f"pandas per label {t_pandas * 1000:6.2f} ms, "
+            f"2-D block {t_batched * 1000:6.2f} ms"
+        )
+
+
+@benchmark
+def figure_json():
+    from plotly.utils import PlotlyJSONEncoder
+
+    from lib.figure_json import JSON_ENGINE, encode_figure
+
+    # two years of a measurement every 3 hours
+    df = measurements(2 * 365 * 8)
+    resampled_df = df.resample("1h").mean().interpolate()
+    print(f"json engine: {JSON_ENGINE}")
+    # every point, and downsampled to the last month as the app does
+    x_range = (df.index[-1] - pd.Timedelta(days=30), df.index[-1])
+    for (n_stats, max_points) in [(6, None), (10, None), (6, 2000), (10, 2000)]:
+        fig = get_plotted_fig_all(
+            df,
+            resampled_df,
+            MI_FIT_LABELS[:n_stats],
+            emw_span=24,
+            x_range=x_range if max_points else None,
+            max_points=max_points,
+        )
+        plotly_fig = as_plotly_figure(fig)
+        plotly_json, t_plotly = timed(
+            lambda: json.dumps(plotly_fig, cls=PlotlyJSONEncoder), repeat=5
+        )
+        encoded, t_encoded = timed(lambda: encode_figure(fig), repeat=5)
+        print(
+            f"{n_stats:>2} subplots, {max_points or 'all'} points: "
+            f"plotly {t_plotly * 1000:.0f} ms, {len(plotly_json) / 1024:.0f} KiB; "
+            f"encoded {t_encoded * 1000:.0f} ms, {len(encoded) / 1024:.0f} KiB"
+        )
+
+
+@benchmark
+def http_cache():
+    from lib.figure_cache import window_start
+    from lib.figure_json import encode_figure
+    from lib.http_cache import brotli, compress
+    from lib.my_plotter import get_fig_body_composite_trend, get_xaxis_zoomed_range
+
+    # the responses of the default dashboard (see `construct_page_content`)
+    end = pd.Timestamp.now().floor("3h")
+    df = measurements(2 * 365 * 8, end=end)
+    resampled_df = df.resample("1h").mean().interpolate()
+    labels = ["WEIGHT", "BODY_FAT", "MUSCLE", "BONE_MASS", "MOISTURE", "IMPEDANCE"]
+    since = window_start(30, now=end)
+    stats = encode_figure(
+        get_plotted_fig_all(
+            df.loc[since:],
+            resampled_df.loc[since:],
+            labels,
+            emw_span=24,
+            x_range=get_xaxis_zoomed_range(end, 1)["xaxis_range"],
+            max_points=2000,
+        )
+    )
+    since = window_start(15, now=end)
+    trend = encode_figure(
+        get_fig_body_composite_trend(
+            df.loc[since:],
+            resampled_df.loc[since:],
+            beginning_date=since,
+            trend_smoothing_span=10,
+        )
+    )
+
+    def callback_response(outputs):
+        # how dash wraps the outputs of a callback
+        return json.dumps(
+            {"multi": True, "response": {k: {"data": v} for k, v in outputs.items()}}
+        ).encode()
+
+    responses = {
+        "stats figure": callback_response(
+            {"graph_all_base": stats, "graph_all_view": {"key": "k"}}
+        ),
+        "trend figure": callback_response({"composite_trend_json": trend}),
+    }
+    assets_dir = os.path.join(os.path.dirname(__file__), "..", "assets")
+    for name in sorted(os.listdir(assets_dir)):
+        with open(os.path.join(assets_dir, name), "rb") as f:
+            responses[name] = f.read()
+
+    encodings = ("gzip", "br") if brotli is not None else ("gzip",)
+    totals = dict(raw=0, **{encoding: 0 for encoding in encodings})
+    for name, data in responses.items():
+        line = f"{name:>22}: {len(data) / 1024:7.1f} KiB"
+        totals["raw"] += len(data)
+        for encoding in encodings:
+            compressed, elapsed = timed(lambda: compress(data, encoding))
+            totals[encoding] += len(compressed)
+            line += (
+                f", {encoding} {len(compressed) / 1024:7.1f} KiB "
+                f"({len(compressed) / len(data):.0%}, {elapsed * 1000:.0f} ms)"
+            )
+        print(line)
+    print(
+        f"{'total':>22}: {totals['raw'] / 1024:7.1f} KiB, "
+        + ", ".join(
+            f"{encoding} saves {(totals['raw'] - totals[encoding]) / 1024:.1f} KiB"
+            for encoding in encodings
+        )
+    )
+
+
+@benchmark
+def my_plotter():
+    # two years of a measurement every 3 hours
+    df = measurements(2 * 365 * 8)
+    resampled_df = _get_resampled_df(df)
+    x_range = (df.index[-1] - pd.Timedelta(days=30), df.index[-1])
+    for (n_stats, max_points) in [(6, None), (10, None), (6, 2000), (10, 2000)]:
+        stats_labels = MI_FIT_LABELS[:n_stats]
+        smoothed = {
+            label: resampled_df[label].ewm(span=24).mean() for label in stats_labels
+        }
+        fig_dict, t_dict = timed(
+            lambda: get_plotted_fig_all(
+                df,
+                resampled_df,
+                stats_labels,
+                emw_span=24,
+                smoothed=smoothed,
+                x_range=x_range if max_points else None,
+                max_points=max_points,
+            )
+        )
+        # the traces as plotly objects, added to make_subplots' figure
+        _, t_objects = timed(lambda: make_subplots_figure(fig_dict, stats_labels))
+        print(
+            f"{n_stats:>2} subplots, {max_points or 'all'} points: "
+            f"make_subplots {t_objects * 1000:.0f} ms, dict {t_dict * 1000:.0f} ms"
+        )
+
+
+@benchmark
+def range_index():
+    from lib.range_index import RangeExtrema
+
+    rng = np.random.default_rng(0)
+    for n in (10 * 365 * 2, 100_000):
+        frame = measurements(n, labels=["WEIGHT"], start="1980-01-01", nan_fraction=0.2)
+        x, y = frame.index, frame["WEIGHT"].to_numpy(dtype=float)
+        index, t_build = timed(lambda: RangeExtrema(x, y))
+        windows = np.sort(rng.integers(0, n, (1000, 2)), axis=1)
+        _, t_index = timed(lambda: [index.min_max(x[i0], x[i1]) for i0, i1 in windows])
+        _, t_slice = timed(
+            lambda: [
+                (np.nanmin(y[i0:i1]), np.nanmax(y[i0:i1]))
+                for i0, i1 in windows
+                if np.isfinite(y[i0:i1]).any()
+            ]
+        )
+        print(
+            f"{n} values indexed in {t_build * 1000:.2f} ms "
+            f"({index.nbytes} bytes); per window: index "
+            f"{t_index / len(windows) * 1e6:.1f} us, nanmin/nanmax of the "
+            f"slice {t_slice / len(windows) * 1e6:.1f} us"
+        )
+
+
+@benchmark
+def resample():
+    from lib.ingest import load_measurements
+    from lib.resample import IncrementalResampler
+
+    df = load_measurements(SAMPLE_CSV)
+    # grow the frame one measurement at a time
+    n_initial = len(df) // 2
+    resampler = IncrementalResampler(df.iloc[:n_initial])
+    t_incremental = t_full = 0.0
+    for n in range(n_initial + 1, len(df) + 1):
+        t_incremental += timed(lambda: resampler.extend(df.iloc[:n]))[1]
+        t_full += timed(lambda: _get_resampled_df(df.iloc[:n]))[1]
+    n_appends = len(df) - n_initial
+    print(
+        f"{n_appends} appends: incremental "
+        f"{t_incremental / n_appends * 1000:.2f} ms, "
+        f"full {t_full / n_appends * 1000:.2f} ms per append"
+    )
+
+
+@benchmark
+def rollup():
+    from lib.rollup import ROLLUP_FREQS, Rollup, compute_rollup
+
+    # ten years of about three measurements a day
+    n = 10 * 365 * 3
+    df = measurements(n, freq="8h", start="2012-01-01", irregular=True, dtype=float)
+    n_initial = n - 100
+    for freq in ROLLUP_FREQS:
+        rollup = Rollup(df.iloc[:n_initial], MI_FIT_LABELS, freq)
+        _, t_extend = timed(
+            lambda: [
+                rollup.extend(df.iloc[: i + 1], df.index[i])
+                for i in range(n_initial, n)
+            ]
+        )
+        full, t_full = timed(lambda: compute_rollup(df, MI_FIT_LABELS, freq))
+        print(
+            f"{freq:>5}: {n} measurements -> {len(full)} rows; "
+            f"full {t_full * 1000:.1f} ms, "
+            f"per append {t_extend / (n - n_initial) * 1000:.1f} ms"
+        )
+
+
+@benchmark
+def sqlite_store():
+    from lib.sqlite_store import MeasurementDB
+
+    rows = sample_rows(100_000, step=pd.Timedelta(minutes=10))
+    with tempfile.TemporaryDirectory() as tmp:
+        db = MeasurementDB(os.path.join(tmp, "measurements.db"))
+        _, t_replace = timed(lambda: db.replace_user("a", rows.iloc[:-1000]))
+        _, t_insert = timed(lambda: db.insert_new("a", rows.iloc[-2000:]))
+        print(
+            f"replace with {len(rows) - 1000} rows {t_replace * 1000:.0f} ms; "
+            f"insert 2000 rows (1000 new) {t_insert * 1000:.0f} ms"
+        )
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            sys.exit(f"unknown benchmark '{name}', one of {', '.join(BENCHMARKS)}")
+        print(f"== {name}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
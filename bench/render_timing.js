@@ -0,0 +1,74 @@
+// Measure how long a figure takes to render a frame while it is panned. Not
+// served with the dashboard (as the assets are): paste it into the browser's
+// console of the running dashboard, then e.g.
+//
+//     measureRenderTime("graph_all").then(console.table)
+//
+// The x-range is panned by `step` of its width per frame, `frames` times (and
+// back), the way dragging it would. Each frame is timed from the relayout
+// until the browser painted it, so the clientside callbacks that follow a
+// pan (see figure_patch.js) are included.
+window.measureRenderTime = function (graphId, frames, step) {
+    frames = frames || 30;
+    step = step || 0.01;
+    var gd = document.getElementById(graphId);
+    if (gd && !gd.classList.contains("js-plotly-plot")) {
+        gd = gd.querySelector(".js-plotly-plot");
+    }
+    if (!gd || !gd._fullLayout) {
+        return Promise.reject(new Error("no plotted figure with id " + graphId));
+    }
+    var xaxis = gd._fullLayout.xaxis;
+    var start = xaxis.range.map(xaxis.r2l);
+    var width = start[1] - start[0];
+
+    function nextPaint() {
+        return new Promise(function (resolve) {
+            requestAnimationFrame(function () {
+                requestAnimationFrame(resolve);
+            });
+        });
+    }
+
+    var times = [];
+    var frame = 0;
+
+    function panOnce() {
+        if (frame >= 2 * frames) {
+            return Promise.resolve();
+        }
+        // there and back again
+        var offset = (frame < frames ? frame + 1 : 2 * frames - frame - 1) * step * width;
+        frame++;
+        var t0 = performance.now();
+        return Plotly.relayout(gd, {
+            "xaxis.range": [xaxis.l2r(start[0] + offset), xaxis.l2r(start[1] + offset)],
+        })
+            .then(nextPaint)
+            .then(function () {
+                times.push(performance.now() - t0);
+                return panOnce();
+            });
+    }
+
+    return panOnce().then(function () {
+        var sorted = times.slice().sort(function (a, b) {
+            return a - b;
+        });
+        var types = {};
+        var points = 0;
+        gd.data.forEach(function (trace) {
+            types[trace.type || "scatter"] = (types[trace.type || "scatter"] || 0) + 1;
+            points += trace.x ? trace.x.length : 0;
+        });
+        return {
+            frames: times.length,
+            points: points,
+            traces: JSON.stringify(types),
+            mean_ms: times.reduce(function (a, b) { return a + b; }, 0) / times.length,
+            median_ms: sorted[Math.floor(sorted.length / 2)],
+            p95_ms: sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * 0.95))],
+            max_ms: sorted[sorted.length - 1],
+        };
+    });
+};
@@ -0,0 +1,82 @@
+"""Index of the annotations shown on the figures.
+
+The annotations are read from a csv of (date, text) rows with a header. The
+file is parsed once per version (see `FileVersion`) into a sorted datetime64
+array, such that the annotations within a time range are found by binary
+search instead of reading and parsing the file for every subplot.
+"""
+import csv
+import threading
+
+import dateutil.parser
+import numpy as np
+import pandas as pd
+
+from .data_version import FileVersion
+
+ANNOTATION_CSV = "data/annotation.csv"
+
+
+class AnnotationIndex:
+    def __init__(self, path=ANNOTATION_CSV):
+        self.path = path
+        self.file_version = FileVersion(path)
+        self._loaded_version = None
+        self._lock = threading.Lock()
+        # (dates, texts), swapped as a whole on reloads
+        self._entries = (
+            np.array([], dtype="datetime64[ns]"),
+            np.array([], dtype=object),
+        )
+
+    @property
+    def version(self):
+        """The version of the annotation file, figures with annotations are
+        cached under it."""
+        return self.file_version.current()
+
+    def _reload_if_changed(self):
+        version = self.file_version.current()
+        if version == self._loaded_version:
+            return
+        with self._lock:
+            if version == self._loaded_version:
+                return
+            dates, texts = [], []
+            try:
+                with open(self.path, "r") as f:
+                    reader = csv.reader(f)
+                    next(reader, None)
+                    for date, text in reader:
+                        dates.append(dateutil.parser.parse(date))
+                        texts.append(text)
+            except FileNotFoundError:
+                pass
+            dates = np.array(dates, dtype="datetime64[ns]")
+            order = np.argsort(dates, kind="stable")
+            self._entries = (dates[order], np.array(texts, dtype=object)[order])
+            self._loaded_version = version
+
+    def between(self, start=None, end=None):
+        """The (dates, texts) of the annotations in [start, end] (None for
+        unbounded), sorted by date."""
+        self._reload_if_changed()
+        dates, texts = self._entries
+        lo = 0 if start is None else dates.searchsorted(_datetime64(start), "left")
+        hi = len(dates) if end is None else dates.searchsorted(_datetime64(end), "right")
+        return dates[lo:hi], texts[lo:hi]
+
+
+def _datetime64(date):
+    return pd.Timestamp(date).to_datetime64()
+
+
+_indexes = {}
+
+
+def annotation_index(path=ANNOTATION_CSV):
+    """The (shared) index of the annotations in `path`."""
+    index = _indexes.get(path)
+    if index is None:
+        index = _indexes.setdefault(path, AnnotationIndex(path))
+    return index
@@ -0,0 +1,153 @@
+"""Typed columnar cache of the parsed measurement table.
+
+The parsed DataFrame is stored next to the csv as one `.npy` file per column
+(plus the datetime index), and loaded back by memory-mapping those files
+instead of re-parsing the csv text. Object (string) and categorical columns
+are stored as integer codes with their categories kept in the metadata file.
+The cache is tied to the size and mtime of the csv and regenerated whenever
+those change.
+"""
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .ingest import load_measurements
+from .schema import compact_measurements
+
+_CACHE_FORMAT = 2
+_META_FILE = "meta.json"
+_INDEX_FILE = "__index__.npy"
+
+
+def get_cache_dir(csv_name):
+    dirname, basename = os.path.split(csv_name)
+    return os.path.join(dirname, f".{basename}.columns")
+
+
+def _source_key(csv_name):
+    st = os.stat(csv_name)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_measurements_cached(csv_name, compact=False):
+    """Same as `load_measurements(csv_name)` (followed by
+    `compact_measurements` if `compact`), but served from the columnar cache
+    when it is up-to-date with the csv, and (re)building it otherwise."""
+    source_key = _source_key(csv_name)
+    df = read_column_cache(csv_name, source_key, compact)
+    if df is None:
+        df = load_measurements(csv_name)
+        if compact:
+            df = compact_measurements(df)
+        try:
+            write_column_cache(csv_name, df, source_key, compact)
+        except (OSError, ValueError) as e:
+            # the cache is only an optimisation
+            print(f"Not caching {csv_name}: {e}")
+    return df
+
+
+def read_column_cache(csv_name, source_key=None, compact=False):
+    """Return the cached DataFrame, or None if there is no valid cache."""
+    cache_dir = get_cache_dir(csv_name)
+    try:
+        with open(os.path.join(cache_dir, _META_FILE), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if source_key is None:
+        source_key = _source_key(csv_name)
+    if (
+        meta.get("format") != _CACHE_FORMAT
+        or meta.get("source") != source_key
+        or meta.get("compact") != compact
+    ):
+        return None
+
+    try:
+        index = np.load(os.path.join(cache_dir, _INDEX_FILE), mmap_mode="r")
+        columns = {}
+        for i, (name, col_meta) in enumerate(zip(meta["columns"], meta["dtypes"])):
+            values = np.load(os.path.join(cache_dir, f"{i}.npy"), mmap_mode="r")
+            if col_meta["kind"] == "codes":
+                categories = np.array(col_meta["categories"], dtype=object)
+                values = _decode(values, categories)
+            elif col_meta["kind"] == "category":
+                values = pd.Categorical.from_codes(values, col_meta["categories"])
+            columns[name] = values
+    except (OSError, ValueError):
+        return None
+
+    df = pd.DataFrame(columns, columns=meta["columns"])
+    df.index = pd.DatetimeIndex(
+        np.asarray(index).view("datetime64[ns]"), name=meta["index_name"]
+    )
+    return df
+
+
+def write_column_cache(csv_name, df, source_key=None, compact=False):
+    """Write `df` as the columnar cache of `csv_name`.
+
+    The files are written to a temporary directory which is then moved into
+    place, such that readers never see a partially written cache."""
+    if source_key is None:
+        source_key = _source_key(csv_name)
+    cache_dir = get_cache_dir(csv_name)
+    tmp_dir = f"{cache_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        dtypes = []
+        for i, name in enumerate(df.columns):
+            values, col_meta = _encode(df[name])
+            np.save(os.path.join(tmp_dir, f"{i}.npy"), values)
+            dtypes.append(col_meta)
+        np.save(
+            os.path.join(tmp_dir, _INDEX_FILE),
+            df.index.values.astype("datetime64[ns]").view(np.int64),
+        )
+        meta = dict(
+            format=_CACHE_FORMAT,
+            source=source_key,
+            compact=compact,
+            columns=list(df.columns),
+            dtypes=dtypes,
+            index_name=df.index.name,
+        )
+        with open(os.path.join(tmp_dir, _META_FILE), "w") as f:
+            json.dump(meta, f)
+
+        old_dir = f"{tmp_dir}.old"
+        if os.path.exists(cache_dir):
+            os.rename(cache_dir, old_dir)
+        os.rename(tmp_dir, cache_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _encode(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        kind = "category"
+        codes = series.cat.codes.to_numpy()
+    elif series.dtype == object:
+        codes, categories = pd.factorize(series)
+        kind = "codes"
+    else:
+        return series.to_numpy(), dict(kind="array")
+    if not all(isinstance(c, str) for c in categories):
+        raise ValueError(f"column {series.name} has non-string objects")
+    return codes.astype(np.int32), dict(kind=kind, categories=list(categories))
+
+
+def _decode(codes, categories):
+    values = np.empty(len(codes), dtype=object)
+    values[:] = np.nan
+    valid = codes >= 0
+    values[valid] = categories[codes[valid]]
+    return values
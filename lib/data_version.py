@@ -0,0 +1,229 @@
+"""Cheap change detection for the data files.
+
+A `FileVersion` keeps a version counter for one file. Checking it is O(1) when
+the file is being watched with inotify (the counter only needs attention after
+the watcher has seen a write), and a single `os.stat` otherwise. The content
+is only hashed when the stat metadata is ambiguous, i.e. the size is unchanged
+but the mtime/inode differ, or the last recorded mtime was too close to the
+time it was recorded to tell two writes apart. In the latter case it is
+hashed once for that stat, and once more when the mtime can be trusted, which
+sees a second write that left the stat unchanged.
+"""
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+
+from .utils import md5
+
+# mtime that is this close to the time we recorded it is not trusted, as a
+# second write within the timestamp granularity would leave it unchanged
+_RACY_MTIME_WINDOW_NS = 2 * 10 ** 9
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _is_racy(key):
+    return key is not None and time.time_ns() - key[0] < _RACY_MTIME_WINDOW_NS
+
+
+class FileVersion:
+    def __init__(self, path, watch=True):
+        self.path = path
+        self._version = 0
+        self._stat_key = None
+        self._digest = None
+        self._racy = False
+        # start dirty such that the first check records the file state
+        self._dirty = True
+        self._lock = threading.Lock()
+        self._watcher = None
+        if watch:
+            self._watcher = InotifyWatcher.for_file(
+                path, self.invalidate, self._unwatch
+            )
+
+    @property
+    def watched(self):
+        return self._watcher is not None
+
+    def invalidate(self):
+        """Mark the file as possibly changed, the next check will stat it."""
+        self._dirty = True
+
+    def _unwatch(self):
+        # changes may have been missed, and are not seen from now on
+        self._watcher = None
+        self.invalidate()
+
+    def current(self):
+        """Return the version counter of the file, bumping it if the file has
+        changed since the last check."""
+        if self._watcher is not None and not self._dirty and not self._racy:
+            return self._version
+        with self._lock:
+            self._dirty = False
+            key = _stat_key(self.path)
+            if key != self._stat_key:
+                if self._content_changed(key):
+                    self._version += 1
+                self._record(key)
+            elif self._racy and not _is_racy(key):
+                # the mtime is trusted from now on, a last look at the content
+                # for writes that left the stat as it was
+                if self._digest is not None and md5(self.path) != self._digest:
+                    self._version += 1
+                self._record(key)
+            return self._version
+
+    def acknowledge(self):
+        """Record a write that was made by this process (e.g. an append that
+        was already merged in memory) and return the new version. The content
+        is not hashed, the file is as we wrote it."""
+        with self._lock:
+            self._dirty = False
+            self._version += 1
+            self._digest = None
+            self._record(_stat_key(self.path), digest=False)
+            return self._version
+
+    def _content_changed(self, key):
+        if self._stat_key is None or key is None:
+            # file appeared or disappeared
+            return True
+        if key[1] != self._stat_key[1]:
+            # size differs, no need to look at the content
+            self._digest = None
+            return True
+        # same size but different mtime/inode (or untrusted mtime): hash it
+        digest = md5(self.path)
+        changed = self._digest is None or digest != self._digest
+        self._digest = digest
+        return changed
+
+    def _record(self, key, digest=True):
+        self._stat_key = key
+        self._racy = _is_racy(key)
+        if self._racy and self._digest is None and digest:
+            # keep a digest to compare against while the mtime is untrusted
+            self._digest = md5(self.path)
+
+
+class InotifyWatcher:
+    """Watch the directories of files with inotify and call a callback
+    whenever one of the files is written, replaced or removed.
+
+    The directories are watched (rather than the files) such that atomic
+    replacement by rename is seen as well. One inotify instance, read by one
+    thread, is shared by all files of the process, with one watch per
+    directory. Only available on Linux; elsewhere `for_file` returns None and
+    callers fall back to stat checks."""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    # events may have been lost
+    IN_Q_OVERFLOW = 0x00004000
+    # the watch was removed, e.g. as the directory was deleted or unmounted
+    IN_IGNORED = 0x00008000
+    _MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    _libc = None
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def for_file(cls, path, callback, lost):
+        """Call `callback` whenever the file at `path` changes, and `lost` if
+        its changes can no longer be told (the events overflowed the queue,
+        or the watch of its directory was removed); nothing is called for it
+        after that. Returns the shared watcher, or None if the file cannot
+        be watched."""
+        try:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+                cls._instance.watch(path, callback, lost)
+                return cls._instance
+        except OSError:
+            return None
+
+    def __init__(self):
+        self._fd = self._load_libc().inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> file name -> [(callback, lost), ...]
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def watch(self, path, callback, lost):
+        dirname = os.path.dirname(os.path.abspath(path))
+        filename = os.fsencode(os.path.basename(path))
+        with self._lock:
+            # the same descriptor for every file of the directory
+            wd = self._load_libc().inotify_add_watch(
+                self._fd, os.fsencode(dirname), self._MASK
+            )
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"cannot watch {dirname}")
+            files = self._watches.setdefault(wd, {})
+            files.setdefault(filename, []).append((callback, lost))
+
+    @classmethod
+    def _load_libc(cls):
+        if cls._libc is None:
+            name = ctypes.util.find_library("c")
+            if name is None:
+                raise OSError("libc not found")
+            libc = ctypes.CDLL(name, use_errno=True)
+            if not hasattr(libc, "inotify_init1"):
+                raise OSError("inotify is not available")
+            cls._libc = libc
+        return cls._libc
+
+    def _run(self):
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except OSError:
+                return
+            self._handle(buf)
+
+    def _handle(self, buf):
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, name_len = self._EVENT_HEADER.unpack_from(buf, offset)
+            offset += self._EVENT_HEADER.size
+            name = buf[offset : offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if mask & (self.IN_Q_OVERFLOW | self.IN_IGNORED):
+                # the files have no name in these events; every file of the
+                # watch (all of them on an overflow) falls back to stat checks
+                with self._lock:
+                    if mask & self.IN_Q_OVERFLOW:
+                        lost = list(self._watches.values())
+                        self._watches.clear()
+                    else:
+                        lost = [self._watches.pop(wd, {})]
+                for files in lost:
+                    for watchers in files.values():
+                        for _, on_lost in watchers:
+                            on_lost()
+                continue
+            with self._lock:
+                watchers = list(self._watches.get(wd, {}).get(name, ()))
+            for callback, _ in watchers:
+                callback()
@@ -0,0 +1,634 @@
+"""Per-user partitions of the measurement data.
+
+Each user's measurements are stored as their own csv partition. The default
+user keeps the original `data/mifit.csv`, every other user lives in
+`<users_dir>/<user>/mifit.csv`. Loaded datasets (raw, resampled frames and
+what is derived from them) sit in a bounded LRU with memory accounting, such
+that one user's upload or reload only invalidates that user's caches. The
+data of a dataset is published as immutable snapshots, a reload builds the
+next one while requests keep reading the previous one.
+
+With a `MeasurementDB` the partitions are mirrored into SQLite and windowed
+views are queried from there instead of slicing the whole loaded history.
+"""
+import copy
+import functools
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from .column_cache import load_measurements_cached
+from .data_version import FileVersion
+from .derived import (
+    DERIVED_INPUTS,
+    DERIVED_METRICS,
+    WEEK,
+    compute_derived,
+    derived_column,
+)
+from .downsample import PyramidCache
+from .ingest import drop_known_rows, append_rows_to_csv, merge_rows
+from .ewm import EwmCache
+from .my_plotter import MI_FIT_LABELS, _get_resampled_df
+from .range_index import RangeExtrema
+from .resample import IncrementalResampler, _resampled_columns
+from .rollup import Rollup, bucket_start
+from .schema import compact_measurements
+from .utils import build_index_engines, get_df_after_given_date
+
+DEFAULT_USER = "default"
+# series that can be smoothed besides the columns of the resampled frame
+SMOOTHED_DERIVED = {
+    name: functools.partial(derived_column, name=name)
+    for name, metric in DERIVED_METRICS.items()
+    if metric.rowwise
+}
+
+_VALID_USER = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$")
+
+
+def _rollup_since(rollup, since):
+    if since is None:
+        return rollup.table
+    return rollup.table.loc[rollup.table.index >= bucket_start(since, rollup.freq)]
+
+
+def frame_nbytes(df):
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class DataSnapshot:
+    """One version of the measurements of one user: the raw and resampled
+    frames, and what is computed from them (on first use).
+
+    Snapshots are built off to the side by their `Dataset` and published with
+    a single reference swap; their frames are never changed afterwards. A
+    request takes one snapshot (see `DatasetRegistry.get`) and reads all of
+    its data from it, so it sees one version, even if the data is reloaded
+    meanwhile."""
+
+    def __init__(
+        self,
+        user,
+        df=None,
+        resampler=None,
+        data_version=0,
+        file_version=None,
+        ewm_cache=None,
+        rollups=None,
+    ):
+        self.user = user
+        self.df = df
+        # keeps the resampled frame, and is extended for the next snapshot
+        self.resampler = resampler
+        self.resampled_df = resampler.resampled_df if resampler is not None else None
+        for frame in (self.df, self.resampled_df):
+            if frame is not None:
+                build_index_engines(frame)
+        # incremented whenever the data changes, figures are cached under it
+        self.data_version = data_version
+        # the version of the csv the data was loaded from (None if unloaded)
+        self.file_version = file_version
+        self._frames_nbytes = frame_nbytes(self.df) + frame_nbytes(self.resampled_df)
+        # moving averages of the resampled frame, per (column, span)
+        if ewm_cache is None:
+            ewm_cache = EwmCache(
+                max_entries=4 * len(MI_FIT_LABELS), derived=SMOOTHED_DERIVED
+            )
+        self.ewm_cache = ewm_cache
+        # downsampling pyramids of the plotted whole-history series
+        self.pyramids = PyramidCache(max_entries=4 * len(MI_FIT_LABELS))
+        # range min/max indexes of the measurements, per label
+        self._range_extrema = {}
+        # derived metrics of the raw and resampled frames
+        self._derived = None
+        # rollup tables by granularity
+        self._rollups = dict(rollups or {})
+        # the last measurement (shown on the cards)
+        self._latest = None
+        # guards the caches; reloads do not take it
+        self.lock = threading.RLock()
+
+    @property
+    def loaded(self):
+        return self.df is not None
+
+    @property
+    def nbytes(self):
+        return (
+            self._frames_nbytes
+            + self.ewm_cache.nbytes()
+            + self.pyramids.nbytes()
+            + sum(index.nbytes for index in list(self._range_extrema.values()))
+            + sum(frame_nbytes(frame) for frame in self._derived or ())
+            + sum(rollup.nbytes for rollup in list(self._rollups.values()))
+        )
+
+    def frames_since(self, since=None, columns=None):
+        """Return the raw and resampled frames from `since` onwards (the whole
+        history if None). `columns` are the columns that will be read, which
+        backends may use to load only those."""
+        if since is None:
+            return self.df, self.resampled_df
+        return (
+            get_df_after_given_date(self.df, since),
+            get_df_after_given_date(self.resampled_df, since),
+        )
+
+    def smoothed_since(self, columns, span, since=None):
+        """Map `columns` to their moving average with the given span, computed
+        over the whole resampled history and sliced from `since` onwards."""
+        with self.lock:
+            smoothed = self.ewm_cache.means(self.resampled_df, columns, span)
+        if since is not None:
+            smoothed = {
+                column: get_df_after_given_date(series, since)
+                for column, series in smoothed.items()
+            }
+        return smoothed
+
+    def derived_since(self, names, since=None):
+        """Return the derived metrics `names` (see `DERIVED_METRICS`) of the
+        raw and resampled frames from `since` onwards. Each metric is computed
+        when it is first asked for, once per version."""
+        derived = self._derived
+        if derived is None or not set(names) <= set(derived[0].columns):
+            with self.lock:
+                derived = self._derived
+                missing = [
+                    name
+                    for name in names
+                    if derived is None or name not in derived[0].columns
+                ]
+                if missing:
+                    computed = (
+                        compute_derived(self.df, missing),
+                        compute_derived(self.resampled_df, missing),
+                    )
+                    if derived is not None:
+                        computed = tuple(
+                            pd.concat([frame, new], axis=1)
+                            for frame, new in zip(derived, computed)
+                        )
+                    for frame in computed:
+                        build_index_engines(frame)
+                    derived = self._derived = computed
+        # metrics whose inputs the frames lack are left out
+        derived = tuple(
+            frame[[name for name in names if name in frame.columns]]
+            for frame in derived
+        )
+        if since is None:
+            return derived
+        return tuple(get_df_after_given_date(frame, since) for frame in derived)
+
+    def rollup(self, freq, since=None):
+        """Return the rollup table (see `compute_rollup`) at granularity `freq`
+        of the buckets from the one containing `since` onwards."""
+        rollup = self._rollups.get(freq)
+        if rollup is None:
+            with self.lock:
+                rollup = self._rollups.get(freq)
+                if rollup is None:
+                    rollup = self._rollups[freq] = Rollup(
+                        self.df, _resampled_columns(self.df), freq
+                    )
+        return _rollup_since(rollup, since)
+
+    def y_range(self, label, start=None, end=None):
+        """(min, max) of the measurements of `label` with start <= time < end
+        (None for unbounded), NaN if there are none."""
+        index = self._range_extrema.get(label)
+        if index is None:
+            with self.lock:
+                index = self._range_extrema.get(label)
+                if index is None:
+                    index = self._range_extrema[label] = RangeExtrema(
+                        self.df.index, self.df[label]
+                    )
+        return index.min_max(start, end)
+
+    def latest(self):
+        """The last measurement, None if there is none."""
+        if self._latest is None and len(self.df):
+            self._latest = self.df.iloc[-1]
+        return self._latest
+
+    def carried_over(self):
+        """The caches that the next snapshot starts from (and updates by
+        itself): the moving averages and the rollup tables."""
+        with self.lock:
+            return self.ewm_cache.copy(), dict(self._rollups)
+
+
+class Dataset:
+    """The measurements of one user, loaded lazily from its csv partition.
+
+    The data is read from the current `snapshot()`. Reloads and appends (one
+    at a time, under `lock`) build the next snapshot from the previous one
+    and publish it once it is complete."""
+
+    def __init__(self, user, csv_name):
+        self.user = user
+        self.csv_name = csv_name
+        self.file_version = FileVersion(csv_name)
+        self.lock = threading.RLock()
+        self._snapshot = self._new_snapshot()
+        self._reloading = False
+        self._reloading_lock = threading.Lock()
+        # called with the dataset once a background reload is published
+        self.on_reload = None
+
+    def _new_snapshot(self, **kwargs):
+        return DataSnapshot(self.user, **kwargs)
+
+    @property
+    def loaded(self):
+        return self._snapshot.loaded
+
+    @property
+    def nbytes(self):
+        return self._snapshot.nbytes
+
+    @property
+    def data_version(self):
+        return self._snapshot.data_version
+
+    @property
+    def loaded_version(self):
+        return self._snapshot.file_version
+
+    def snapshot(self, wait=False):
+        """The current snapshot of the data. If the csv has changed since it
+        was loaded, it is reloaded in a background thread and the previous
+        snapshot is returned meanwhile, unless `wait` (or nothing is loaded
+        yet), in which case it is reloaded first."""
+        snapshot = self._snapshot
+        # O(1) unless the file was touched
+        if self.file_version.current() == snapshot.file_version:
+            return snapshot
+        if wait or snapshot.file_version is None:
+            self.reload_if_changed()
+            return self._snapshot
+        with self._reloading_lock:
+            if not self._reloading:
+                self._reloading = True
+                threading.Thread(target=self._reload_in_background, daemon=True).start()
+        return snapshot
+
+    def _reload_in_background(self):
+        try:
+            reloaded = self.reload_if_changed()
+        finally:
+            with self._reloading_lock:
+                self._reloading = False
+        if reloaded and self.on_reload is not None:
+            self.on_reload(self)
+
+    def reload_if_changed(self):
+        """Reload the frames if the csv has changed since they were loaded.
+        Returns True if a reload happened."""
+        # O(1) unless the file was touched
+        if self.file_version.current() == self.loaded_version:
+            return False
+        with self.lock:
+            version = self.file_version.current()
+            if version == self.loaded_version:
+                # reloaded by another thread while we were waiting
+                return False
+            df = load_measurements_cached(self.csv_name, compact=True)
+            self._set_frames(df, version)
+            return True
+
+    def append_rows(self, new_df):
+        """Append the rows of `new_df` that are not stored yet to the csv, and
+        merge them into the loaded frames without a full reload. Returns the
+        rows that were appended."""
+        with self.lock:
+            if os.path.exists(self.csv_name):
+                self.reload_if_changed()
+            df = self._snapshot.df
+            new_df = drop_known_rows(df, new_df)
+            if len(new_df):
+                # cast and merged before anything is written, such that rows
+                # that do not fit the stored dtypes raise and leave the csv
+                # as it is
+                if df is None or len(df) == 0:
+                    merged = compact_measurements(new_df, report=False)
+                else:
+                    merged = merge_rows(df, new_df)
+                os.makedirs(os.path.dirname(self.csv_name) or ".", exist_ok=True)
+                append_rows_to_csv(self.csv_name, new_df)
+                self._set_frames(
+                    merged,
+                    self.file_version.acknowledge(),
+                    appended_since=new_df.index.min(),
+                )
+        return new_df
+
+    def unload(self):
+        with self.lock:
+            # requests that hold the loaded snapshot keep reading it
+            self._publish()
+
+    def _set_frames(self, df, version, appended_since=None):
+        """Publish a snapshot of the frame `df`. If `appended_since` is given,
+        `df` is the loaded frame with rows from (at the earliest) that time
+        appended, and only the tails of the resampled frame, the moving
+        averages and the rollups are updated."""
+        previous = self._snapshot
+        ewm_cache, rollups = previous.carried_over()
+        if appended_since is not None and previous.resampler is not None:
+            # extended on a copy, the previous snapshot keeps its frame
+            resampler = copy.copy(previous.resampler)
+            resampler.extend(df)
+        else:
+            resampler = IncrementalResampler(df)
+        if appended_since is not None:
+            rollups = {
+                freq: _extended_rollup(rollup, df, appended_since)
+                for freq, rollup in rollups.items()
+            }
+        else:
+            rollups = None
+        if resampler.changed_from is not None:
+            ewm_cache.extend(resampler.resampled_df, resampler.changed_from)
+        else:
+            ewm_cache.clear()
+        self._publish(
+            df=df,
+            resampler=resampler,
+            file_version=version,
+            ewm_cache=ewm_cache,
+            rollups=rollups,
+        )
+
+    def _publish(self, **kwargs):
+        # one reference swap, requests take either snapshot as a whole
+        self._snapshot = self._new_snapshot(
+            data_version=self._snapshot.data_version + 1, **kwargs
+        )
+
+
+def _extended_rollup(rollup, df, since):
+    # extended on a copy, the previous snapshot keeps its table
+    rollup = copy.copy(rollup)
+    rollup.extend(df, since)
+    return rollup
+
+
+class SqliteSnapshot(DataSnapshot):
+    """A snapshot of a dataset that is mirrored into a `MeasurementDB`.
+
+    Windowed frames are range queries on the database (projected to the
+    requested columns), so the whole history is only held in memory when it
+    is plotted as a whole; it is then loaded into the snapshot once. Every
+    query is bounded by the `generation` of the user's rows at the time the
+    snapshot was published, so appends made meanwhile are not seen. A
+    replaced partition (a reload of a rewritten csv) is not kept: snapshots
+    published before it find none of its rows."""
+
+    def __init__(self, user, db, generation=None, **kwargs):
+        super().__init__(user, **kwargs)
+        self.db = db
+        self.generation = generation
+
+    def frames_since(self, since=None, columns=None):
+        if since is None:
+            if self.df is None:
+                with self.lock:
+                    if self.df is None:
+                        df = self.db.query_df(
+                            self.user, MI_FIT_LABELS, generation=self.generation
+                        )
+                        df = build_index_engines(
+                            compact_measurements(df, report=False)
+                        )
+                        # the same version of the data, loaded as a whole
+                        self.resampler = IncrementalResampler(df)
+                        self.resampled_df = self.resampler.resampled_df
+                        self._frames_nbytes = frame_nbytes(df) + frame_nbytes(
+                            self.resampled_df
+                        )
+                        self.df = df
+            return self.df, self.resampled_df
+        columns = list(columns) if columns is not None else MI_FIT_LABELS
+        # start from the last measurement before the window, such that the
+        # resampled series is interpolated into the beginning of the window
+        start = self.db.last_before(self.user, since, self.generation)
+        df = self.db.query_df(
+            self.user,
+            columns,
+            start=pd.Timestamp(start, unit="ms") if start is not None else None,
+            generation=self.generation,
+        )
+        return (
+            get_df_after_given_date(df, since),
+            get_df_after_given_date(_get_resampled_df(df), since),
+        )
+
+    def smoothed_since(self, columns, span, since=None):
+        if since is not None:
+            # windows are not kept in memory, they are smoothed when plotted
+            return None
+        self.frames_since(None)
+        return super().smoothed_since(columns, span)
+
+    def derived_since(self, names, since=None):
+        if since is None:
+            self.frames_since(None)
+            return super().derived_since(names)
+        # computed for the queried window only, and the week before it which
+        # the weekly changes look back to
+        return tuple(
+            get_df_after_given_date(compute_derived(frame, names), since)
+            for frame in self.frames_since(since - WEEK, columns=DERIVED_INPUTS)
+        )
+
+    def rollup(self, freq, since=None):
+        if self.df is not None:
+            return super().rollup(freq, since)
+        rollup = self._rollups.get(freq)
+        if rollup is None:
+            # rolled up from the database, without keeping the history loaded
+            with self.lock:
+                rollup = self._rollups.get(freq)
+                if rollup is None:
+                    df = self.db.query_df(
+                        self.user, MI_FIT_LABELS, generation=self.generation
+                    )
+                    rollup = self._rollups[freq] = Rollup(df, MI_FIT_LABELS, freq)
+        return _rollup_since(rollup, since)
+
+    def y_range(self, label, start=None, end=None):
+        if self.df is None:
+            # an index range scan, rather than loading the whole history
+            return self.db.min_max(self.user, label, start, end, self.generation)
+        return super().y_range(label, start, end)
+
+    def latest(self):
+        if self._latest is None:
+            last = self.db.query_df(
+                self.user, MI_FIT_LABELS, limit=1, desc=True, generation=self.generation
+            )
+            if len(last):
+                self._latest = last.iloc[-1]
+        return self._latest
+
+
+class SqliteDataset(Dataset):
+    """A dataset whose csv partition is mirrored into a `MeasurementDB`, see
+    `SqliteSnapshot`."""
+
+    def __init__(self, user, csv_name, db):
+        self.db = db
+        super().__init__(user, csv_name)
+
+    def _new_snapshot(self, **kwargs):
+        # bounded by the rows written before it is published
+        return SqliteSnapshot(
+            self.user, self.db, generation=self.db.generation(self.user), **kwargs
+        )
+
+    def _source(self):
+        st = os.stat(self.csv_name)
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def reload_if_changed(self):
+        if self.file_version.current() == self.loaded_version:
+            return False
+        with self.lock:
+            version = self.file_version.current()
+            if version == self.loaded_version:
+                return False
+            source = self._source()
+            if self.db.get_source(self.user) != source:
+                df = load_measurements_cached(self.csv_name)
+                self.db.replace_user(self.user, df, source=source)
+            self._publish(file_version=version)
+            return True
+
+    def append_rows(self, new_df):
+        with self.lock:
+            if os.path.exists(self.csv_name):
+                self.reload_if_changed()
+            new_df = drop_known_rows(None, new_df)
+            # raises (before anything is stored) on rows that do not fit the
+            # stored dtypes
+            compact_measurements(new_df, report=False)
+            new_df = self.db.insert_new(self.user, new_df)
+            if len(new_df):
+                os.makedirs(os.path.dirname(self.csv_name) or ".", exist_ok=True)
+                append_rows_to_csv(self.csv_name, new_df)
+                self.db.set_source(self.user, self._source())
+                since = new_df.index.min()
+                previous = self._snapshot
+                version = self.file_version.acknowledge()
+                if previous.df is not None:
+                    df = merge_rows(previous.df, new_df)
+                    self._set_frames(df, version, appended_since=since)
+                else:
+                    _, rollups = previous.carried_over()
+                    for freq, rollup in rollups.items():
+                        start = bucket_start(since, rollup.freq)
+                        tail = self.db.query_df(self.user, rollup.labels, start=start)
+                        rollups[freq] = _extended_rollup(rollup, tail, since)
+                    self._publish(file_version=version, rollups=rollups)
+        return new_df
+
+
+class DatasetRegistry:
+    """Map users to their `Dataset`, keeping at most `max_bytes` of loaded
+    frames (the most recently used dataset is always kept). If `db` is given
+    the datasets are backed by that `MeasurementDB`."""
+
+    def __init__(self, default_csv, users_dir, max_bytes=512 * 1024 ** 2, db=None):
+        self.default_csv = default_csv
+        self.users_dir = users_dir
+        self.max_bytes = max_bytes
+        self.db = db
+        self._datasets = {}
+        # loaded datasets, least recently used first
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def partition_path(self, user):
+        if user == DEFAULT_USER:
+            return self.default_csv
+        if not _VALID_USER.match(user):
+            raise ValueError(f"invalid user '{user}'")
+        return os.path.join(self.users_dir, user, os.path.basename(self.default_csv))
+
+    def users(self):
+        """All users that have a partition on disk."""
+        users = [DEFAULT_USER] if os.path.exists(self.default_csv) else []
+        if os.path.isdir(self.users_dir):
+            users.extend(
+                sorted(
+                    u
+                    for u in os.listdir(self.users_dir)
+                    if u != DEFAULT_USER
+                    and _VALID_USER.match(u)
+                    and os.path.exists(self.partition_path(u))
+                )
+            )
+        return users
+
+    def dataset(self, user):
+        """Return the (possibly unloaded) dataset of the given user."""
+        with self._lock:
+            if user not in self._datasets:
+                csv_name = self.partition_path(user)
+                if self.db is not None:
+                    dataset = SqliteDataset(user, csv_name, self.db)
+                else:
+                    dataset = Dataset(user, csv_name)
+                # it may have been evicted while it was reloading, account
+                # for what was loaded
+                dataset.on_reload = self.touch
+                self._datasets[user] = dataset
+            return self._datasets[user]
+
+    def get(self, user):
+        """Return the current snapshot of the data of the given user (see
+        `Dataset.snapshot`), everything a request reads of it is read from
+        that one snapshot."""
+        dataset = self.dataset(user)
+        snapshot = dataset.snapshot()
+        self.touch(dataset)
+        return snapshot
+
+    def touch(self, dataset):
+        """Mark the dataset as most recently used and evict others if the
+        loaded datasets are over budget."""
+        evicted = []
+        with self._lock:
+            self._lru[dataset.user] = dataset
+            self._lru.move_to_end(dataset.user)
+            while len(self._lru) > 1 and self.loaded_nbytes() > self.max_bytes:
+                evicted.append(self._lru.popitem(last=False)[1])
+        # unloading waits for the dataset's lock (held while it reloads), which
+        # must not hold up every other request
+        for dataset in evicted:
+            dataset.unload()
+
+    def loaded_nbytes(self):
+        return sum(d.nbytes for d in self._lru.values())
+
+    def loaded_users(self):
+        """The users whose datasets are loaded, least recently used first."""
+        with self._lock:
+            return list(self._lru)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                loaded={u: d.nbytes for u, d in self._lru.items()},
+                loaded_nbytes=self.loaded_nbytes(),
+                max_bytes=self.max_bytes,
+            )
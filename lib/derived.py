@@ -0,0 +1,140 @@
+"""Body-composition metrics derived from the measured stats.
+
+Every metric is declared once in `DERIVED_METRICS`, by the columns it reads
+(measured, or derived before it) and a vectorised function of a frame with
+those columns. `compute_derived` evaluates the requested ones (and what they
+depend on) over the raw or the resampled frame; datasets compute each metric
+when it is first asked for and cache it per version of their data, such that
+figures (the composite trend) and the cards read the derived columns instead
+of recomputing them.
+"""
+import numpy as np
+import pandas as pd
+
+WEEK = pd.Timedelta(days=7)
+
+
+class DerivedMetric:
+    """A metric computed by `compute(frame)` from the `inputs` columns of
+    `frame`. Row-wise metrics only read the row they are computed for (such
+    that they can be computed over any slice of a frame)."""
+
+    def __init__(self, title, inputs, compute, unit="", rowwise=True):
+        self.title = title
+        self.inputs = inputs
+        self.compute = compute
+        self.unit = unit
+        self.rowwise = rowwise
+
+
+def weekly_delta(column):
+    """The change of `column` over the past week, with the value a week ago
+    linearly interpolated between the values around it."""
+
+    def compute(frame):
+        series = frame[column]
+        valid = series.notna().to_numpy()
+        if not valid.any():
+            # nothing to interpolate from
+            return pd.Series(np.nan, index=frame.index)
+        times = frame.index.asi8
+        week_ago = np.interp(
+            times - WEEK.value,
+            times[valid],
+            series.to_numpy(dtype=float)[valid],
+            left=np.nan,
+        )
+        return series - week_ago
+
+    return compute
+
+
+DERIVED_METRICS = {
+    "FAT_MASS": DerivedMetric(
+        "Fat Mass",
+        ["BODY_FAT", "WEIGHT"],
+        lambda f: f["BODY_FAT"] * f["WEIGHT"] / 100,
+        unit="kg",
+    ),
+    "LEAN_MASS": DerivedMetric(
+        "Lean Mass",
+        ["WEIGHT", "FAT_MASS"],
+        lambda f: f["WEIGHT"] - f["FAT_MASS"],
+        unit="kg",
+    ),
+    # height squared is WEIGHT / BMI
+    "FFMI": DerivedMetric(
+        "Fat-Free Mass Index",
+        ["LEAN_MASS", "BMI", "WEIGHT"],
+        lambda f: f["LEAN_MASS"] * f["BMI"] / f["WEIGHT"],
+        unit="kg/m²",
+    ),
+    "WATER_MASS": DerivedMetric(
+        "Water Mass",
+        ["MOISTURE", "WEIGHT"],
+        lambda f: f["MOISTURE"] * f["WEIGHT"] / 100,
+        unit="kg",
+    ),
+    "WEIGHT_WEEKLY_DELTA": DerivedMetric(
+        "Weight Change (7 days)",
+        ["WEIGHT"],
+        weekly_delta("WEIGHT"),
+        unit="kg",
+        rowwise=False,
+    ),
+}
+
+# the measured columns any derived metric depends on
+DERIVED_INPUTS = sorted(
+    {c for m in DERIVED_METRICS.values() for c in m.inputs} - set(DERIVED_METRICS)
+)
+
+
+class _Columns:
+    # the columns of `frame` together with those derived so far
+    def __init__(self, frame, derived):
+        self.index = frame.index
+        self._frame = frame
+        self._derived = derived
+
+    def __getitem__(self, column):
+        if column in self._derived:
+            return self._derived[column]
+        return self._frame[column]
+
+
+def _with_dependencies(names):
+    needed = set()
+
+    def add(name):
+        if name in DERIVED_METRICS and name not in needed:
+            needed.add(name)
+            for column in DERIVED_METRICS[name].inputs:
+                add(column)
+
+    for name in names:
+        add(name)
+    # in declaration order, which has the dependencies first
+    return [name for name in DERIVED_METRICS if name in needed]
+
+
+def compute_derived(frame, names=None):
+    """The derived metrics `names` (all by default) of `frame`, as a frame
+    with the same index. Metrics whose inputs `frame` lacks are left out."""
+    names = list(DERIVED_METRICS) if names is None else names
+    derived = {}
+    columns = _Columns(frame, derived)
+    for name in _with_dependencies(names):
+        metric = DERIVED_METRICS[name]
+        if all(c in derived or c in frame.columns for c in metric.inputs):
+            derived[name] = pd.Series(
+                metric.compute(columns), index=frame.index, name=name
+            )
+    return pd.DataFrame(
+        {name: derived[name] for name in names if name in derived}, index=frame.index
+    )
+
+
+def derived_column(frame, name):
+    """One derived metric of `frame` (as a series)."""
+    return compute_derived(frame, [name])[name]
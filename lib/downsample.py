@@ -0,0 +1,133 @@
+"""Zoom-aware downsampling of the plotted traces.
+
+Sending every 3-hourly resampled point (and every measurement) of the whole
+history makes the figure grow with the years of data. `MinMaxPyramid` keeps,
+per series, successively coarser levels where each level keeps the minimum
+and maximum of every four points of the level below, such that peaks survive
+at every resolution. A trace is then served as the finest level that fits a
+point budget within the visible x-range, plus a coarse overview of the rest
+of the history to pan into, and is refined when the user zooms.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# levels coarser than this are not worth keeping
+_MIN_LEVEL_SIZE = 64
+
+
+def _to_ns(x):
+    return np.asarray(x, dtype="datetime64[ns]").view(np.int64)
+
+
+def _minmax_reduce(idx, y):
+    """Keep the (time-ordered) min and max of every 4 consecutive points of
+    `idx`, ignoring NaNs."""
+    pad = -len(idx) % 4
+    candidates = np.concatenate([idx, np.repeat(idx[-1:], pad)]).reshape(-1, 4)
+    values = y[candidates]
+    nan = np.isnan(values)
+    lo = np.argmin(np.where(nan, np.inf, values), axis=1)
+    hi = np.argmax(np.where(nan, -np.inf, values), axis=1)
+    rows = np.arange(len(candidates))
+    picked = np.sort(
+        np.stack([candidates[rows, lo], candidates[rows, hi]], axis=1), axis=1
+    ).ravel()
+    # a bucket whose min and max are the same point
+    return picked[np.r_[True, picked[1:] != picked[:-1]]]
+
+
+class MinMaxPyramid:
+    """Multi-resolution min-max index over the series (x, y), with x sorted.
+
+    `levels[0]` are all points, every level after it keeps about half of the
+    points of the previous one; each level is an array of indices into
+    (x, y)."""
+
+    def __init__(self, x, y):
+        self.x = _to_ns(x)
+        y = np.asarray(y, dtype=float)
+        idx = np.arange(len(y))
+        self.levels = [idx]
+        while len(idx) > 2 * _MIN_LEVEL_SIZE:
+            idx = _minmax_reduce(idx, y)
+            self.levels.append(idx)
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + sum(level.nbytes for level in self.levels)
+
+    def _points(self, i0, i1, max_points):
+        # the finest level with at most `max_points` points in [i0, i1)
+        for level in self.levels:
+            start, end = np.searchsorted(level, [i0, i1])
+            if end - start <= max_points:
+                break
+        return level[start:end]
+
+    def select(self, start, end, max_points):
+        """Indices of the points to plot when (start, end) is visible (None
+        for the whole history): at most about `max_points` within the window,
+        one point beyond each of its edges, and an overview of a quarter as
+        many points over the whole history. The first and last points are
+        always kept."""
+        n = len(self.x)
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+        i0 = 0 if start is None else np.searchsorted(self.x, pd.Timestamp(start).value)
+        i1 = n if end is None else np.searchsorted(self.x, pd.Timestamp(end).value)
+        i0, i1 = max(i0 - 1, 0), min(i1 + 1, n)
+        return np.unique(
+            np.concatenate(
+                [
+                    self._points(i0, i1, max_points),
+                    self._points(0, n, max(max_points // 4, 1)),
+                    [0, n - 1],
+                ]
+            )
+        )
+
+
+class PyramidCache:
+    """Pyramids of one version of a dataset's series, by key, most recently
+    used last. Shared by the requests that read the version."""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._pyramids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, x, y):
+        """The pyramid stored under `key`, built from (x, y) if there is none."""
+        with self._lock:
+            pyramid = self._pyramids.get(key)
+            if pyramid is None:
+                # built once, by the first request that needs it
+                pyramid = self._pyramids[key] = MinMaxPyramid(x, y)
+            self._pyramids.move_to_end(key)
+            while len(self._pyramids) > self.max_entries:
+                self._pyramids.popitem(last=False)
+            return pyramid
+
+    def clear(self):
+        with self._lock:
+            self._pyramids.clear()
+
+    def nbytes(self):
+        with self._lock:
+            return sum(p.nbytes for p in self._pyramids.values())
+
+
+def downsample(x, y, x_range, max_points, pyramid=None):
+    """The points of (x, y) to plot when `x_range` (None for everything) is
+    visible, see `MinMaxPyramid.select`. `pyramid` may be a prebuilt pyramid
+    of (x, y)."""
+    if len(x) <= max_points:
+        return x, y
+    if pyramid is None:
+        pyramid = MinMaxPyramid(x, y)
+    start, end = x_range if x_range is not None else (None, None)
+    idx = pyramid.select(start, end, max_points)
+    return x[idx], np.asarray(y)[idx]
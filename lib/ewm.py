@@ -0,0 +1,147 @@
+"""Cached exponentially weighted means of the resampled series.
+
+`EwmCache` keeps `series.ewm(span=span).mean()` per (column, span) for the
+whole resampled history of a dataset, such that re-plotting with a recently
+used span is a lookup. Columns are smoothed together by `ewm_mean_2d`, one
+pandas ewm over a 2-D block. When the resampled frame is extended, the cached
+series are continued from the first changed row with the recursive update
+pandas uses (adjust=True, ignore_na=False) instead of being recomputed.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# weights below this are negligible when recovering the state of the mean
+_MIN_WEIGHT = 1e-18
+
+
+def span_to_alpha(span):
+    return 2.0 / (span + 1.0)
+
+
+def _n_recent(alpha):
+    # number of rows whose weight is not negligible
+    decay = 1.0 - alpha
+    return int(np.log(_MIN_WEIGHT) / np.log(decay)) + 1 if decay > 0 else 1
+
+
+def ewm_old_weight(recent_values, alpha):
+    """Recover the weight of the running average after the last of
+    `recent_values`: the sum of decay**age over the observations (NaNs do not
+    count, but still age the others)."""
+    recent_values = recent_values[-_n_recent(alpha) :]
+    ages = np.arange(len(recent_values) - 1, -1, -1)
+    return np.sum(np.power(1.0 - alpha, ages)[~np.isnan(recent_values)])
+
+
+def ewm_continue(values, alpha, avg=np.nan, old_wt=1.0):
+    """Continue the exponentially weighted mean over `values` from the given
+    state; mirrors pandas' `ewm(alpha=alpha).mean()` with adjust=True."""
+    decay = 1.0 - alpha
+    out = np.empty(len(values))
+    for i, cur in enumerate(values.tolist()):
+        if avg == avg:
+            old_wt *= decay
+            if cur == cur:
+                if avg != cur:
+                    avg = (old_wt * avg + cur) / (old_wt + 1.0)
+                old_wt += 1.0
+        elif cur == cur:
+            avg = cur
+        out[i] = avg
+    return out
+
+
+def ewm_mean_2d(values, span, axis=0):
+    """Exponentially weighted mean of every series of the 2-D float array
+    `values`, with time along `axis`: one
+    `pd.DataFrame(values).ewm(span=span).mean()` (adjust=True,
+    ignore_na=False) over the whole block."""
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        return ewm_mean_2d(values[:, None], span)[:, 0]
+    columns = values if axis == 0 else values.T
+    out = pd.DataFrame(columns).ewm(span=span).mean().to_numpy()
+    return out if axis == 0 else out.T
+
+
+class EwmCache:
+    """Per (column, span) smoothed series of one resampled frame, most
+    recently used last. `derived` maps extra column names to functions that
+    compute them from (a slice of) the frame."""
+
+    def __init__(self, max_entries=32, derived=None):
+        self.max_entries = max_entries
+        self.derived = derived or {}
+        self._entries = OrderedDict()
+
+    def clear(self):
+        self._entries.clear()
+
+    def copy(self):
+        """A cache with the same entries, to be updated on its own."""
+        cache = EwmCache(self.max_entries, self.derived)
+        cache._entries = OrderedDict(self._entries)
+        return cache
+
+    def nbytes(self):
+        # a copy, as `means` may update the entries meanwhile (under the
+        # lock of the snapshot, which is not held here)
+        entries = list(self._entries.values())
+        return sum(s.memory_usage(index=False) for s in entries)
+
+    def _column(self, frame, column):
+        if column in self.derived:
+            return self.derived[column](frame)
+        return frame[column]
+
+    def mean(self, frame, column, span):
+        """The smoothed `column` of `frame` over its whole index."""
+        return self.means(frame, [column], span)[column]
+
+    def means(self, frame, columns, span):
+        """Map `columns` of `frame` to their smoothed series; the columns that
+        are not cached yet are smoothed together in one 2-D block."""
+        missing = [c for c in columns if (c, span) not in self._entries]
+        if missing:
+            rows = np.vstack(
+                [self._column(frame, c).to_numpy(dtype=float) for c in missing]
+            )
+            for column, row in zip(missing, ewm_mean_2d(rows, span, axis=1)):
+                self._entries[(column, span)] = pd.Series(
+                    row, index=frame.index, name=column
+                )
+        result = {}
+        for column in columns:
+            self._entries.move_to_end((column, span))
+            result[column] = self._entries[(column, span)]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result
+
+    def extend(self, frame, changed_from):
+        """Update the cached series for `frame`, whose rows before
+        `changed_from` are unchanged since they were computed."""
+        for key, smoothed in list(self._entries.items()):
+            column, span = key
+            alpha = span_to_alpha(span)
+            # last unchanged row, whose output is the state to continue from
+            pos = smoothed.index.searchsorted(changed_from) - 1
+            if pos < 0:
+                del self._entries[key]
+                continue
+            start = max(pos + 1 - _n_recent(alpha), 0)
+            values = self._column(frame.iloc[start:], column).to_numpy(dtype=float)
+            avg = smoothed.iat[pos]
+            old_wt = ewm_old_weight(values[: pos + 1 - start], alpha)
+            if avg != avg:
+                # no observation yet
+                old_wt = 1.0
+            tail = ewm_continue(values[pos + 1 - start :], alpha, avg, old_wt)
+            self._entries[key] = pd.concat(
+                [
+                    smoothed.iloc[: pos + 1],
+                    pd.Series(tail, index=frame.index[pos + 1 :], name=smoothed.name),
+                ]
+            )
@@ -0,0 +1,131 @@
+"""Bounded cache of plotted figures.
+
+Figures are cached under keys that include the user and the version of the
+data they were plotted from (see `Dataset.data_version`), with time windows
+bucketed by `window_start`, such that repeated requests hit and figures of
+outdated data are never returned. Concurrent requests for a figure that is
+not cached yet plot it once. Entries are evicted least recently used
+first once the cache holds more than `max_entries` figures or `max_bytes` of
+(estimated) figure data.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# windows starting "x days ago" start at the beginning of the current bucket
+WINDOW_BUCKET = "1h"
+
+
+def window_start(days, now=None):
+    """The start of a window of the last `days` days, bucketed such that it
+    stays the same within one `WINDOW_BUCKET`."""
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    return now.floor(WINDOW_BUCKET) - pd.Timedelta(days=days)
+
+
+def _array_nbytes(value):
+    if value is None:
+        return 0
+    return np.asarray(value).nbytes
+
+
+def figure_nbytes(fig):
+    """An estimate of the memory held by the data arrays of `fig` (a figure,
+    or plotly json)."""
+    if isinstance(fig, dict):
+        traces = fig.get("data", ())
+    else:
+        # the plotly json of the traces, without copying it
+        traces = fig._data
+    nbytes = 0
+    for trace in traces:
+        nbytes += _array_nbytes(trace.get("x")) + _array_nbytes(trace.get("y"))
+        error_y = trace.get("error_y") or {}
+        nbytes += _array_nbytes(error_y.get("array"))
+        nbytes += _array_nbytes(error_y.get("arrayminus"))
+    return nbytes
+
+
+class FigureCache:
+    def __init__(self, max_bytes=64 * 1024 ** 2, max_entries=128, sizeof=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof or figure_nbytes
+        # key -> (figure, nbytes), least recently used first
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        # key -> event set once the figure being created is cached
+        self._creating = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, create, force_update=False):
+        """The figure cached under `key`, or `create()` (cached under `key`)
+        if there is none or `force_update`. A figure is only created by one
+        thread at a time, others asking for it wait for it (unless
+        `force_update`)."""
+        creating = None
+        while not force_update:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                creating = self._creating.get(key)
+                if creating is None:
+                    creating = self._creating[key] = threading.Event()
+                    break
+            # being created by another thread (e.g. the warm-up), it is
+            # cached once it is done (or created here if that failed)
+            creating.wait()
+            creating = None
+        with self._lock:
+            self.misses += 1
+        try:
+            fig = create()
+            self.put(key, fig)
+        finally:
+            if creating is not None:
+                with self._lock:
+                    del self._creating[key]
+                creating.set()
+        return fig
+
+    def put(self, key, fig):
+        nbytes = self.sizeof(fig)
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (fig, nbytes)
+            self._nbytes += nbytes
+            # the newest entry is kept even if it is over budget by itself
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+            ):
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._entries),
+                nbytes=self._nbytes,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=self.hits / lookups if lookups else None,
+                evictions=self.evictions,
+            )
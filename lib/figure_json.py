@@ -0,0 +1,70 @@
+"""Compact JSON encoding of figures.
+
+Figures are encoded once per version of the data they were plotted from and
+the cached text is sent to the browser as it is, where it is parsed by the
+clientside callbacks (see assets/figure_patch.js). The dates of the traces
+are encoded as milliseconds since the epoch instead of ISO strings (the
+x-axes are marked as dates), and with orjson (if installed) numeric arrays
+are encoded from the arrays directly, with the values as float32 in their
+short form.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_ENGINE = "orjson" if orjson is not None else "json"
+
+
+def _epoch_ms(values):
+    """The datetime64 `values` as milliseconds since the epoch; plotly shows
+    these as the same (timezone-naive) dates."""
+    ms = values.astype("datetime64[ms]").astype(np.int64)
+    nat = np.isnat(values)
+    if nat.any():
+        return np.where(nat, np.nan, ms)
+    return ms
+
+
+def figure_to_dict(fig):
+    """The plotly json of `fig` (a figure, or plotly json), with the dates of
+    its traces as epoch milliseconds and their values as float32 (which plotly
+    shows the same). The arrays of `fig` are shared, not copied."""
+    if isinstance(fig, dict):
+        layout, traces = dict(fig.get("layout", {})), fig.get("data", ())
+    else:
+        # plotly's `to_dict` deep-copies every array (and every date in them)
+        layout, traces = dict(fig._layout), fig._data
+    data = []
+    for trace in traces:
+        trace = dict(trace)
+        data.append(trace)
+        y = trace.get("y")
+        if isinstance(y, np.ndarray) and y.dtype == np.float64:
+            trace["y"] = y.astype(np.float32)
+        x = trace.get("x")
+        if x is None:
+            continue
+        x = np.asarray(x)
+        if x.dtype == object and len(x) and isinstance(x[0], datetime.datetime):
+            # plotly keeps the dates of a DatetimeIndex as datetime objects
+            x = pd.DatetimeIndex(x).to_numpy()
+        if x.dtype.kind != "M":
+            continue
+        trace["x"] = _epoch_ms(x)
+        # numbers would be shown as such on an axis that is not a date axis
+        axis = "xaxis" + trace.get("xaxis", "x")[1:]
+        layout[axis] = dict(layout.get(axis, {}))
+        layout[axis].setdefault("type", "date")
+    return dict(data=data, layout=layout)
+
+
+def encode_figure(fig):
+    """The JSON text of `fig`."""
+    return to_json_plotly(figure_to_dict(fig), engine=JSON_ENGINE)
@@ -0,0 +1,86 @@
+"""Synthetic measurements and reference builds shared by the tests (tests/)
+and the benchmarks (bench/)."""
+import os
+
+import numpy as np
+import pandas as pd
+from plotly.subplots import make_subplots
+
+from .ingest import load_measurements
+from .my_plotter import (
+    MI_FIT_LABELS,
+    VERTICAL_SPACING,
+    _SCATTER_CLASSES,
+    get_layout,
+    stats_to_title,
+    stats_to_yaxis_title,
+)
+
+SAMPLE_CSV = os.path.join(os.path.dirname(__file__), "..", "data", "mifit.csv")
+
+
+def measurements(
+    n,
+    labels=MI_FIT_LABELS,
+    freq="3h",
+    start="2019-01-01",
+    end=None,
+    irregular=False,
+    nan_fraction=0.0,
+    dtype=np.float32,
+    seed=0,
+):
+    """`n` measurements of `labels`, each a random walk around 70, indexed
+    every `freq` from `start` (or up to `end`), or at uniformly random times
+    over the same period if `irregular`. A `nan_fraction` of the values is
+    missing."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(
+        start=None if end is not None else start,
+        end=end,
+        periods=n,
+        freq=freq,
+        name="TIMESTAMP",
+    )
+    if irregular:
+        offsets = np.sort(rng.uniform(0, (index[-1] - index[0]).value, n))
+        index = pd.DatetimeIndex(index[0] + pd.to_timedelta(offsets), name="TIMESTAMP")
+    values = 70 + np.cumsum(rng.normal(0, 0.1, (n, len(labels))), axis=0)
+    if nan_fraction:
+        values[rng.random(values.shape) < nan_fraction] = np.nan
+    return pd.DataFrame(values, index=index, columns=list(labels)).astype(dtype)
+
+
+def sample_rows(n, step=pd.Timedelta(hours=4), csv_name=SAMPLE_CSV):
+    """`n` rows of the sample export (repeated) as loaded from a csv, one
+    every `step`, with unique TIMESTAMP and _id."""
+    sample = load_measurements(csv_name)
+    rows = sample.iloc[np.arange(n) % len(sample)].copy()
+    step_ms = step.value // 10 ** 6
+    rows["TIMESTAMP"] = sample.TIMESTAMP.iloc[0] + np.arange(n) * step_ms
+    rows["_id"] = rows["TIMESTAMP"]
+    rows.index = pd.to_datetime(rows.TIMESTAMP, unit="ms")
+    return rows
+
+
+def make_subplots_figure(fig_dict, stats_labels):
+    """The figure of `get_plotted_fig_all`'s `fig_dict` as it was built
+    before, through plotly's objects and make_subplots."""
+    fig = make_subplots(
+        rows=len(stats_labels),
+        cols=1,
+        shared_xaxes=True,
+        vertical_spacing=VERTICAL_SPACING,
+    )
+    for trace in fig_dict["data"]:
+        trace = dict(trace)
+        row = int(trace.pop("xaxis")[1:] or 1)
+        del trace["yaxis"]
+        fig.add_trace(_SCATTER_CLASSES[trace.pop("type")](**trace), row=row, col=1)
+    fig.update_layout(get_layout(stats_to_title(stats_labels[-1])), showlegend=False)
+    fig.update_xaxes(title_text="Time", row=len(stats_labels), col=1)
+    for i, stats_label in enumerate(stats_labels):
+        fig.update_yaxes(title_text=stats_to_yaxis_title(stats_label), row=i + 1, col=1)
+    for xaxis_attr in (a for a in dir(fig.layout) if a.startswith("xaxis")):
+        getattr(fig.layout, xaxis_attr).showticklabels = True
+    return fig
@@ -0,0 +1,132 @@
+"""Compression and conditional requests of the server's responses.
+
+Responses of at least `COMPRESS_MIN_SIZE` bytes (the callback responses with
+the figures, the layout, the scripts) are compressed with brotli (if
+installed and accepted by the client) or gzip. The compressed bodies are
+cached by the digest of the uncompressed body, such that a figure sent to
+many clients, or an asset, is compressed once.
+
+GET responses carry an ETag (of their content, unless the route set one,
+e.g. from the version of the data it serves, see `versioned_etag`), and a
+request whose If-None-Match has it is answered with 304 Not Modified and no
+body.
+"""
+import gzip
+import hashlib
+import uuid
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .figure_cache import FigureCache
+
+# smaller responses fit a few packets anyway
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/css",
+    "text/html",
+    "text/plain",
+}
+GZIP_LEVEL = 6
+# the higher qualities are too slow for the (uncached) callback responses
+BROTLI_QUALITY = 5
+# the versions of the data are counted from 1 in every process, an ETag of a
+# version must not match one of a previous process
+_BOOT_ID = uuid.uuid4().hex
+
+
+def choose_encoding(accept_encoding):
+    """The content coding to send for the given Accept-Encoding header: "br"
+    or "gzip", whichever the client prefers (brotli on a tie), or None."""
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        qualities[name.strip().lower()] = quality
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best = None
+    for encoding in candidates:
+        quality = qualities.get(encoding, qualities.get("*", 0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = encoding, quality
+    return best[0] if best else None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0 such that the same body is compressed to the same bytes
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def versioned_etag(*parts):
+    """An ETag of a response that only changes with `parts` (e.g. the user
+    and the version of the data it is computed from, and the arguments), and
+    with the process that sent it."""
+    return hashlib.sha1(repr((_BOOT_ID, parts)).encode()).hexdigest()[:20]
+
+
+def matching_etag(etag):
+    """The variant of `etag` (as sent, possibly compressed) that the request
+    has in its If-None-Match, if any; the response need not be computed then
+    and is answered with 304 Not Modified."""
+    for variant in [etag] + [f"{etag}-{encoding}" for encoding in ("br", "gzip")]:
+        if request.if_none_match.contains(variant):
+            return variant
+    return None
+
+
+def build_hooks(app, min_size=COMPRESS_MIN_SIZE, max_cache_bytes=16 * 1024 ** 2):
+    """Compress the responses of `app.server` and answer conditional GETs.
+
+    Dash's own compression (flask-compress, gzip only) should be disabled
+    with `compress=False`. Returns the cache of compressed bodies."""
+    compressed_cache = FigureCache(max_bytes=max_cache_bytes, sizeof=len)
+
+    @app.server.after_request
+    def compress_and_validate(response):
+        if response.status_code != 200:
+            return response
+        encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+        compressible = (
+            encoding is not None
+            and response.mimetype in COMPRESS_MIMETYPES
+            and "Content-Encoding" not in response.headers
+            and (response.content_length or 0) >= min_size
+        )
+        if compressible:
+            response.vary.add("Accept-Encoding")
+        if request.method in ("GET", "HEAD"):
+            etag, weak = response.get_etag()
+            if etag is None and not response.is_streamed:
+                response.add_etag()
+                etag, weak = response.get_etag()
+            if etag is not None and compressible:
+                # the compressed body is a different representation
+                response.set_etag(f"{etag}-{encoding}", weak=weak)
+            response.make_conditional(request)
+            if response.status_code != 200:
+                return response
+        if compressible:
+            # e.g. the static files are sent from the file otherwise
+            response.direct_passthrough = False
+            data = response.get_data()
+            key = (hashlib.sha1(data).digest(), encoding)
+            response.set_data(compressed_cache.get(key, lambda: compress(data, encoding)))
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    return compressed_cache
@@ -0,0 +1,86 @@
+import csv
+
+import numpy as np
+import pandas as pd
+
+
+def load_measurements(source):
+    """Read a Mi Fit export (path or file-like) into a DataFrame that is
+    indexed by the measurement time."""
+    df = pd.read_csv(source)
+    df.index = (
+        pd.to_datetime(df.TIMESTAMP, unit="ms")
+        # .dt.tz_localize("UTC")
+        # .dt.tz_convert("Australia/Sydney")
+    )
+    return df
+
+
+def read_csv_header(csv_name):
+    """Return the header row of the given csv, or None if the file is empty or
+    does not exist. Only the first line is read."""
+    try:
+        with open(csv_name, "r", newline="") as f:
+            return next(csv.reader(f), None)
+    except FileNotFoundError:
+        return None
+
+
+def drop_known_rows(df, new_df):
+    """Remove rows from `new_df` that are already stored in `df`.
+
+    Rows are de-duplicated on TIMESTAMP and _id within `new_df`, then a row is
+    considered known if its TIMESTAMP is already in `df`. As `df` is sorted by
+    time this is a binary search per new row, so the cost only depends on the
+    size of the delta. The returned rows are sorted by time (e.g. an export
+    may list the newest first), which `merge_rows` and the appended csv
+    rely on."""
+    new_df = new_df.drop_duplicates(subset=["TIMESTAMP"])
+    if "_id" in new_df:
+        new_df = new_df.drop_duplicates(subset=["_id"])
+    if not new_df.index.is_monotonic_increasing:
+        new_df = new_df.sort_index(kind="mergesort")
+    if df is None or len(df) == 0 or len(new_df) == 0:
+        return new_df
+
+    existing_ts = df["TIMESTAMP"].to_numpy()
+    new_ts = new_df["TIMESTAMP"].to_numpy()
+    pos = np.searchsorted(existing_ts, new_ts)
+    pos_clipped = np.minimum(pos, len(existing_ts) - 1)
+    is_known = existing_ts[pos_clipped] == new_ts
+    return new_df[~is_known]
+
+
+def append_rows_to_csv(csv_name, new_df):
+    """Append rows to the csv without rewriting the existing content.
+
+    Columns are written in the order of the existing header; if the file does
+    not exist yet it is created with the header of `new_df`."""
+    header = read_csv_header(csv_name)
+    if header is None:
+        new_df.to_csv(csv_name, index=False)
+        return
+    with open(csv_name, "a", newline="") as f:
+        new_df.reindex(columns=header).to_csv(f, index=False, header=False)
+
+
+def merge_rows(df, new_df):
+    """Merge new (already de-duplicated) rows into the in-memory df, keeping
+    the index sorted and the columns/dtypes of `df`."""
+    if df is None or len(df) == 0:
+        return new_df
+    new_df = new_df.reindex(columns=df.columns)
+    dtypes = df.dtypes.to_dict()
+    for c, dtype in dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            unseen = set(new_df[c].dropna()) - set(dtype.categories)
+            if unseen:
+                # rare (e.g. a new scale), re-code the history with the new one
+                dtype = pd.CategoricalDtype([*dtype.categories, *sorted(unseen)])
+                df = df.astype({c: dtype})
+                dtypes[c] = dtype
+    merged = pd.concat([df, new_df.astype(dtypes)])
+    if len(df) and len(new_df) and new_df.index.min() < df.index[-1]:
+        # some of the new rows are older than what we have, restore ordering
+        merged = merged.sort_index(kind="mergesort")
+    return merged
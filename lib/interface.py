@@ -19,6 +19,14 @@ def construct_page_content(app):
         # 'width': 600
     }
 
+    _ui_user = [
+        # the selected user can be bookmarked as ?user=<id>
+        dcc.Location(id="url", refresh=False),
+        html.P("User", style={"textAlign": "center"}),
+        # options are filled in from the registry when the page is loaded
+        dcc.Dropdown(id="user_dropdown", clearable=False),
+    ]
+
     _ui_dropdown = [
         html.P("Dropdown", style={"textAlign": "center"}),
         dcc.Dropdown(
@@ -65,6 +73,19 @@ def construct_page_content(app):
     ]
 
     _ui_figure_display_control = [
+        html.P("Stats: Plot from"),
+        dbc.RadioItems(
+            id="plot_source",
+            options=[
+                {"label": "Measurements", "value": "raw"},
+                {"label": "Daily", "value": "day"},
+                {"label": "Weekly", "value": "week"},
+                {"label": "Monthly", "value": "month"},
+            ],
+            value="raw",
+            inline=True,
+        ),
+        html.Br(),
         html.P("Stat: Smoothing span"),
         dcc.Slider(
             id="stat_smoothing_span",
@@ -110,6 +131,8 @@ def construct_page_content(app):
 
     controls = dbc.FormGroup(
         [
+            *_ui_user,
+            html.Br(),
             *_ui_dropdown,
             html.Br(),
             *_ui_checkbox,
@@ -227,8 +250,25 @@ def construct_page_content(app):
         ]
     )
 
-    all_stats = dbc.Row([dbc.Col(dcc.Graph(id=f"graph_all"), md=12,)])
-    composite_trend = dbc.Row([dbc.Col(dcc.Graph(id=f"composite_trend"), md=12,)])
+    all_stats = dbc.Row(
+        [
+            dbc.Col(dcc.Graph(id=f"graph_all"), md=12,),
+            # the (shared) figure as JSON text, what it shows (see `get_fig_view`), and the
+            # per-request layout patch that is applied to it in the browser
+            dcc.Store(id="graph_all_base"),
+            dcc.Store(id="graph_all_view"),
+            dcc.Store(id="graph_all_patch"),
+            # the zoom/pan the traces should be refined for
+            dcc.Store(id="graph_all_refine"),
+        ]
+    )
+    composite_trend = dbc.Row(
+        [
+            dbc.Col(dcc.Graph(id=f"composite_trend"), md=12,),
+            # the JSON text of the figure, parsed in the browser
+            dcc.Store(id="composite_trend_json"),
+        ]
+    )
 
     content = html.Div(
         [
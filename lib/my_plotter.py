@@ -1,13 +1,14 @@
-import os
-import csv
-
 import datetime
-import dateutil
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import plotly.io as pio
 
+from .annotations import annotation_index
+from .derived import compute_derived
+from .downsample import downsample
+from .ewm import ewm_mean_2d
 from .utils import get_df_after_given_date
 
 moving_average_window_size = 3 * 8
@@ -82,11 +83,87 @@ def get_xaxis_zoomed_range(right_most_date, recent_months_to_zoom):
     return dict(xaxis_range=[_from, _to])
 
 
+# space above and below the measurements of an autoscaled y-axis
+YAXIS_MARGIN = 0.5
+# subplots of more points than this are rendered with WebGL (None to never
+# use it); downsampled subplots count the points of the series they plot
+WEBGL_POINT_THRESHOLD = 5000
+
+
+# the space between stacked subplots, as a fraction of the figure's height
+VERTICAL_SPACING = 0.03
+
+LEGEND = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+
+
+def _scatter_type(n_points, webgl_threshold=WEBGL_POINT_THRESHOLD):
+    """The trace type to plot a subplot of `n_points` points with: "scattergl"
+    (WebGL) above `webgl_threshold` points (None to always use SVG),
+    "scatter" otherwise. Both take the same attributes for the traces plotted
+    here."""
+    if webgl_threshold is not None and n_points > webgl_threshold:
+        return "scattergl"
+    return "scatter"
+
+
+_SCATTER_CLASSES = {"scatter": go.Scatter, "scattergl": go.Scattergl}
+
+
+def _axis_suffix(row):
+    # the axes of the first subplot are x and y, then x2 and y2, ...
+    return str(row) if row > 1 else ""
+
+
+def _subplots_layout(n_rows, vertical_spacing=VERTICAL_SPACING):
+    """The axes of `n_rows` subplots stacked over each other, sharing the
+    x-axis of the bottom one, as laid out by `make_subplots(rows=n_rows,
+    cols=1, shared_xaxes=True, vertical_spacing=vertical_spacing)` (but with
+    the tick labels shown on every x-axis)."""
+    height = (1 - vertical_spacing * (n_rows - 1)) / n_rows
+    bottom_xaxis = f"x{_axis_suffix(n_rows)}"
+    layout = {}
+    for row in range(1, n_rows + 1):
+        suffix = _axis_suffix(row)
+        top = 1 - (row - 1) * (height + vertical_spacing)
+        xaxis = dict(anchor=f"y{suffix}", domain=[0.0, 1.0], showticklabels=True)
+        if row < n_rows:
+            xaxis["matches"] = bottom_xaxis
+        layout[f"xaxis{suffix}"] = xaxis
+        layout[f"yaxis{suffix}"] = dict(
+            anchor=f"x{suffix}", domain=[max(top - height, 0.0), top]
+        )
+    return layout
+
+
+# plotly json of the templates, by name
+_templates = {}
+
+
+def _template():
+    # the template go.Figure applies
+    name = pio.templates.default
+    if name not in _templates:
+        _templates[name] = pio.templates[name].to_plotly_json()
+    return _templates[name]
+
+
+def get_yaxis_autoscaled_range(y_range, stats_labels, x_range, margin=YAXIS_MARGIN):
+    """The y-axis range of every subplot (stats in the order of
+    `get_plotted_fig_all`) that fits the measurements within `x_range`.
+    `y_range(label, start, end)` returns the (min, max) of the measurements of
+    a stat in [start, end), such as `Dataset.y_range`."""
+    layout = {}
+    for i, stats_label in enumerate(stats_labels):
+        lo, hi = y_range(stats_label, x_range[0], x_range[1])
+        if lo != lo:
+            # nothing measured in range
+            continue
+        layout[f"yaxis{i + 1 if i else ''}_range"] = (lo - margin, hi + margin)
+    return layout
+
+
 def get_layout(title):
-    layout = go.Layout(
-        title=title,
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-    )
+    layout = go.Layout(title=title, legend=LEGEND)
     return layout
 
 
@@ -108,12 +185,23 @@ def get_layout(title):
 def _get_resampled_df(df):
     # resample the dataframe to be equally-spaced
     # (3 hr apart which is reasonable)
+    # only the plotted stats are needed (and can be interpolated)
     resampled_df = (
-        df.resample("3h").ffill(limit=1).interpolate(method="linear", order=2)
+        df[[label for label in MI_FIT_LABELS if label in df.columns]]
+        .resample("3h")
+        .ffill(limit=1)
+        .interpolate(method="linear", order=2)
     )
     return resampled_df
 
 
+def _cached_pyramid(pyramids, key, x, y, max_points):
+    # only series that are downsampled (see `downsample`) need a pyramid
+    if pyramids is None or len(x) <= max_points:
+        return None
+    return pyramids.get(key, x, y)
+
+
 def _get_trace_for_stat(
     df,
     resampled_df,
@@ -121,25 +209,59 @@ def _get_trace_for_stat(
     ma_color="rgba(119,173,59,0.8)",
     actual_color="rgba(119,173,59,1)",
     emw_span=3 * 8 * 1,
+    smoothed=None,
+    x_range=None,
+    max_points=None,
+    pyramids=None,
+    webgl_threshold=WEBGL_POINT_THRESHOLD,
 ):
+    if smoothed is None:
+        smoothed = resampled_df[stats_label].ewm(span=emw_span).mean()
+    ma_x, ma_y = resampled_df.index, smoothed
+    actual_x, actual_y = df.index, df[stats_label]
+    # chosen by the whole series rather than by the points sent, which are
+    # capped by `max_points`; the trace type is then also kept when zooming
+    # refines the traces
+    scatter = _scatter_type(len(ma_x) + len(actual_x), webgl_threshold)
+    if max_points is not None:
+        # only send as many points as can be seen at the visible x-range
+        ma_x, ma_y = downsample(
+            ma_x,
+            ma_y,
+            x_range,
+            max_points,
+            pyramid=_cached_pyramid(
+                pyramids, ("smoothed", stats_label, emw_span), ma_x, ma_y, max_points
+            ),
+        )
+        actual_x, actual_y = downsample(
+            actual_x,
+            actual_y,
+            x_range,
+            max_points,
+            pyramid=_cached_pyramid(
+                pyramids, ("actual", stats_label), actual_x, actual_y, max_points
+            ),
+        )
     traces = [
         # plot the moving average
-        go.Scatter(
-            x=resampled_df.index,
-            y=resampled_df[stats_label].ewm(span=emw_span).mean(),
+        dict(
+            type=scatter,
+            x=np.asarray(ma_x),
+            y=np.asarray(ma_y),
             # y=resampled_df[stats_label]
             # .rolling(window=moving_average_window_size)
             # .mean(),
             mode="lines",
-            line_width=4,
-            line_color=ma_color,
+            line=dict(width=4, color=ma_color),
             hoverinfo="skip",
             name="Moving Average",
         ),
         # plot the actual scatters
-        go.Scatter(
-            x=df.index,
-            y=df[stats_label],
+        dict(
+            type=scatter,
+            x=np.asarray(actual_x),
+            y=np.asarray(actual_y),
             mode="markers",
             marker=dict(
                 size=6,
@@ -152,56 +274,150 @@ def _get_trace_for_stat(
     ]
     add_annotate_for_last_point = True
     if add_annotate_for_last_point:
-        traces.append(
-            go.Scatter(
-                x=[df.index[-1]],
-                y=[df[stats_label].iloc[-1]],
-                text=[f"{df[stats_label].iloc[-1]:.1f}"],
-                mode="text",
-                # marker=dict(color='red', size=10),
-                # textfont=dict(color='green', size=20),
-                textposition="top right",
-                showlegend=False,
-            )
-        )
+        traces.append(_get_last_point_trace(df, stats_label))
 
     return traces
 
 
-def get_plotted_fig_all(df, resampled_df, stats_labels, emw_span):
-    fig = make_subplots(
-        rows=len(stats_labels), cols=1, shared_xaxes=True, vertical_spacing=0.03
+def _get_last_point_trace(df, stats_label):
+    # a single point, whose text is rendered the same in SVG in any case
+    last = df[stats_label].iloc[-1]
+    return dict(
+        type="scatter",
+        x=np.asarray(df.index[-1:]),
+        y=np.array([last]),
+        text=[f"{last:.1f}"],
+        mode="text",
+        # marker=dict(color='red', size=10),
+        # textfont=dict(color='green', size=20),
+        textposition="top right",
+        showlegend=False,
     )
 
+
+def _get_rollup_trace_for_stat(
+    df,
+    rollup,
+    stats_label,
+    ma_color="rgba(119,173,59,0.8)",
+    actual_color="rgba(119,173,59,1)",
+    webgl_threshold=WEBGL_POINT_THRESHOLD,
+):
+    """Like `_get_trace_for_stat`, but plotting the rollup table of the stat
+    (see `compute_rollup`): the mean per bucket, with its min and max."""
+    x = np.asarray(rollup.index)
+    mean = rollup["mean"].to_numpy()
+    scatter = _scatter_type(2 * len(rollup), webgl_threshold)
+    return [
+        dict(
+            type=scatter,
+            x=x,
+            y=mean,
+            mode="lines",
+            line=dict(width=4, color=ma_color),
+            hoverinfo="skip",
+            name="Moving Average",
+        ),
+        dict(
+            type=scatter,
+            x=x,
+            y=mean,
+            error_y=dict(
+                type="data",
+                array=rollup["max"].to_numpy() - mean,
+                arrayminus=mean - rollup["min"].to_numpy(),
+                thickness=1,
+            ),
+            mode="markers",
+            marker=dict(size=6, color=actual_color, symbol="diamond-open"),
+            name="Actual Measurement",
+        ),
+        _get_last_point_trace(df, stats_label),
+    ]
+
+
+def get_plotted_fig_all(
+    df,
+    resampled_df,
+    stats_labels,
+    emw_span,
+    smoothed=None,
+    x_range=None,
+    max_points=None,
+    pyramids=None,
+    rollup=None,
+    webgl_threshold=WEBGL_POINT_THRESHOLD,
+):
+    """Plot the given stats as subplots sharing the x axis. `smoothed` may map
+    stats to their precomputed moving average (aligned with `resampled_df`),
+    the others are smoothed here with `emw_span`, together in one pass.
+
+    If `max_points` is given, every trace is downsampled to about that many
+    points within `x_range` (see `downsample`); `pyramids` may be a
+    `PyramidCache` of the given frames to downsample from.
+
+    If a `rollup` table (see `compute_rollup`) is given, the stats are
+    plotted from its buckets instead of the measurements.
+
+    Subplots of more than `webgl_threshold` points are rendered with WebGL
+    (see `_scatter_type`), counting the points before downsampling.
+
+    The figure is returned as plotly json (a dict of its data and layout),
+    assembled directly rather than through plotly's (validating) objects."""
+    smoothed = dict(smoothed or {})
+    to_smooth = [label for label in stats_labels if label not in smoothed]
+    if to_smooth and rollup is None:
+        # one row per stat, smoothed along time
+        rows = np.vstack(
+            [resampled_df[label].to_numpy(dtype=float) for label in to_smooth]
+        )
+        smoothed.update(zip(to_smooth, ewm_mean_2d(rows, emw_span, axis=1)))
+
+    data = []
     for i, stats_label in enumerate(stats_labels):
         color = STATS_NAME_TO_COLOR[stats_label]
-        traces = _get_trace_for_stat(
-            df,
-            resampled_df,
-            stats_label,
-            ma_color=color,
-            actual_color=color,
-            emw_span=emw_span,
-        )
+        if rollup is not None:
+            traces = _get_rollup_trace_for_stat(
+                df,
+                rollup[stats_label],
+                stats_label,
+                ma_color=color,
+                actual_color=color,
+                webgl_threshold=webgl_threshold,
+            )
+        else:
+            traces = _get_trace_for_stat(
+                df,
+                resampled_df,
+                stats_label,
+                ma_color=color,
+                actual_color=color,
+                emw_span=emw_span,
+                smoothed=smoothed[stats_label],
+                x_range=x_range,
+                max_points=max_points,
+                pyramids=pyramids,
+                webgl_threshold=webgl_threshold,
+            )
 
+        suffix = _axis_suffix(i + 1)
         for t in traces:
-            fig.add_trace(t, row=i + 1, col=1)
+            t.update(xaxis=f"x{suffix}", yaxis=f"y{suffix}")
+        data.extend(traces)
 
-    fig.update_layout(
-        get_layout(stats_to_title(stats_label)),
-        # height=600, width=600, title_text="Multiple Subplots with Shared Y-Axes"
+    layout = _subplots_layout(len(stats_labels))
+    for i, stats_label in enumerate(stats_labels):
+        layout[f"yaxis{_axis_suffix(i + 1)}"]["title"] = dict(
+            text=stats_to_yaxis_title(stats_label)
+        )
+    layout[f"xaxis{_axis_suffix(len(stats_labels))}"]["title"] = dict(text="Time")
+    layout.update(
+        template=_template(),
+        title=dict(text=stats_to_title(stats_labels[-1])),
+        legend=dict(LEGEND),
         showlegend=False,
     )
-
-    # update all y axis
-    fig.update_xaxes(title_text="Time", row=len(stats_labels), col=1)
-    # Update yaxis properties
-    for i, stats_label in enumerate(stats_labels):
-        fig.update_yaxes(title_text=stats_to_yaxis_title(stats_label), row=i + 1, col=1)
-
-    # force show ticks for all subplot
-    for xaxis_attr in (attr for attr in dir(fig.layout) if attr.startswith("xaxis")):
-        getattr(fig.layout, xaxis_attr).showticklabels = True
+    fig = dict(data=data, layout=layout)
 
     add_annotations(fig,
                     [f"x{i}" for i in range(1, len(stats_labels) + 1)],
@@ -211,16 +427,36 @@ def get_plotted_fig_all(df, resampled_df, stats_labels, emw_span):
 
 
 def get_fig_body_composite_trend(
-    df, resampled_df, beginning_date, trend_smoothing_span
+    df,
+    resampled_df,
+    beginning_date,
+    trend_smoothing_span,
+    smoothed=None,
+    derived=None,
+    webgl_threshold=WEBGL_POINT_THRESHOLD,
 ):
+    """Plot the change of fat, muscle and bone mass since `beginning_date`.
+    `smoothed` may map BODY_FAT (the fat mass), MUSCLE and BONE_MASS to their
+    moving average over (at least) the resampled window. `derived` may be the
+    derived metrics (see `compute_derived`) of (at least) the raw and
+    resampled window. The figure is rendered with WebGL if it has more than
+    `webgl_threshold` points."""
     # only plot all data after the given date
-    df = get_df_after_given_date(df, beginning_date).copy()
-    resampled_df = get_df_after_given_date(resampled_df, beginning_date).copy()
+    df = get_df_after_given_date(df, beginning_date)
+    resampled_df = get_df_after_given_date(resampled_df, beginning_date)
+    if derived is None:
+        derived = (
+            compute_derived(df, ["FAT_MASS"]),
+            compute_derived(resampled_df, ["FAT_MASS"]),
+        )
+    derived_df, derived_resampled_df = (
+        get_df_after_given_date(frame, beginning_date) for frame in derived
+    )
 
-    body_fat = resampled_df["BODY_FAT"] * resampled_df["WEIGHT"] / 100
+    body_fat = derived_resampled_df["FAT_MASS"]
     muscle_mass = resampled_df["MUSCLE"]
     bone_mass = resampled_df["BONE_MASS"]
-    body_fat_actual = df["BODY_FAT"] * df["WEIGHT"] / 100
+    body_fat_actual = derived_df["FAT_MASS"]
     muscle_mass_actual = df["MUSCLE"]
     bone_mass_actual = df["BONE_MASS"]
 
@@ -231,32 +467,42 @@ def get_fig_body_composite_trend(
         # series_actual /= datum
         # ===== compute_offset =====
         datum = series.dropna()[0]
-        series -= datum
-        series_actual -= datum
-        return series, series_actual
+        return series - datum, series_actual - datum, datum
 
-    body_fat, body_fat_actual = normalise_offset_with_first_val(
+    body_fat, body_fat_actual, body_fat_datum = normalise_offset_with_first_val(
         body_fat, body_fat_actual
     )
-    muscle_mass, muscle_mass_actual = normalise_offset_with_first_val(
+    muscle_mass, muscle_mass_actual, muscle_datum = normalise_offset_with_first_val(
         muscle_mass, muscle_mass_actual
     )
-    bone_mass, bone_mass_actual = normalise_offset_with_first_val(
+    bone_mass, bone_mass_actual, bone_datum = normalise_offset_with_first_val(
         bone_mass, bone_mass_actual
     )
 
     fig = go.Figure(layout=get_layout("Body Composite Trend"))
+    # the three stats share one plot
+    scatter = _SCATTER_CLASSES[
+        _scatter_type(3 * (len(resampled_df) + len(df)), webgl_threshold)
+    ]
 
-    for name, stat_id, stat, stat_actual in zip(
+    for name, stat_id, stat, stat_actual, datum in zip(
         ["Body Fat", "Muscle", "Bone Mass"],
         ["BODY_FAT", "MUSCLE", "BONE_MASS"],
         [body_fat, muscle_mass, bone_mass],
         [body_fat_actual, muscle_mass_actual, bone_mass_actual],
+        [body_fat_datum, muscle_datum, bone_datum],
     ):
+        if smoothed is not None:
+            # the offset commutes with the (normalised) moving average
+            stat_smoothed = (
+                get_df_after_given_date(smoothed[stat_id], beginning_date) - datum
+            )
+        else:
+            stat_smoothed = stat.ewm(span=trend_smoothing_span).mean()
         fig.add_trace(
-            go.Scatter(
+            scatter(
                 x=resampled_df.index,
-                y=stat.ewm(span=trend_smoothing_span).mean(),
+                y=stat_smoothed,
                 mode="lines",
                 # fill='tozeroy',
                 marker=dict(
@@ -270,7 +516,7 @@ def get_fig_body_composite_trend(
             )
         )
         fig.add_trace(
-            go.Scatter(
+            scatter(
                 x=stat_actual.index,
                 y=stat_actual,
                 mode="markers",
@@ -295,19 +541,35 @@ def get_fig_body_composite_trend(
 
     return fig
 
-def add_annotations(fig, xrefs, yrefs, y=None):
-    if os.path.exists("data/annotation.csv"):
-        for xref, yref in zip(xrefs, yrefs):
-            with open("data/annotation.csv", 'r') as f:
-                reader = csv.reader(f)
-                next(reader)
-                for date, text in reader:
-                    date = dateutil.parser.parse(date)
-                    if date >= fig.data[0].x[0]:
-                        add_annotation(fig, date, text, xref=xref, yref=yref, y=y)
 
-def add_annotation(fig, date, text, xref="x", yref="y", y=None):
-    fig.add_annotation(
+def add_annotations(fig, xrefs, yrefs, y=None, index=None):
+    """Annotate the subplots (`xrefs`, `yrefs`) of `fig` (a figure, or plotly
+    json) from its first plotted date onwards, in one layout update. `index`
+    is the `AnnotationIndex` to read from (that of data/annotation.csv by
+    default)."""
+    index = annotation_index() if index is None else index
+    if isinstance(fig, dict):
+        first_date = fig["data"][0]["x"][0]
+    else:
+        first_date = fig.data[0].x[0]
+    dates, texts = index.between(first_date)
+    if not len(dates):
+        return
+    dates = list(pd.DatetimeIndex(dates))
+    annotations = [
+        _annotation(date, text, xref=xref, yref=yref, y=y)
+        for xref, yref in zip(xrefs, yrefs)
+        for date, text in zip(dates, texts)
+    ]
+    if isinstance(fig, dict):
+        layout = fig.setdefault("layout", {})
+        layout["annotations"] = list(layout.get("annotations", ())) + annotations
+    else:
+        fig.update_layout(annotations=list(fig.layout.annotations) + annotations)
+
+
+def _annotation(date, text, xref="x", yref="y", y=None):
+    return dict(
             x=date,
             y=y,
             xref=xref,
@@ -334,15 +596,5 @@ def add_annotation(fig, date, text, xref="x", yref="y", y=None):
             )
 
 
-if __name__ == "__main__":
-
-    def run():
-        df = pd.read_csv("mifit.csv")
-
-        # get_plotted_fig(df, 'BODY_FAT', recent_months=10).show()
-
-        # print(get_plotted_fig(df, "BODY_FAT", recent_months=10).data)
-
-        get_plotted_fig_all(df, _get_resampled_df(df), MI_FIT_LABELS).show()
-
-    run()
+def add_annotation(fig, date, text, xref="x", yref="y", y=None):
+    fig.add_annotation(**_annotation(date, text, xref=xref, yref=yref, y=y))
@@ -0,0 +1,153 @@
+"""Background warm-up of the figure caches.
+
+A `FigureWarmer` runs a daemon thread that checks the loaded datasets (and
+the ones it is told about, e.g. by an upload) for a new version of their
+data. For every new version it plots the figures of the default control
+values of the page and of the requests that were made most often recently,
+such that the first load after startup or after an upload is served from the
+cache instead of plotting inside the request. Only a new data version is
+warmed; figures that are outdated otherwise (e.g. as their time window moved
+on) are plotted by the request. The figures are cached under keys that
+include the data version, so the figures of the old version are
+served until the new ones are there; a request for a figure that is being
+warmed waits for it (see `FigureCache.get`) rather than plotting it again.
+"""
+import threading
+import traceback
+from collections import Counter, deque
+
+# seconds between checks for changed data
+WARM_INTERVAL = 2.0
+
+
+def component_values(*components):
+    """The `value` of every component with an id in the given layout(s), by
+    id, i.e. the default values of the controls."""
+    values = {}
+    stack = list(components)
+    while stack:
+        component = stack.pop()
+        if isinstance(component, (list, tuple)):
+            stack.extend(component)
+            continue
+        if not hasattr(component, "to_plotly_json"):
+            continue
+        component_id = getattr(component, "id", None)
+        value = getattr(component, "value", None)
+        if component_id is not None and value is not None:
+            values[component_id] = value
+        stack.append(getattr(component, "children", None))
+    return values
+
+
+class FigureWarmer:
+    """Warm the figures of every new data version of the users in `registry`.
+
+    `warm(snapshot, request)` plots (and caches) the figures of one request
+    from a snapshot of the user's data (see `DataSnapshot`); requests are
+    hashable descriptions of what the callbacks plot. The `defaults` are
+    warmed for every user, and besides those the `top` most frequent of the
+    last `max_recent` requests recorded with `record` for each user."""
+
+    def __init__(
+        self,
+        registry,
+        warm,
+        defaults=(),
+        top=4,
+        max_recent=256,
+        interval=WARM_INTERVAL,
+    ):
+        self.registry = registry
+        self.warm = warm
+        self.defaults = list(defaults)
+        self.top = top
+        self.max_recent = max_recent
+        self.interval = interval
+        self._recent = {}
+        # user -> the version of the data its figures were warmed for
+        self._warmed = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.warmups = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def record(self, user, request):
+        """Count a request of `user`; the most frequent are warmed."""
+        with self._lock:
+            recent = self._recent.get(user)
+            if recent is None:
+                recent = self._recent[user] = deque(maxlen=self.max_recent)
+            recent.append(request)
+
+    def notify(self, user):
+        """Check the data of `user` now (e.g. after an upload)."""
+        with self._lock:
+            self._pending.add(user)
+        self._wakeup.set()
+
+    def requests(self, user):
+        """What is warmed for `user`: the defaults, then the most frequent
+        recent requests."""
+        with self._lock:
+            counts = Counter(self._recent.get(user, ()))
+        requests = list(self.defaults)
+        for request, _ in counts.most_common():
+            if len(requests) >= len(self.defaults) + self.top:
+                break
+            if request not in requests:
+                requests.append(request)
+        return requests
+
+    def warm_if_changed(self, user):
+        """Warm the figures of `user` if its data changed since they were
+        last warmed. Returns True if they were."""
+        dataset = self.registry.dataset(user)
+        # reloaded here rather than in a request, which is served the
+        # previous snapshot meanwhile
+        snapshot = dataset.snapshot(wait=True)
+        version = snapshot.data_version
+        if self._warmed.get(user) == version:
+            return False
+        # account for the (re)loaded dataset
+        self.registry.touch(dataset)
+        for request in self.requests(user):
+            try:
+                self.warm(snapshot, request)
+            except Exception:
+                # the request plots it again (and fails) by itself
+                traceback.print_exc()
+        self._warmed[user] = version
+        self.warmups += 1
+        return True
+
+    def _users(self):
+        with self._lock:
+            users = set(self._pending)
+            self._pending.clear()
+        # the loaded datasets are the ones that are being looked at
+        return users | set(self.registry.loaded_users())
+
+    def _run(self):
+        while True:
+            for user in sorted(self._users()):
+                try:
+                    self.warm_if_changed(user)
+                except Exception:
+                    traceback.print_exc()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                warmups=self.warmups,
+                warmed=dict(self._warmed),
+            )
@@ -0,0 +1,64 @@
+"""Range minimum/maximum queries over a measurement series.
+
+The y-axis autoscale needs the extremes of each stat within the visible
+x-window. `RangeExtrema` keeps the min and max of every block of
+`BLOCK_SIZE` consecutive values (built once per version of the data, in
+O(n / BLOCK_SIZE) memory besides the series), such that the extremes of an
+index range are those of the whole blocks it covers and of the at most
+2 * BLOCK_SIZE values at its ends.
+"""
+import numpy as np
+import pandas as pd
+
+BLOCK_SIZE = 256
+
+
+class RangeExtrema:
+    """NaN-aware range min/max over the series (x, y), with x sorted."""
+
+    def __init__(self, x, y, block_size=BLOCK_SIZE):
+        self.x = np.asarray(x, dtype="datetime64[ns]").view(np.int64)
+        y = np.asarray(y)
+        # float series are not copied
+        self.y = y if np.issubdtype(y.dtype, np.floating) else y.astype(float)
+        self._copied_nbytes = 0 if self.y is y else self.y.nbytes
+        self.block_size = block_size
+        n_blocks = len(self.y) // block_size
+        blocks = self.y[: n_blocks * block_size].reshape(n_blocks, block_size)
+        # fmin/fmax ignore NaNs, and give NaN for blocks without a value
+        self._block_min = np.fmin.reduce(blocks, axis=1)
+        self._block_max = np.fmax.reduce(blocks, axis=1)
+
+    @property
+    def nbytes(self):
+        return self._copied_nbytes + self._block_min.nbytes + self._block_max.nbytes
+
+    def index_min_max(self, i0, i1):
+        """(min, max) of y[i0:i1], NaN if there is no value."""
+        if i1 <= i0:
+            return np.nan, np.nan
+        # the whole blocks within [i0, i1)
+        b0 = -(-i0 // self.block_size)
+        b1 = i1 // self.block_size
+        if b1 <= b0:
+            lo = np.fmin.reduce(self.y[i0:i1])
+            hi = np.fmax.reduce(self.y[i0:i1])
+        else:
+            head = self.y[i0 : b0 * self.block_size]
+            tail = self.y[b1 * self.block_size : i1]
+            lo = np.fmin.reduce(np.concatenate([head, self._block_min[b0:b1], tail]))
+            hi = np.fmax.reduce(np.concatenate([head, self._block_max[b0:b1], tail]))
+        if np.isnan(lo):
+            return np.nan, np.nan
+        return float(lo), float(hi)
+
+    def min_max(self, start=None, end=None):
+        """(min, max) of the values with start <= x < end (None for
+        unbounded), NaN if there is no value."""
+        i0 = 0 if start is None else np.searchsorted(self.x, pd.Timestamp(start).value)
+        i1 = (
+            len(self.x)
+            if end is None
+            else np.searchsorted(self.x, pd.Timestamp(end).value)
+        )
+        return self.index_min_max(int(i0), int(i1))
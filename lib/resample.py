@@ -0,0 +1,110 @@
+"""Incremental maintenance of the 3-hourly resampled frame.
+
+`_get_resampled_df` places every measurement on the first grid point at or
+after it (`ffill(limit=1)`) and linearly interpolates the grid points in
+between. Appending measurements can therefore only change the grid from the
+last placed (non-interpolated) value of each column onwards; everything
+before that is kept and only the tail is re-placed and re-interpolated.
+"""
+import numpy as np
+import pandas as pd
+
+from .my_plotter import MI_FIT_LABELS
+
+RESAMPLE_FREQ = "3h"
+
+
+def _resampled_columns(df):
+    return [label for label in MI_FIT_LABELS if label in df.columns]
+
+
+def _place_on_grid(df):
+    # the grid values before interpolation, see `_get_resampled_df`
+    return df[_resampled_columns(df)].resample(RESAMPLE_FREQ).ffill(limit=1)
+
+
+def _interpolate(placed):
+    return placed.interpolate(method="linear", order=2)
+
+
+def _last_valid_times(placed):
+    # per column, the grid time of the last placed value (NaT if none)
+    if len(placed) == 0:
+        return pd.Series(pd.NaT, index=placed.columns, dtype="datetime64[ns]")
+    valid = placed.notna().to_numpy()
+    has_valid = valid.any(axis=0)
+    last = len(valid) - 1 - np.argmax(valid[::-1], axis=0)
+    times = placed.index.to_numpy()[last]
+    return pd.Series(
+        np.where(has_valid, times, np.datetime64("NaT")), index=placed.columns
+    )
+
+
+class IncrementalResampler:
+    """Keep the resampled frame of a growing measurement frame.
+
+    `resampled_df` is always equal (up to float rounding) to
+    `_get_resampled_df(df)` of the frame last passed to `reset` or `extend`.
+    `changed_from` is the first grid time that may differ from the previous
+    `resampled_df` (None if it was recomputed as a whole).
+    """
+
+    def __init__(self, df):
+        self.reset(df)
+
+    def reset(self, df):
+        """Resample the whole of `df`."""
+        placed = _place_on_grid(df)
+        self.resampled_df = _interpolate(placed)
+        self._anchors = _last_valid_times(placed)
+        self._last_time = df.index[-1] if len(df) else None
+        self._n_rows = len(df)
+        self.changed_from = None
+        return self.resampled_df
+
+    def extend(self, df):
+        """Update the resampled frame for `df`, which is the previous frame
+        with rows appended. Falls back to a full resample if the new rows are
+        not all after the previous ones, or a column had no value yet."""
+        resampled_df = self.resampled_df
+        if (
+            self._last_time is None
+            or len(resampled_df) == 0
+            or self._anchors.isna().any()
+            or list(resampled_df.columns) != _resampled_columns(df)
+        ):
+            return self.reset(df)
+        if df.index.searchsorted(self._last_time, side="right") != self._n_rows:
+            # rows were inserted before the previous last measurement
+            return self.reset(df)
+        if len(df) == self._n_rows:
+            self.changed_from = resampled_df.index[-1] + pd.Timedelta(RESAMPLE_FREQ)
+            return resampled_df
+
+        # only the grid from the earliest per-column last placed value onwards
+        # can change; the value there is kept as the start of the interpolation
+        start = self._anchors.min()
+        step = pd.Timedelta(RESAMPLE_FREQ)
+        # the rows that can be placed on the grid from `start` onwards
+        tail_rows = df.iloc[df.index.searchsorted(start - step, side="right") :]
+        placed = _place_on_grid(tail_rows)
+        placed = placed.loc[placed.index >= start]
+        # the full grid may start earlier than the placement of the tail rows
+        grid = pd.date_range(
+            start, placed.index[-1], freq=RESAMPLE_FREQ, name=resampled_df.index.name
+        )
+        placed = placed.reindex(grid)
+
+        seeded = placed.copy()
+        seeded.iloc[0] = resampled_df.loc[start]
+        tail = _interpolate(seeded)
+
+        self.resampled_df = pd.concat(
+            [resampled_df.loc[resampled_df.index < start], tail]
+        )
+        new_anchors = _last_valid_times(placed.iloc[1:])
+        self._anchors = new_anchors.fillna(self._anchors)
+        self._last_time = df.index[-1]
+        self._n_rows = len(df)
+        self.changed_from = start
+        return self.resampled_df
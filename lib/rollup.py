@@ -0,0 +1,92 @@
+"""Daily, weekly and monthly rollups of the measurements.
+
+A rollup table has one row per calendar bucket (labelled by the bucket's
+start) and, per stat, the mean, min, max, count and first/last measurement
+in that bucket. Long-horizon views can be plotted from these few hundred rows
+instead of every measurement. When measurements are added, only the buckets
+from the one containing the earliest new measurement onwards are recomputed.
+"""
+import numpy as np
+import pandas as pd
+
+from .utils import build_index_engines
+
+# pandas period frequency of each rollup granularity
+ROLLUP_FREQS = {"day": "D", "week": "W", "month": "M"}
+ROLLUP_STATS = ["mean", "min", "max", "count", "first", "last"]
+
+
+def bucket_start(date, freq):
+    """The start of the `freq` bucket containing `date`."""
+    return pd.Timestamp(date).to_period(ROLLUP_FREQS[freq]).start_time
+
+
+def compute_rollup(df, labels, freq):
+    """The rollup table of the `labels` of `df` (sorted by time), with float
+    columns (label, stat); NaNs are not counted as measurements."""
+    buckets = df.index.to_period(ROLLUP_FREQS[freq]).start_time
+    # the measurements of every bucket are consecutive
+    is_start = np.r_[True, buckets[1:] != buckets[:-1]] if len(df) else []
+    starts = np.flatnonzero(is_start)
+    values = df[labels].to_numpy(dtype=float)
+    stats = {}
+    if len(starts):
+        valid = ~np.isnan(values)
+        stats["count"] = np.add.reduceat(valid, starts, axis=0)
+        total = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+        rows = np.arange(len(values))[:, None]
+        # the first and last row with a value, if any
+        first = np.minimum.reduceat(
+            np.where(valid, rows, len(values) - 1), starts, axis=0
+        )
+        last = np.maximum.reduceat(np.where(valid, rows, 0), starts, axis=0)
+        any_valid = stats["count"] > 0
+        columns = np.arange(len(labels))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["mean"] = total / stats["count"]
+        stats["min"] = np.fmin.reduceat(values, starts, axis=0)
+        stats["max"] = np.fmax.reduceat(values, starts, axis=0)
+        stats["first"] = np.where(any_valid, values[first, columns], np.nan)
+        stats["last"] = np.where(any_valid, values[last, columns], np.nan)
+        table = np.stack([stats[stat] for stat in ROLLUP_STATS], axis=2)
+    else:
+        table = np.empty((0, len(labels), len(ROLLUP_STATS)))
+    # one float block (counts included), which is cheap to build and concat
+    table = pd.DataFrame(
+        table.reshape(len(starts), -1),
+        index=pd.DatetimeIndex(buckets[starts], name=df.index.name),
+        columns=pd.MultiIndex.from_product([labels, ROLLUP_STATS]),
+    )
+    return build_index_engines(table)
+
+
+class Rollup:
+    """The rollup table of a growing measurement frame at one granularity."""
+
+    def __init__(self, df, labels, freq):
+        self.labels = labels
+        self.freq = freq
+        self.table = compute_rollup(df, labels, freq)
+
+    def extend(self, df, since):
+        """Update the table for measurements added from `since` onwards; `df`
+        has (at least) every measurement from the start of the bucket
+        containing `since` onwards."""
+        start = bucket_start(since, self.freq)
+        tail = df.iloc[df.index.searchsorted(start) :]
+        self.table = build_index_engines(
+            pd.concat(
+                [
+                    self.table.loc[self.table.index < start],
+                    compute_rollup(tail, self.labels, self.freq),
+                ]
+            )
+        )
+
+    @property
+    def nbytes(self):
+        return int(self.table.memory_usage(index=True).sum())
+
+    def means(self):
+        """The mean of every stat per bucket, shaped like the measurements."""
+        return self.table.xs("mean", axis=1, level=1)
@@ -0,0 +1,78 @@
+# serve the rollup tables via GET
+from flask import request, jsonify
+
+import numpy as np
+import pandas as pd
+
+from .dataset_registry import DEFAULT_USER
+from .http_cache import matching_etag, versioned_etag
+from .rollup import ROLLUP_FREQS, ROLLUP_STATS
+
+
+def build_route(app, registry):
+    """Register the rollup route.
+
+    GET /rollup?freq=<day|week|month>[&user=<id>][&since=<date>][&labels=A,B]
+    returns the rollup table (see `compute_rollup`) of the user's measurements
+    as {"user", "freq", "buckets": [bucket start, ...],
+    "stats": {label: {stat: [value per bucket, ...]}}}, with null for buckets
+    without a measurement of a label. A `since` with a time zone is converted
+    to UTC. The ETag of the response follows the
+    version of the user's data (in this process), a conditional GET of an
+    unchanged table is answered without computing it."""
+
+    @app.server.route("/rollup", methods=["GET"])
+    def get_rollup():
+        user = request.args.get("user", DEFAULT_USER)
+        freq = request.args.get("freq", "day")
+        if freq not in ROLLUP_FREQS:
+            return f"freq must be one of {', '.join(ROLLUP_FREQS)}", 400
+        try:
+            if user not in registry.users():
+                return f"no measurements of user '{user}'", 404
+            since = request.args.get("since")
+            since = pd.Timestamp(since) if since else None
+            if since is not None and since.tz is not None:
+                # the measurements are timed in UTC, without a time zone
+                since = since.tz_convert(None)
+        except ValueError as e:
+            return str(e), 400
+        dataset = registry.get(user)
+        etag = versioned_etag(
+            user, dataset.data_version, freq, since, request.args.get("labels")
+        )
+        sent_etag = matching_etag(etag)
+        if sent_etag is not None:
+            return "", 304, {"ETag": f'"{sent_etag}"'}
+        table = dataset.rollup(freq, since)
+
+        labels = table.columns.get_level_values(0).unique().tolist()
+        if request.args.get("labels"):
+            requested = request.args["labels"].split(",")
+            unknown = set(requested) - set(labels)
+            if unknown:
+                return f"unknown labels {sorted(unknown)}", 400
+            labels = requested
+
+        def to_list(series, stat):
+            values = series.to_numpy()
+            if stat == "count":
+                return values.astype(np.int64).tolist()
+            return [None if v != v else v for v in values.tolist()]
+
+        response = jsonify(
+            {
+                "user": user,
+                "freq": freq,
+                "buckets": [t.isoformat() for t in table.index],
+                "stats": {
+                    label: {
+                        stat: to_list(table[(label, stat)], stat)
+                        for stat in ROLLUP_STATS
+                    }
+                    for label in labels
+                },
+            }
+        )
+        response.set_etag(etag)
+        return response
@@ -0,0 +1,35 @@
+"""Compact in-memory representation of the measurements.
+
+The Mi Fit export has ~30 columns that pandas infers as float64/object, while
+the dashboard only reads the labels in `MI_FIT_LABELS_NICE_NAME_DICT`. The
+schema below projects the loaded frames to those labels (as float32, which
+holds every value of the export exactly enough for plotting) plus the few key
+columns, with DEVICE_ID as a categorical.
+"""
+import numpy as np
+
+from .my_plotter import MI_FIT_LABELS_NICE_NAME_DICT
+
+MEASUREMENT_DTYPES = {
+    "_id": np.int64,
+    "TIMESTAMP": np.int64,
+    "DEVICE_ID": "category",
+    **{label: np.float32 for label in MI_FIT_LABELS_NICE_NAME_DICT},
+}
+
+
+def compact_measurements(df, report=True):
+    """Project `df` to the columns of `MEASUREMENT_DTYPES` (those that it
+    has) and cast them to their compact dtype."""
+    columns = [c for c in MEASUREMENT_DTYPES if c in df.columns]
+    compact = df[columns].astype(
+        {c: MEASUREMENT_DTYPES[c] for c in columns}, copy=False
+    )
+    if report:
+        before = df.memory_usage(index=True, deep=True).sum()
+        after = compact.memory_usage(index=True, deep=True).sum()
+        print(
+            f"Compacted {len(df)} measurements: {before} -> {after} bytes "
+            f"({before - after} bytes saved, {before / max(after, 1):.1f}x)"
+        )
+    return compact
@@ -0,0 +1,235 @@
+"""Optional embedded SQLite storage of the measurements.
+
+The measurements of all users are kept in one table whose primary key is
+(USER, TIMESTAMP), so time-window queries for a user are index range scans.
+Only the plotted columns are stored and queries project the requested columns
+only, returning NumPy arrays; memory and time of a "last N months" query
+therefore scale with the window rather than with the whole history.
+
+Every write of a user's rows is a new generation of that user, stored with
+the rows it wrote; reads bounded by a generation see the rows as they were
+after that write, even while later rows are inserted.
+"""
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .my_plotter import MI_FIT_LABELS
+
+TABLE = "measurements"
+# columns stored besides the key; these are all the dashboard ever reads
+STORED_COLUMNS = ["_id", *MI_FIT_LABELS]
+
+
+def _to_ms(date):
+    if date is None:
+        return None
+    return int(pd.Timestamp(date).value // 10 ** 6)
+
+
+def _insert_sql(verb):
+    placeholders = ", ".join("?" for _ in range(len(STORED_COLUMNS) + 3))
+    names = ", ".join(f'"{c}"' for c in STORED_COLUMNS)
+    return (
+        f"{verb} INTO {TABLE} (USER, TIMESTAMP, SEQ, {names}) "
+        f"VALUES ({placeholders})"
+    )
+
+
+def _rows(user, df, seq):
+    """The rows of `df` as parameters of `_insert_sql`; sqlite binds NaN as
+    NULL."""
+    values = df.reindex(columns=STORED_COLUMNS).to_numpy(dtype=float).tolist()
+    timestamps = df["TIMESTAMP"].to_numpy(dtype=np.int64).tolist()
+    for ts, row in zip(timestamps, values):
+        yield (user, ts, seq, *row)
+
+
+def _where(user, start=None, end=None, generation=None):
+    """The WHERE clause (and its arguments) of the rows of `user` with
+    start <= TIMESTAMP < end, as of `generation` (the latest if None)."""
+    sql = " WHERE USER = ?"
+    args = [user]
+    if start is not None:
+        sql += " AND TIMESTAMP >= ?"
+        args.append(_to_ms(start))
+    if end is not None:
+        sql += " AND TIMESTAMP < ?"
+        args.append(_to_ms(end))
+    if generation is not None:
+        sql += " AND SEQ <= ?"
+        args.append(generation)
+    return sql, args
+
+
+class MeasurementDB:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = ", ".join(f'"{c}" REAL' for c in STORED_COLUMNS)
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+                f"USER TEXT NOT NULL, TIMESTAMP INTEGER NOT NULL, "
+                f"SEQ INTEGER NOT NULL DEFAULT 0, {columns}, "
+                f"PRIMARY KEY (USER, TIMESTAMP)) WITHOUT ROWID"
+            )
+            existing = [row[1] for row in conn.execute(f"PRAGMA table_info({TABLE})")]
+            if "SEQ" not in existing:
+                # created before the rows were versioned
+                conn.execute(
+                    f"ALTER TABLE {TABLE} ADD COLUMN SEQ INTEGER NOT NULL DEFAULT 0"
+                )
+            # the last generation of each user's rows
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations "
+                "(USER TEXT PRIMARY KEY, SEQ INTEGER NOT NULL)"
+            )
+            # state of the csv each user's rows were last synced from
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sources "
+                "(USER TEXT PRIMARY KEY, SOURCE TEXT NOT NULL)"
+            )
+
+    def _connection(self):
+        # sqlite connections cannot be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            self._local.conn = conn
+        return conn
+
+    def get_source(self, user):
+        row = (
+            self._connection()
+            .execute("SELECT SOURCE FROM sources WHERE USER = ?", (user,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def generation(self, user):
+        """The generation of the last write of the rows of `user`."""
+        row = (
+            self._connection()
+            .execute("SELECT SEQ FROM generations WHERE USER = ?", (user,))
+            .fetchone()
+        )
+        return row[0] if row else 0
+
+    def _next_generation(self, conn, user):
+        conn.execute(
+            "INSERT OR IGNORE INTO generations (USER, SEQ) VALUES (?, 0)", (user,)
+        )
+        conn.execute("UPDATE generations SET SEQ = SEQ + 1 WHERE USER = ?", (user,))
+        return conn.execute(
+            "SELECT SEQ FROM generations WHERE USER = ?", (user,)
+        ).fetchone()[0]
+
+    def set_source(self, user, source):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sources (USER, SOURCE) VALUES (?, ?)",
+                (user, source),
+            )
+
+    def replace_user(self, user, df, source=None):
+        """Replace all measurements of `user` with the rows of `df`. The rows
+        of earlier generations are gone, also for reads bounded by them."""
+        with self._connection() as conn:
+            seq = self._next_generation(conn, user)
+            conn.execute(f"DELETE FROM {TABLE} WHERE USER = ?", (user,))
+            # nothing to tell apart, one statement for all rows
+            conn.executemany(_insert_sql("INSERT OR REPLACE"), _rows(user, df, seq))
+            if source is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sources (USER, SOURCE) VALUES (?, ?)",
+                    (user, source),
+                )
+
+    def insert_new(self, user, df):
+        """Insert the rows of `df` that are not stored yet (by TIMESTAMP) and
+        return them."""
+        sql = _insert_sql("INSERT OR IGNORE")
+        is_new = np.zeros(len(df), dtype=bool)
+        with self._connection() as conn:
+            seq = self._next_generation(conn, user)
+            # one statement per row, whose row count tells if it was new
+            for i, row in enumerate(_rows(user, df, seq)):
+                is_new[i] = conn.execute(sql, row).rowcount > 0
+        return df[is_new]
+
+    def query(
+        self,
+        user,
+        columns,
+        start=None,
+        end=None,
+        limit=None,
+        desc=False,
+        generation=None,
+    ):
+        """Return the TIMESTAMP (ms) array and an (n, len(columns)) float array
+        of the measurements of `user` with start <= TIMESTAMP < end, as of
+        `generation` (the latest if None)."""
+        unknown = set(columns) - set(STORED_COLUMNS)
+        if unknown:
+            raise ValueError(f"columns {sorted(unknown)} are not stored")
+        projection = "".join(f', "{c}"' for c in columns)
+        where, args = _where(user, start, end, generation)
+        sql = f"SELECT TIMESTAMP{projection} FROM {TABLE}{where}"
+        sql += " ORDER BY TIMESTAMP" + (" DESC" if desc else "")
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        rows = self._connection().execute(sql, args).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(columns)))
+        arr = np.array(rows, dtype=float)
+        if desc:
+            arr = arr[::-1]
+        return arr[:, 0].astype(np.int64), arr[:, 1:]
+
+    def query_df(
+        self,
+        user,
+        columns,
+        start=None,
+        end=None,
+        limit=None,
+        desc=False,
+        generation=None,
+    ):
+        """Same as `query`, as a DataFrame indexed like `load_measurements`."""
+        timestamps, values = self.query(
+            user, columns, start, end, limit, desc, generation
+        )
+        df = pd.DataFrame(values, columns=columns)
+        df["TIMESTAMP"] = timestamps
+        df.index = pd.to_datetime(df.TIMESTAMP, unit="ms")
+        return df
+
+    def min_max(self, user, column, start=None, end=None, generation=None):
+        """(min, max) of `column` of the measurements of `user` with
+        start <= TIMESTAMP < end (as of `generation`), NaN if there are
+        none."""
+        if column not in STORED_COLUMNS:
+            raise ValueError(f"column '{column}' is not stored")
+        where, args = _where(user, start, end, generation)
+        sql = f'SELECT MIN("{column}"), MAX("{column}") FROM {TABLE}{where}'
+        lo, hi = self._connection().execute(sql, args).fetchone()
+        if lo is None:
+            return np.nan, np.nan
+        return lo, hi
+
+    def last_before(self, user, date, generation=None):
+        """TIMESTAMP (ms) of the last measurement before `date` (as of
+        `generation`), or None."""
+        where, args = _where(user, end=date, generation=generation)
+        row = (
+            self._connection()
+            .execute(f"SELECT MAX(TIMESTAMP) FROM {TABLE}{where}", args)
+            .fetchone()
+        )
+        return row[0]
@@ -1,21 +1,327 @@
 # update csv via POST
-from flask import request
+from flask import request, jsonify
 
-from io import StringIO
+from contextlib import nullcontext
+import codecs
 import csv
+import os
+import tempfile
+import zlib
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from pandas.api.types import is_float_dtype, is_integer_dtype
+
+from .dataset_registry import DEFAULT_USER
+from .ingest import load_measurements
+from .schema import MEASUREMENT_DTYPES
+
+_CHUNK_SIZE = 64 * 1024
+# the columns the loader casts (see `compact_measurements`)
+REQUIRED_COLUMNS = tuple(MEASUREMENT_DTYPES)
+
+
+class UploadError(ValueError):
+    """The posted content cannot be stored."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def build_route(app, registry, on_update=None):
+    """Register the upload route.
+
+    The `user` query argument selects the partition of the `registry` that
+    the upload goes to (the default user when omitted), so that one user's
+    upload only invalidates that user's caches.
+
+    POST /update_csv replaces the stored csv with the posted content. The body
+    is streamed in chunks (optionally gzip/deflate/zstd Content-Encoding),
+    validated row by row and written to a temporary file that atomically
+    replaces the csv, so readers never see a partially written file.
+    POST /update_csv?mode=append only accepts new rows: rows already stored
+    (same TIMESTAMP or _id) are dropped, the rest are appended to the csv and
+    merged into the loaded frames without a full reload. The validated rows
+    are streamed to a temporary file, which is parsed once complete.
+    With ?split=USER_ID (instead of `user`) an export of several users (e.g.
+    of a shared scale) goes to the partition of each row's USER_ID, streamed
+    into one temporary file per user; the response maps the users to their
+    stored (or appended) rows.
+    `on_update(user)` is called after each stored upload (e.g. to warm the
+    figures of the new data)."""
 
-def build_route(app, csv_name):
     @app.server.route("/update_csv", methods=["POST"])
     def parse_request():
-        postdata = request.get_data()
+        append = request.args.get("mode") == "append"
+        split = request.args.get("split")
+        try:
+            if split is None:
+                dataset = _dataset(registry, request.args.get("user", DEFAULT_USER))
+                text_chunks = _iter_request_text()
+                if append:
+                    with tempfile.TemporaryFile("w+", newline="") as f:
+                        write_csv(f, text_chunks)
+                        n_rows = _append_csv(registry, dataset, f)
+                    if on_update is not None and n_rows:
+                        on_update(dataset.user)
+                    return jsonify({"appended": n_rows})
+                _replace_csv(dataset, text_chunks)
+                if on_update is not None:
+                    on_update(dataset.user)
+                return "ok"
+
+            if split != "USER_ID":
+                raise UploadError("uploads can only be split by USER_ID")
+            parts = {}
+
+            def open_part(user):
+                # every partition name is checked before anything is stored
+                dataset = _dataset(registry, user)
+                if append:
+                    part = tempfile.TemporaryFile("w+", newline="")
+                else:
+                    part = PendingCsv(dataset.csv_name)
+                parts[user] = (dataset, part)
+                return part
+
+            try:
+                n_rows = split_csv(_iter_request_text(), split, open_part)
+                stored = {}
+                for user, (dataset, part) in parts.items():
+                    if append:
+                        stored[user] = _append_csv(registry, dataset, part)
+                    else:
+                        part.commit(lock=dataset.lock)
+                        stored[user] = n_rows[user]
+                    if on_update is not None and stored[user]:
+                        on_update(user)
+            finally:
+                for _, part in parts.values():
+                    part.close()
+            return jsonify({"appended" if append else "stored": stored})
+        except UploadError as e:
+            return str(e), e.status
+
+
+def _dataset(registry, user):
+    try:
+        return registry.dataset(user)
+    except ValueError as e:
+        raise UploadError(str(e))
+
+
+def _replace_csv(dataset, text_chunks):
+    """Replace the csv of `dataset`, returns the number of rows stored."""
+    return write_csv_atomically(dataset.csv_name, text_chunks, lock=dataset.lock)
+
+
+def _append_csv(registry, dataset, f):
+    """Append the new rows of the (validated) csv file `f` to `dataset`,
+    returns the number of rows appended."""
+    f.seek(0)
+    try:
+        new_df = load_measurements(f)
+    except ValueError as e:
+        raise UploadError(f"cannot parse csv: {e}")
+    try:
+        new_df = dataset.append_rows(new_df)
+    except (ValueError, TypeError) as e:
+        # the csv and the loaded frames are left unchanged
+        raise UploadError(f"rows do not fit the stored columns: {e}")
+    # the dataset is loaded now, account for it
+    registry.touch(dataset)
+    return len(new_df)
+
+
+def _iter_request_text():
+    """Yield the decoded text of the request body, chunk by chunk."""
+    encoding = request.headers.get("Content-Encoding", "")
+    decompressor = _get_decompressor(encoding)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        while True:
+            chunk = request.stream.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            yield decoder.decode(chunk)
+        if decompressor is not None and not decompressor.eof:
+            raise UploadError(f"truncated {encoding} request body")
+        yield decoder.decode(b"", final=True)
+    except (UnicodeDecodeError, zlib.error) as e:
+        raise UploadError(f"cannot decode request body: {e}")
+
+
+def _get_decompressor(content_encoding):
+    # None for an uncompressed body
+    encoding = content_encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd":
+        if zstandard is None:
+            raise UploadError("zstd Content-Encoding is not supported", 415)
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise UploadError(f"unsupported Content-Encoding '{content_encoding}'", 415)
 
-        f = StringIO(postdata.decode("utf-8"))
-        reader = csv.reader(f, delimiter=",")
 
-        # write result back to file
-        writer = csv.writer(open(csv_name, "w"))
+def _iter_lines(text_chunks):
+    """Re-split a stream of text chunks into lines (keeping line endings)."""
+    pending = ""
+    for chunk in text_chunks:
+        lines = (pending + chunk).splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _is_float(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _row_checker(header):
+    """Check the `header` of an uploaded csv, and return a function that
+    checks one of its rows; both raise `UploadError`. The rows must fit the
+    dtypes the loader casts to: the integer columns (_id, TIMESTAMP) cannot
+    be blank, the stats are blank or a number."""
+    if not header:
+        raise UploadError("empty csv")
+    missing = [c for c in REQUIRED_COLUMNS if c not in header]
+    if missing:
+        raise UploadError(f"csv header is missing {missing}")
+    integer_cols = [
+        header.index(c) for c, t in MEASUREMENT_DTYPES.items() if is_integer_dtype(t)
+    ]
+    float_cols = [
+        header.index(c) for c, t in MEASUREMENT_DTYPES.items() if is_float_dtype(t)
+    ]
+
+    def check_row(row, line_num):
+        if len(row) != len(header):
+            raise UploadError(f"invalid row {line_num}: expected {len(header)} fields")
+        for i in integer_cols:
+            if not row[i].isdigit():
+                raise UploadError(
+                    f"invalid row {line_num}: {header[i]} must be an integer"
+                )
+        for i in float_cols:
+            if row[i] and not _is_float(row[i]):
+                raise UploadError(
+                    f"invalid row {line_num}: {header[i]} must be a number"
+                )
+
+    return check_row
+
+
+def _validated_rows(text_chunks):
+    """The header of the csv in `text_chunks` and an iterator of its
+    (non-empty) rows, which are checked as they are read."""
+    reader = csv.reader(_iter_lines(text_chunks), delimiter=",")
+    header = next(reader, None)
+    check_row = _row_checker(header)
+
+    def rows():
         for row in reader:
-            writer.writerow(row)
+            if row:
+                check_row(row, reader.line_num)
+                yield row
+
+    return header, rows()
+
+
+def write_csv(f, text_chunks):
+    """Validate the csv rows in `text_chunks` and write them (with the header)
+    to the file `f`. Returns the number of data rows written."""
+    header, rows = _validated_rows(text_chunks)
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(header)
+    n_rows = 0
+    for row in rows:
+        writer.writerow(row)
+        n_rows += 1
+    return n_rows
+
+
+def split_csv(text_chunks, column, open_part):
+    """Validate the csv rows in `text_chunks` and split them by their value
+    of `column`: each row is written to the file `open_part(value)` (opened
+    on the first row of that value, after the header). Returns the number of
+    rows per value."""
+    header, rows = _validated_rows(text_chunks)
+    if column not in header:
+        raise UploadError(f"csv header is missing ['{column}']")
+    split_col = header.index(column)
+    writers = {}
+    n_rows = {}
+    for row in rows:
+        value = row[split_col]
+        if value not in writers:
+            writers[value] = csv.writer(open_part(value), lineterminator="\n")
+            writers[value].writerow(header)
+            n_rows[value] = 0
+        writers[value].writerow(row)
+        n_rows[value] += 1
+    return n_rows
+
+
+class PendingCsv:
+    """A temporary file in the directory of `csv_name`, which replaces the
+    csv with a rename on `commit()`, or is removed on `close()` otherwise."""
+
+    def __init__(self, csv_name):
+        self.csv_name = csv_name
+        dirname = os.path.dirname(os.path.abspath(csv_name))
+        os.makedirs(dirname, exist_ok=True)
+        fd, self.tmp_name = tempfile.mkstemp(
+            dir=dirname, prefix=".upload-", suffix=".csv"
+        )
+        self.file = open(fd, "w", newline="")
+
+    def write(self, text):
+        return self.file.write(text)
+
+    def commit(self, lock=None):
+        """Replace the csv (while holding `lock`, if given)."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if os.path.exists(self.csv_name):
+            # mkstemp creates the file as owner-only, keep the csv's permissions
+            os.chmod(self.tmp_name, os.stat(self.csv_name).st_mode & 0o777)
+        with lock if lock is not None else nullcontext():
+            os.replace(self.tmp_name, self.csv_name)
+        self.tmp_name = None
+
+    def close(self):
+        self.file.close()
+        if self.tmp_name is not None:
+            os.unlink(self.tmp_name)
+            self.tmp_name = None
+
+
+def write_csv_atomically(csv_name, text_chunks, lock=None):
+    """Validate the csv rows in `text_chunks` and store them as `csv_name`.
 
-        return "ok"
+    The rows are written to a temporary file in the same directory, which
+    replaces `csv_name` with a rename (while holding `lock`, if given) once
+    everything has been validated. Returns the number of data rows written."""
+    pending = PendingCsv(csv_name)
+    try:
+        n_rows = write_csv(pending, text_chunks)
+        pending.commit(lock)
+    finally:
+        pending.close()
+    return n_rows
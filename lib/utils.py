@@ -12,4 +12,12 @@ def md5(fname):
 def get_df_after_given_date(df, date):
     """Slice the df to only contain data after the given date.
     Assume df.index is datetime objects"""
-    return df[bisect.bisect_left(df.index, date) :]
\ No newline at end of file
+    return df[bisect.bisect_left(df.index, date) :]
+
+def build_index_engines(df):
+    """Build the lookup tables of the columns of `df` (and of their levels),
+    which pandas builds on the first lookup, not thread-safely. Frames shared
+    by concurrent requests are built before they are published."""
+    if len(df.columns):
+        df.columns.get_loc(df.columns[0])
+    return df
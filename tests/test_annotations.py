@@ -0,0 +1,54 @@
+import csv
+
+import dateutil.parser
+import pandas as pd
+import plotly.graph_objects as go
+
+from lib.annotations import AnnotationIndex
+from lib.fixtures import measurements
+from lib.my_plotter import (
+    MI_FIT_LABELS,
+    _annotation,
+    add_annotations,
+    get_plotted_fig_all,
+)
+
+
+def test_indexed_annotations_match_one_per_row(tmp_path):
+    df = measurements(365 * 8, start="2020-01-01")
+    path = str(tmp_path / "annotation.csv")
+    # some before the plotted dates, in no particular order
+    dates = pd.date_range("2019-06-01", "2020-12-31", periods=20)
+    with open(path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["date", "text"])
+        for i, date in enumerate(dates[::-1]):
+            writer.writerow([date.strftime("%Y-%m-%d %H:%M"), f"note {i}"])
+
+    def add_annotations_per_row(fig, xrefs, yrefs):
+        # how they were added before: one `add_annotation` per row
+        for xref, yref in zip(xrefs, yrefs):
+            with open(path, "r") as f:
+                reader = csv.reader(f)
+                next(reader)
+                for date, text in reader:
+                    date = dateutil.parser.parse(date)
+                    if date >= fig.data[0].x[0]:
+                        fig.add_annotation(**_annotation(date, text, xref, yref))
+
+    refs = ([f"x{i}" for i in range(1, 4)], [f"y{i}" for i in range(1, 4)])
+    annotations = []
+    for add in (
+        lambda fig: add_annotations_per_row(fig, *refs),
+        lambda fig: add_annotations(fig, *refs, index=AnnotationIndex(path)),
+    ):
+        fig = get_plotted_fig_all(df, df, MI_FIT_LABELS[:3], emw_span=24)
+        fig = go.Figure(
+            dict(fig, data=[dict(t, x=pd.DatetimeIndex(t["x"])) for t in fig["data"]])
+        )
+        fig.layout.annotations = ()
+        add(fig)
+        annotations.append(
+            sorted((str(a.x), a.text, a.xref) for a in fig.layout.annotations)
+        )
+    assert annotations[0] and annotations[0] == annotations[1]
@@ -0,0 +1,14 @@
+import pandas as pd
+
+from lib.column_cache import load_measurements_cached
+from lib.fixtures import sample_rows
+from lib.ingest import load_measurements
+
+
+def test_cached_load_matches_the_csv(tmp_path):
+    csv_name = str(tmp_path / "mifit.csv")
+    sample_rows(10_000, step=pd.Timedelta(minutes=10)).to_csv(csv_name, index=False)
+    expected = load_measurements(csv_name)
+    # written on the first load, read on the second
+    pd.testing.assert_frame_equal(load_measurements_cached(csv_name), expected)
+    pd.testing.assert_frame_equal(load_measurements_cached(csv_name), expected)
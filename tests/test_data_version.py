@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+import pytest
+
+import lib.data_version
+from lib.data_version import FileVersion, InotifyWatcher
+
+# the mtime of a file is trusted once it is older than this
+RACY_WINDOW = 2.1
+
+
+def write(path, text, mode="w"):
+    with open(path, mode) as f:
+        f.write(text)
+
+
+def test_stat_checks(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write(path, "a")
+    version = FileVersion(path, watch=False)
+    first = version.current()
+    assert version.current() == first
+    write(path, "bb")
+    assert version.current() == first + 1
+    # the same size, told apart by the content (if the mtime is the same, once
+    # the mtime is trusted)
+    write(path, "cc")
+    time.sleep(RACY_WINDOW)
+    assert version.current() == first + 2
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    hashed = []
+
+    def md5(path):
+        hashed.append(path)
+        return real_md5(path)
+
+    real_md5 = lib.data_version.md5
+    monkeypatch.setattr(lib.data_version, "md5", md5)
+    return hashed
+
+
+def test_racy_mtime_is_hashed_once_per_stat(tmp_path, hashes):
+    path = str(tmp_path / "data.csv")
+    write(path, "a")
+    version = FileVersion(path, watch=False)
+    first = version.current()
+    for _ in range(100):
+        assert version.current() == first
+    assert len(hashes) == 1
+    # and once more when the mtime is trusted
+    time.sleep(RACY_WINDOW)
+    assert version.current() == first
+    assert version.current() == first
+    assert len(hashes) == 2
+
+
+def test_own_writes_are_not_hashed(tmp_path, hashes):
+    path = str(tmp_path / "data.csv")
+    write(path, "a")
+    time.sleep(RACY_WINDOW)
+    version = FileVersion(path, watch=False)
+    first = version.current()
+    write(path, "bb", "a")
+    assert version.acknowledge() == first + 1
+    for _ in range(10):
+        assert version.current() == first + 1
+    time.sleep(RACY_WINDOW)
+    assert version.current() == first + 1
+    assert hashes == []
+
+
+@pytest.fixture
+def watched(tmp_path):
+    (tmp_path / "sub").mkdir()
+    paths = [
+        str(tmp_path / "a.csv"),
+        str(tmp_path / "b.csv"),
+        str(tmp_path / "sub" / "c.csv"),
+    ]
+    for path in paths:
+        write(path, "x")
+    threads = threading.active_count()
+    versions = [FileVersion(path) for path in paths]
+    if not all(version.watched for version in versions):
+        pytest.skip("inotify is not available")
+    # one instance (and thread) for every file
+    assert threading.active_count() - threads <= 1
+    assert len({version._watcher for version in versions}) == 1
+    time.sleep(RACY_WINDOW)
+    for version in versions:
+        version.current()
+    return paths, versions
+
+
+def test_watched_changes(watched):
+    paths, versions = watched
+    before = [version.current() for version in versions]
+    write(paths[0], "yy", "a")
+    time.sleep(0.2)
+    assert versions[0].current() == before[0] + 1
+    assert versions[1].current() == before[1]
+
+
+def test_removed_directory_falls_back_to_stat(watched):
+    paths, versions = watched
+    os.remove(paths[2])
+    os.rmdir(os.path.dirname(paths[2]))
+    time.sleep(0.2)
+    assert not versions[2].watched
+    assert versions[0].watched
+
+
+def test_overflow_falls_back_to_stat(watched):
+    paths, versions = watched
+    before = versions[1].current()
+    header = InotifyWatcher._EVENT_HEADER.pack(-1, InotifyWatcher.IN_Q_OVERFLOW, 0, 0)
+    versions[0]._watcher._handle(header)
+    assert not any(version.watched for version in versions)
+    write(paths[1], "zzz", "a")
+    assert versions[1].current() == before + 1
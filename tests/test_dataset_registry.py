@@ -0,0 +1,298 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.dataset_registry import DEFAULT_USER, DatasetRegistry
+from lib.derived import compute_derived
+from lib.fixtures import sample_rows
+from lib.sqlite_store import MeasurementDB
+
+N_ROWS = 3 * 365 * 6
+
+
+@pytest.fixture
+def rows():
+    return sample_rows(N_ROWS)
+
+
+@pytest.fixture
+def registry(tmp_path, rows):
+    csv_name = str(tmp_path / "mifit.csv")
+    rows.iloc[:-50].to_csv(csv_name, index=False)
+    return DatasetRegistry(csv_name, str(tmp_path / "users"))
+
+
+@pytest.fixture
+def sqlite_registry(tmp_path, rows):
+    csv_name = str(tmp_path / "mifit.csv")
+    rows.iloc[:-50].to_csv(csv_name, index=False)
+    db = MeasurementDB(str(tmp_path / "measurements.db"))
+    return DatasetRegistry(csv_name, str(tmp_path / "users"), db=db)
+
+
+def replace_csv(csv_name, rows):
+    rows.to_csv(csv_name + ".tmp", index=False)
+    os.replace(csv_name + ".tmp", csv_name)
+
+
+def test_snapshots_are_consistent_while_rows_are_appended(registry, rows):
+    dataset = registry.dataset(DEFAULT_USER)
+    first = registry.get(DEFAULT_USER)
+    first.smoothed_since(["WEIGHT"], 10)
+    first.rollup("week")
+    first_len = len(first.df)
+
+    # everything read of one snapshot must be of one version
+    observed = {}
+    errors = []
+    done = threading.Event()
+
+    def read():
+        try:
+            while not done.is_set():
+                snapshot = registry.get(DEFAULT_USER)
+                df, resampled_df = snapshot.frames_since()
+                smoothed = snapshot.smoothed_since(["WEIGHT"], 10)["WEIGHT"]
+                week = snapshot.rollup("week")
+                consistent = (
+                    snapshot.latest().name == df.index[-1]
+                    and smoothed.index.equals(resampled_df.index)
+                    and week[("WEIGHT", "count")].sum() == df.WEIGHT.count()
+                )
+                observation = (consistent, len(df), resampled_df.index[-1])
+                observed.setdefault(snapshot.data_version, set()).add(observation)
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for i in range(50):
+            dataset.append_rows(rows.iloc[[N_ROWS - 50 + i]])
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+    assert not errors
+    for version, observations in observed.items():
+        assert len(observations) == 1, (version, observations)
+        assert next(iter(observations))[0], version
+    lengths = [next(iter(observed[v]))[1] for v in sorted(observed)]
+    assert lengths == sorted(lengths)
+    # the snapshot taken before the appends is unchanged
+    assert len(first.df) == first_len
+    assert len(first.smoothed_since(["WEIGHT"], 10)["WEIGHT"]) == len(
+        first.resampled_df
+    )
+
+
+def test_replaced_csv_is_reloaded_in_the_background(registry, rows):
+    dataset = registry.dataset(DEFAULT_USER)
+    previous = registry.get(DEFAULT_USER)
+    rows = rows.copy()
+    rows["WEIGHT"] += 1
+    replace_csv(dataset.csv_name, rows)
+    deadline = time.monotonic() + 30
+    while True:
+        snapshot = registry.get(DEFAULT_USER)
+        if snapshot.data_version != previous.data_version:
+            break
+        # served the previous snapshot meanwhile
+        assert snapshot is previous
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    assert len(snapshot.df) == N_ROWS
+    assert snapshot.df.WEIGHT.iloc[-51] == previous.df.WEIGHT.iloc[-1] + 1
+
+    rows["WEIGHT"] -= 1
+    replace_csv(dataset.csv_name, rows)
+    snapshot = dataset.snapshot(wait=True)
+    assert snapshot.df.WEIGHT.iloc[-51] == previous.df.WEIGHT.iloc[-1]
+
+
+def test_appended_rows_are_sorted(registry, rows):
+    dataset = registry.dataset(DEFAULT_USER)
+    # newest first
+    dataset.append_rows(rows.iloc[-50:][::-1])
+    assert registry.get(DEFAULT_USER).df.index.is_monotonic_increasing
+    stored = pd.read_csv(dataset.csv_name)
+    assert stored.TIMESTAMP.is_monotonic_increasing
+    assert len(stored) == N_ROWS
+
+
+def test_rows_that_do_not_fit_are_not_appended(registry, rows):
+    dataset = registry.dataset(DEFAULT_USER)
+    with open(dataset.csv_name) as f:
+        before = f.read()
+    bad = rows.iloc[-50:].copy()
+    bad["WEIGHT"] = "heavy"
+    with pytest.raises(ValueError):
+        dataset.append_rows(bad)
+    with open(dataset.csv_name) as f:
+        assert f.read() == before
+    assert len(registry.get(DEFAULT_USER).df) == N_ROWS - 50
+
+
+def test_sqlite_snapshots_do_not_see_later_appends(sqlite_registry, rows):
+    dataset = sqlite_registry.dataset(DEFAULT_USER)
+    first = sqlite_registry.get(DEFAULT_USER)
+    since = rows.index[-200]
+    df, resampled_df = first.frames_since(since, columns=["WEIGHT"])
+    y_range = first.y_range("WEIGHT", since)
+
+    appended = rows.iloc[-50:].copy()
+    appended["WEIGHT"] = 1000.0
+    dataset.append_rows(appended)
+
+    # the windowed reads of the first snapshot are those of its version
+    pinned, pinned_resampled = first.frames_since(since, columns=["WEIGHT"])
+    assert pinned.index.equals(df.index)
+    assert pinned_resampled.index.equals(resampled_df.index)
+    assert first.y_range("WEIGHT", since) == y_range
+    assert first.latest().name == rows.index[-51]
+    assert first.rollup("week")[("WEIGHT", "count")].sum() == N_ROWS - 50
+    latest = sqlite_registry.get(DEFAULT_USER)
+    assert len(latest.frames_since(since, columns=["WEIGHT"])[0]) == 200
+    assert latest.y_range("WEIGHT", since)[1] == 1000.0
+
+
+@pytest.fixture
+def users(tmp_path, rows):
+    # three users with partitions of the same size, and a registry that
+    # holds two of them
+    registry = DatasetRegistry(str(tmp_path / "mifit.csv"), str(tmp_path / "users"))
+    for user in ("a", "b", "c"):
+        csv_name = registry.partition_path(user)
+        os.makedirs(os.path.dirname(csv_name))
+        rows.iloc[:1000].to_csv(csv_name, index=False)
+    registry.get("a")
+    registry.max_bytes = int(2.5 * registry.dataset("a").nbytes)
+    return registry
+
+
+def test_least_recently_used_datasets_are_evicted(users):
+    users.get("b")
+    users.get("a")
+    assert users.loaded_users() == ["b", "a"]
+    users.get("c")
+    assert users.loaded_users() == ["a", "c"]
+    assert not users.dataset("b").loaded
+    assert users.loaded_nbytes() <= users.max_bytes
+    # reloaded when used again
+    assert len(users.get("b").df) == 1000
+    assert users.loaded_users() == ["c", "b"]
+
+
+def test_most_recently_used_dataset_is_kept_over_budget(users):
+    users.max_bytes = 1
+    users.get("b")
+    assert users.loaded_users() == ["b"]
+    assert users.dataset("b").loaded
+    assert not users.dataset("a").loaded
+    assert users.stats()["loaded_nbytes"] == users.dataset("b").nbytes
+
+
+def test_dataset_reloaded_after_eviction_is_accounted_for(users, rows):
+    dataset = users.dataset("a")
+    previous = users.get("a")
+    replace_csv(dataset.csv_name, rows.iloc[:1001])
+    # the reload starts in the background, and is evicted before it is done
+    with dataset.lock:
+        assert users.get("a") is previous
+        users.get("b")
+        users.get("c")
+        assert users.loaded_users() == ["b", "c"]
+    deadline = time.monotonic() + 30
+    while users.loaded_users()[-1:] != ["a"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    assert dataset.loaded
+    assert users.loaded_users() == ["c", "a"]
+
+
+def test_derived_metrics_are_computed_by_name(registry):
+    snapshot = registry.get(DEFAULT_USER)
+    df, resampled_df = snapshot.derived_since(["FAT_MASS"])
+    assert list(df.columns) == ["FAT_MASS"]
+    # only what was asked for
+    assert list(snapshot._derived[0].columns) == ["FAT_MASS"]
+    expected = compute_derived(snapshot.df)
+    since = snapshot.df.index[-100]
+    df, _ = snapshot.derived_since(["LEAN_MASS", "FAT_MASS"], since)
+    pd.testing.assert_frame_equal(df, expected.loc[since:, ["LEAN_MASS", "FAT_MASS"]])
+
+
+def test_sqlite_derived_metrics_of_a_window(registry, sqlite_registry, rows):
+    # computed over the queried window, as over the whole loaded history
+    names = ["WEIGHT_WEEKLY_DELTA", "FAT_MASS"]
+    since = rows.index[-200]
+    df, _ = sqlite_registry.get(DEFAULT_USER).derived_since(names, since)
+    expected, _ = registry.get(DEFAULT_USER).derived_since(names, since)
+    assert len(df) == 150
+    pd.testing.assert_frame_equal(
+        df, expected, check_dtype=False, check_names=False, rtol=1e-5
+    )
+
+
+def test_sqlite_windows_match_the_loaded_history(registry, sqlite_registry, rows):
+    snapshot = sqlite_registry.get(DEFAULT_USER)
+    expected = registry.get(DEFAULT_USER)
+    since = rows.index[-500]
+    df, resampled_df = snapshot.frames_since(since, columns=["WEIGHT"])
+    expected_df, expected_resampled = expected.frames_since(since)
+    assert df.index.equals(expected_df.index)
+    np.testing.assert_allclose(df.WEIGHT, expected_df.WEIGHT, rtol=1e-6)
+    assert resampled_df.index.equals(expected_resampled.index)
+    np.testing.assert_allclose(
+        resampled_df.WEIGHT, expected_resampled.WEIGHT, rtol=1e-6
+    )
+    start, end = rows.index[-300], rows.index[-100]
+    np.testing.assert_allclose(
+        snapshot.y_range("WEIGHT", start, end),
+        expected.y_range("WEIGHT", start, end),
+        rtol=1e-6,
+    )
+    assert snapshot.latest().name == expected.latest().name
+    # the windows did not load the whole history
+    assert snapshot.df is None
+    pd.testing.assert_frame_equal(
+        snapshot.rollup("week", since),
+        expected.rollup("week", since),
+        check_dtype=False,
+        rtol=1e-5,
+    )
+
+
+def test_sqlite_rollups_are_extended_by_appends(registry, sqlite_registry, rows):
+    sqlite_registry.get(DEFAULT_USER).rollup("week")
+    sqlite_registry.dataset(DEFAULT_USER).append_rows(rows.iloc[-50:])
+    snapshot = sqlite_registry.get(DEFAULT_USER)
+    assert snapshot.df is None
+    registry.dataset(DEFAULT_USER).append_rows(rows.iloc[-50:])
+    pd.testing.assert_frame_equal(
+        snapshot.rollup("week"),
+        registry.get(DEFAULT_USER).rollup("week"),
+        check_dtype=False,
+        rtol=1e-5,
+    )
+    # a second append of the same rows is not stored again
+    dataset = sqlite_registry.dataset(DEFAULT_USER)
+    assert len(dataset.append_rows(rows.iloc[-50:])) == 0
+
+
+@pytest.mark.parametrize("with_db", [False, True])
+def test_latest_of_an_empty_csv_is_none(tmp_path, rows, with_db):
+    csv_name = str(tmp_path / "mifit.csv")
+    rows.iloc[:0].to_csv(csv_name, index=False)
+    db = MeasurementDB(str(tmp_path / "measurements.db")) if with_db else None
+    registry = DatasetRegistry(csv_name, str(tmp_path / "users"), db=db)
+    snapshot = registry.get(DEFAULT_USER)
+    assert snapshot.latest() is None
+    # rows appended later are the latest of the next snapshot
+    registry.dataset(DEFAULT_USER).append_rows(rows.iloc[:10])
+    assert registry.get(DEFAULT_USER).latest().name == rows.index[9]
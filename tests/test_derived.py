@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.derived import DERIVED_METRICS, compute_derived, derived_column
+from lib.fixtures import SAMPLE_CSV
+from lib.ingest import load_measurements
+from lib.schema import compact_measurements
+
+
+def test_every_metric_of_the_sample():
+    df = compact_measurements(load_measurements(SAMPLE_CSV), report=False)
+    derived = compute_derived(df)
+    assert list(derived.columns) == list(DERIVED_METRICS)
+    np.testing.assert_allclose(
+        derived["FAT_MASS"], df["BODY_FAT"] * df["WEIGHT"] / 100, rtol=1e-6
+    )
+    np.testing.assert_allclose(
+        derived["LEAN_MASS"], df["WEIGHT"] - derived["FAT_MASS"], rtol=1e-6
+    )
+
+
+def test_metrics_by_name_match_all_at_once():
+    df = compact_measurements(load_measurements(SAMPLE_CSV), report=False)
+    derived = compute_derived(df)
+    for name in DERIVED_METRICS:
+        pd.testing.assert_series_equal(derived_column(df, name), derived[name])
+    # the dependencies are computed, but not returned
+    assert list(compute_derived(df, ["FFMI"]).columns) == ["FFMI"]
+
+
+def test_weekly_delta():
+    index = pd.date_range("2021-01-01", periods=15, freq="D")
+    df = pd.DataFrame({"WEIGHT": np.arange(15.0)}, index=index)
+    delta = derived_column(df, "WEIGHT_WEEKLY_DELTA")
+    assert delta.iloc[:7].isna().all()
+    np.testing.assert_array_equal(delta.iloc[7:], 7.0)
+
+
+@pytest.mark.parametrize("n_rows", [0, 3])
+def test_weekly_delta_without_values_is_nan(n_rows):
+    index = pd.date_range("2021-01-01", periods=n_rows, freq="D")
+    df = pd.DataFrame({"WEIGHT": np.full(n_rows, np.nan)}, index=index)
+    delta = derived_column(df, "WEIGHT_WEEKLY_DELTA")
+    assert len(delta) == n_rows
+    assert delta.isna().all()
@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lib.downsample
+from lib.downsample import MinMaxPyramid, PyramidCache, downsample
+from lib.fixtures import measurements
+from lib.my_plotter import _get_resampled_df, get_plotted_fig_all
+
+
+@pytest.mark.parametrize("months", [1, 6, 12 * 5, None])
+def test_downsample_keeps_the_extremes_of_the_window(months):
+    y = measurements(20 * 365 * 8, labels=["WEIGHT"], nan_fraction=0.01, dtype=float)
+    x, y = y.index, y["WEIGHT"].to_numpy()
+    pyramid = MinMaxPyramid(x, y)
+    window = (None, None)
+    if months is not None:
+        window = (x[-1] - pd.Timedelta(days=30 * months), x[-1])
+    xs, ys = downsample(x, y, window, 2000, pyramid)
+    lo, hi = window
+    visible = (x >= (lo or x[0])) & (x <= (hi or x[-1]))
+    in_window = (xs >= (lo or x[0])) & (xs <= (hi or x[-1]))
+    assert np.nanmax(ys[in_window]) == np.nanmax(y[visible])
+    assert np.nanmin(ys[in_window]) == np.nanmin(y[visible])
+
+
+def test_pyramid_cache_is_bounded():
+    frame = measurements(1000, labels=["WEIGHT"])
+    cache = PyramidCache(max_entries=2)
+    pyramids = [cache.get(key, frame.index, frame["WEIGHT"]) for key in "abc"]
+    assert list(cache._pyramids) == ["b", "c"]
+    assert cache.get("c", None, None) is pyramids[2]
+    assert cache.nbytes() == pyramids[1].nbytes + pyramids[2].nbytes
+
+
+def test_concurrent_gets_build_once(monkeypatch):
+    frame = measurements(100_000, labels=["WEIGHT"])
+    built = []
+
+    class CountedPyramid(MinMaxPyramid):
+        def __init__(self, x, y):
+            built.append(1)
+            super().__init__(x, y)
+
+    monkeypatch.setattr(lib.downsample, "MinMaxPyramid", CountedPyramid)
+    cache = PyramidCache()
+    start = threading.Barrier(8)
+    got = []
+
+    def get():
+        start.wait()
+        got.append(cache.get("a", frame.index, frame["WEIGHT"]))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert len(got) == 8 and all(pyramid is got[0] for pyramid in got)
+
+
+def test_short_series_are_not_indexed():
+    # twice a day, resampled every 3 hours
+    df = measurements(1000, freq="12h")
+    cache = PyramidCache()
+    get_plotted_fig_all(
+        df,
+        _get_resampled_df(df),
+        ["WEIGHT"],
+        emw_span=10,
+        max_points=2000,
+        pyramids=cache,
+    )
+    # the measurements fit the budget, the resampled series does not
+    assert list(cache._pyramids) == [("smoothed", "WEIGHT", 10)]
@@ -0,0 +1,70 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.ewm import EwmCache, ewm_mean_2d
+from lib.fixtures import measurements
+
+
+@pytest.mark.parametrize("span", [1, 2, 10, 100])
+def test_ewm_mean_2d_matches_pandas_with_gaps(span):
+    values = measurements(2000, nan_fraction=0.1, dtype=float).to_numpy()
+    np.testing.assert_allclose(
+        ewm_mean_2d(values, span),
+        pd.DataFrame(values).ewm(span=span).mean().to_numpy(),
+        rtol=1e-9,
+    )
+
+
+def test_ewm_mean_2d_rows_match_pandas_per_label():
+    frame = measurements(10 * 365 * 8, dtype=float)
+    # like the interpolated resampled frame, no gaps after the first value
+    rng = np.random.default_rng(1)
+    for column, first in zip(frame.columns, rng.integers(0, len(frame) // 10, 10)):
+        frame.iloc[:first, frame.columns.get_loc(column)] = np.nan
+    rows = np.vstack([frame[label].to_numpy() for label in frame.columns])
+    np.testing.assert_allclose(
+        ewm_mean_2d(rows, 10, axis=1),
+        [frame[label].ewm(span=10).mean().to_numpy() for label in frame.columns],
+        rtol=1e-9,
+    )
+
+
+@pytest.mark.parametrize("span", [2, 10, 100])
+def test_ewm_mean_2d_matches_pandas_after_a_long_gap(span):
+    # thousands of missing rows, during which the weights decay to nothing
+    values = np.full(6000, np.nan)
+    values[0] = 70
+    values[5000] = 71
+    values[5001:] = 72
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        smoothed = ewm_mean_2d(np.vstack([values, values[::-1]]), span, axis=1)
+    np.testing.assert_allclose(
+        smoothed,
+        [
+            pd.Series(values).ewm(span=span).mean().to_numpy(),
+            pd.Series(values[::-1]).ewm(span=span).mean().to_numpy(),
+        ],
+        rtol=1e-9,
+    )
+    np.testing.assert_allclose(
+        ewm_mean_2d(values, span), pd.Series(values).ewm(span=span).mean(), rtol=1e-9
+    )
+
+
+def test_cache_extend_matches_recompute():
+    frame = measurements(3000, dtype=float)
+    cache = EwmCache()
+    cache.means(frame.iloc[:2500], ["WEIGHT", "MUSCLE"], 24)
+    # the last rows changed (e.g. re-interpolated) and more were appended
+    cache.extend(frame, frame.index[2490])
+    smoothed = cache.means(frame, ["WEIGHT", "MUSCLE"], 24)
+    for label in ("WEIGHT", "MUSCLE"):
+        np.testing.assert_allclose(
+            smoothed[label].to_numpy(),
+            frame[label].ewm(span=24).mean().to_numpy(),
+            rtol=1e-9,
+        )
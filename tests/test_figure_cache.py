@@ -0,0 +1,103 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from lib.figure_cache import FigureCache, figure_nbytes
+
+
+def figure(n):
+    return {"data": [{"x": np.arange(n, dtype=float), "y": np.ones(n)}]}
+
+
+def test_evicts_least_recently_used_by_count():
+    cache = FigureCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.get(key, lambda: figure(1))
+    cache.get("a", lambda: pytest.fail("cached"))
+    cache.get("c", lambda: figure(1))
+    assert list(cache._entries) == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_evicts_least_recently_used_by_bytes():
+    nbytes = figure_nbytes(figure(100))
+    assert nbytes == 2 * 100 * 8
+    cache = FigureCache(max_bytes=int(2.5 * nbytes))
+    for key in ("a", "b", "c"):
+        cache.get(key, lambda: figure(100))
+    assert list(cache._entries) == ["b", "c"]
+    assert cache.nbytes == 2 * nbytes
+    # the newest figure is kept even if it is over budget by itself
+    cache.get("d", lambda: figure(1000))
+    assert list(cache._entries) == ["d"]
+    assert cache.nbytes == figure_nbytes(figure(1000))
+    assert cache.stats()["evictions"] == 3
+
+
+def test_counters():
+    cache = FigureCache()
+    cache.get("a", lambda: figure(1))
+    cache.get("a", lambda: figure(1))
+    cache.get("a", lambda: figure(1))
+    cache.get("a", lambda: figure(1), force_update=True)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 2, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def run_concurrently(f, n_threads=8):
+    results = [None] * n_threads
+    errors = []
+    start = threading.Barrier(n_threads)
+
+    def run(i):
+        start.wait()
+        try:
+            results[i] = f()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+    return results, errors
+
+
+def test_concurrent_gets_create_once():
+    cache = FigureCache()
+    created = []
+
+    def create():
+        created.append(1)
+        time.sleep(0.1)
+        return figure(1)
+
+    results, errors = run_concurrently(lambda: cache.get("a", create))
+    assert not errors
+    assert len(created) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_failed_create_does_not_hang_waiters():
+    cache = FigureCache()
+    calls = []
+
+    def create():
+        calls.append(1)
+        time.sleep(0.1)
+        if len(calls) == 1:
+            raise RuntimeError("plotting failed")
+        return figure(1)
+
+    results, errors = run_concurrently(lambda: cache.get("a", create))
+    # the first creation failed for its caller only, a waiter created it
+    assert [str(e) for e in errors] == ["plotting failed"]
+    assert len(calls) == 2
+    assert "a" in cache._entries
+    assert cache.stats()["entries"] == 1
+    assert not cache._creating
@@ -0,0 +1,41 @@
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import pytest
+from plotly.utils import PlotlyJSONEncoder
+
+from lib.figure_json import encode_figure
+from lib.fixtures import measurements
+from lib.my_plotter import MI_FIT_LABELS, get_plotted_fig_all
+
+
+@pytest.mark.parametrize("n_stats,max_points", [(6, None), (10, None), (6, 2000)])
+def test_encoded_figure_plots_like_plotly_json(n_stats, max_points):
+    df = measurements(365 * 8)
+    resampled_df = df.resample("1h").mean().interpolate()
+    x_range = (df.index[-1] - pd.Timedelta(days=30), df.index[-1])
+    fig = get_plotted_fig_all(
+        df,
+        resampled_df,
+        MI_FIT_LABELS[:n_stats],
+        emw_span=24,
+        x_range=x_range if max_points else None,
+        max_points=max_points,
+    )
+    # how dash encodes a plotly figure, with the dates as an index
+    plotly_fig = go.Figure(
+        dict(fig, data=[dict(t, x=pd.DatetimeIndex(t["x"])) for t in fig["data"]])
+    )
+    expected = json.loads(json.dumps(plotly_fig, cls=PlotlyJSONEncoder))
+    decoded = json.loads(encode_figure(fig))
+    for trace, expected_trace in zip(decoded["data"], expected["data"]):
+        # the dates are epoch milliseconds
+        assert trace["x"][0] == pd.Timestamp(expected_trace["x"][0]).value // 10 ** 6
+        np.testing.assert_allclose(
+            np.array(trace["y"], dtype=float),
+            np.array(expected_trace["y"], dtype=float),
+            rtol=1e-6,
+        )
+    assert decoded["layout"]["xaxis"]["type"] == "date"
@@ -0,0 +1,71 @@
+import gzip
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import flask
+import pytest
+
+from lib.http_cache import brotli, build_hooks, versioned_etag
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BODY = b'{"figure": [' + b"70.1, " * 2000 + b"70.2]}"
+
+
+@pytest.fixture
+def hooks():
+    app = SimpleNamespace(server=flask.Flask(__name__))
+
+    @app.server.route("/stats", methods=["GET", "POST"])
+    def stats_route():
+        return flask.Response(BODY, mimetype="application/json")
+
+    @app.server.route("/small", methods=["GET"])
+    def small_route():
+        return flask.Response(b"{}", mimetype="application/json")
+
+    compressed_cache = build_hooks(app)
+    return app.server.test_client(), compressed_cache
+
+
+@pytest.mark.parametrize(
+    "accept,expected", [("gzip, br", "br" if brotli else "gzip"), ("gzip", "gzip")]
+)
+def test_compressed_with_the_preferred_encoding(hooks, accept, expected):
+    client, _ = hooks
+    response = client.post("/stats", headers={"Accept-Encoding": accept})
+    assert response.headers["Content-Encoding"] == expected
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_uncompressed(hooks):
+    client, _ = hooks
+    response = client.post("/stats", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data == BODY
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_conditional_get(hooks):
+    client, compressed_cache = hooks
+    for _ in range(2):
+        response = client.get("/stats", headers={"Accept-Encoding": "gzip"})
+        assert gzip.decompress(response.data) == BODY
+    # the compressed body was reused
+    assert compressed_cache.stats()["hits"] == 1
+    response = client.get(
+        "/stats",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]},
+    )
+    assert response.status_code == 304 and not response.data
+
+
+def test_versioned_etag_differs_per_process():
+    # the versions of the data restart in every process
+    code = "from lib.http_cache import versioned_etag; print(versioned_etag(1))"
+    other = subprocess.check_output(
+        [sys.executable, "-c", code], cwd=REPO, text=True
+    ).strip()
+    assert versioned_etag(1) == versioned_etag(1) != other
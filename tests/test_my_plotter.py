@@ -0,0 +1,65 @@
+import json
+
+import pandas as pd
+import pytest
+
+from lib.figure_json import encode_figure
+from lib.fixtures import make_subplots_figure, measurements
+from lib.my_plotter import (
+    MI_FIT_LABELS,
+    WEBGL_POINT_THRESHOLD,
+    _get_resampled_df,
+    get_plotted_fig_all,
+)
+
+
+def rounded(obj):
+    # the domains are computed in a different order
+    if isinstance(obj, float):
+        return round(obj, 9)
+    if isinstance(obj, dict):
+        return {k: rounded(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [rounded(v) for v in obj]
+    return obj
+
+
+@pytest.mark.parametrize("n_stats,max_points", [(6, None), (10, None), (6, 2000)])
+def test_figure_dict_matches_make_subplots(n_stats, max_points):
+    df = measurements(365 * 8)
+    resampled_df = _get_resampled_df(df)
+    stats_labels = MI_FIT_LABELS[:n_stats]
+    x_range = (df.index[-1] - pd.Timedelta(days=30), df.index[-1])
+    fig_dict = get_plotted_fig_all(
+        df,
+        resampled_df,
+        stats_labels,
+        emw_span=24,
+        smoothed={
+            label: resampled_df[label].ewm(span=24).mean() for label in stats_labels
+        },
+        x_range=x_range if max_points else None,
+        max_points=max_points,
+    )
+    fig = make_subplots_figure(fig_dict, stats_labels)
+    assert rounded(json.loads(encode_figure(fig_dict))) == rounded(
+        json.loads(encode_figure(fig))
+    )
+
+
+def trace_types(df, **kwargs):
+    resampled_df = _get_resampled_df(df)
+    fig = get_plotted_fig_all(df, resampled_df, ["WEIGHT"], emw_span=24, **kwargs)
+    # the last point's text is always SVG
+    return {trace["type"] for trace in fig["data"][:2]}
+
+
+def test_webgl_is_chosen_by_the_points_before_downsampling():
+    df = measurements(WEBGL_POINT_THRESHOLD, freq="12h")
+    end = df.index[-1]
+    # downsampled to far fewer points than the threshold, also when zoomed in
+    for days in (30, 3):
+        x_range = (end - pd.Timedelta(days=days), end)
+        assert trace_types(df, x_range=x_range, max_points=100) == {"scattergl"}
+    assert trace_types(df, max_points=100, webgl_threshold=None) == {"scatter"}
+    assert trace_types(df.iloc[-100:], max_points=100) == {"scatter"}
@@ -0,0 +1,30 @@
+from lib.dataset_registry import DEFAULT_USER, DatasetRegistry
+from lib.fixtures import sample_rows
+from lib.prewarm import FigureWarmer
+
+
+def test_warms_once_per_data_version(tmp_path):
+    rows = sample_rows(1000)
+    csv_name = str(tmp_path / "mifit.csv")
+    rows.iloc[:-10].to_csv(csv_name, index=False)
+    registry = DatasetRegistry(csv_name, str(tmp_path / "users"))
+    warmed = []
+    warmer = FigureWarmer(
+        registry,
+        lambda snapshot, request: warmed.append((snapshot.data_version, request)),
+        defaults=["default"],
+    )
+    warmer.record(DEFAULT_USER, "frequent")
+    assert warmer.warm_if_changed(DEFAULT_USER)
+    version = registry.get(DEFAULT_USER).data_version
+    assert warmed == [(version, "default"), (version, "frequent")]
+
+    # nothing changed, nothing is warmed again
+    assert not warmer.warm_if_changed(DEFAULT_USER)
+    assert len(warmed) == 2
+
+    registry.dataset(DEFAULT_USER).append_rows(rows.iloc[-10:])
+    assert warmer.warm_if_changed(DEFAULT_USER)
+    assert not warmer.warm_if_changed(DEFAULT_USER)
+    assert warmed[2:] == [(version + 1, "default"), (version + 1, "frequent")]
+    assert warmer.stats() == dict(warmups=2, warmed={DEFAULT_USER: version + 1})
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from lib.fixtures import measurements
+from lib.range_index import RangeExtrema
+
+
+def expected_min_max(values):
+    if np.isfinite(values).any():
+        return np.nanmin(values), np.nanmax(values)
+    return np.nan, np.nan
+
+
+@pytest.mark.parametrize("n", [10 * 365 * 2, 100_000])
+def test_min_max_matches_the_slice(n):
+    frame = measurements(n, labels=["WEIGHT"], start="1980-01-01", nan_fraction=0.2)
+    x, y = frame.index, frame["WEIGHT"].to_numpy(dtype=float)
+    index = RangeExtrema(x, y)
+    rng = np.random.default_rng(0)
+    for i0, i1 in np.sort(rng.integers(0, n, (200, 2)), axis=1):
+        np.testing.assert_equal(index.min_max(x[i0], x[i1]), expected_min_max(y[i0:i1]))
+    assert index.min_max() == expected_min_max(y)
+
+
+def test_every_range_around_the_blocks():
+    frame = measurements(50, labels=["WEIGHT"], nan_fraction=0.5)
+    y = frame["WEIGHT"].to_numpy(dtype=float)
+    # a run of NaNs longer than a block
+    y[20:30] = np.nan
+    index = RangeExtrema(frame.index, y, block_size=4)
+    for i0 in range(len(y) + 1):
+        for i1 in range(len(y) + 1):
+            np.testing.assert_equal(
+                index.index_min_max(i0, i1),
+                expected_min_max(y[i0:i1]) if i0 < i1 else (np.nan, np.nan),
+            )
+
+
+def test_memory_is_per_block():
+    frame = measurements(100_000, labels=["WEIGHT"])
+    index = RangeExtrema(frame.index, frame["WEIGHT"])
+    # the float32 series is not copied
+    assert index.nbytes == 2 * 4 * (100_000 // index.block_size)
+    assert np.isclose(index.min_max()[0], frame["WEIGHT"].min())
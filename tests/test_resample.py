@@ -0,0 +1,19 @@
+import pandas as pd
+
+from lib.fixtures import SAMPLE_CSV
+from lib.ingest import load_measurements
+from lib.my_plotter import _get_resampled_df
+from lib.resample import IncrementalResampler
+
+
+def test_extend_matches_a_full_recompute():
+    df = load_measurements(SAMPLE_CSV)
+    # grow the frame one measurement at a time
+    n_initial = len(df) // 2
+    resampler = IncrementalResampler(df.iloc[:n_initial])
+    for n in range(n_initial + 1, len(df) + 1):
+        pd.testing.assert_frame_equal(
+            resampler.extend(df.iloc[:n]),
+            _get_resampled_df(df.iloc[:n]),
+            check_freq=False,
+        )
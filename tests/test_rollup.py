@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import flask
+import pandas as pd
+import pytest
+
+from lib import rollup_via_rest
+from lib.dataset_registry import DEFAULT_USER, DatasetRegistry
+from lib.fixtures import measurements, sample_rows
+from lib.my_plotter import MI_FIT_LABELS
+from lib.rollup import ROLLUP_FREQS, ROLLUP_STATS, Rollup, compute_rollup
+
+
+@pytest.mark.parametrize("freq", list(ROLLUP_FREQS))
+def test_extended_rollup_matches_groupby(freq):
+    # about three measurements a day
+    df = measurements(
+        3 * 365 * 3, freq="8h", start="2012-01-01", irregular=True, dtype=float
+    )
+    n_initial = len(df) - 20
+    rollup = Rollup(df.iloc[:n_initial], MI_FIT_LABELS, freq)
+    for i in range(n_initial, len(df)):
+        rollup.extend(df.iloc[: i + 1], df.index[i])
+    full = compute_rollup(df, MI_FIT_LABELS, freq)
+    pd.testing.assert_frame_equal(rollup.table, full)
+    expected = (
+        df.groupby(df.index.to_period(ROLLUP_FREQS[freq]).start_time)
+        .agg(ROLLUP_STATS)
+        .rename_axis(df.index.name)
+    )
+    pd.testing.assert_frame_equal(full, expected, check_dtype=False, check_freq=False)
+
+
+@pytest.fixture
+def rollup(tmp_path):
+    rows = sample_rows(500)
+    csv_name = str(tmp_path / "mifit.csv")
+    rows.to_csv(csv_name, index=False)
+    registry = DatasetRegistry(csv_name, str(tmp_path / "users"))
+    app = SimpleNamespace(server=flask.Flask(__name__))
+    rollup_via_rest.build_route(app, registry)
+    client = app.server.test_client()
+
+    def get(headers=None, **args):
+        return client.get("/rollup", query_string=args, headers=headers)
+
+    return SimpleNamespace(get=get, registry=registry, rows=rows)
+
+
+def test_rollup_json(rollup):
+    response = rollup.get(freq="week", labels="WEIGHT,BODY_FAT")
+    assert response.status_code == 200
+    body = response.json
+    table = rollup.registry.get(DEFAULT_USER).rollup("week")
+    assert body["user"] == DEFAULT_USER
+    assert body["freq"] == "week"
+    assert body["buckets"] == [t.isoformat() for t in table.index]
+    assert sorted(body["stats"]) == ["BODY_FAT", "WEIGHT"]
+    weight = body["stats"]["WEIGHT"]
+    assert sorted(weight) == sorted(ROLLUP_STATS)
+    assert weight["count"] == table[("WEIGHT", "count")].astype(int).tolist()
+    assert sum(weight["count"]) == rollup.rows.WEIGHT.count()
+    assert weight["max"] == pytest.approx(table[("WEIGHT", "max")].tolist())
+
+
+def test_conditional_get(rollup):
+    response = rollup.get(freq="month")
+    etag = response.headers["ETag"]
+    response = rollup.get(freq="month", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    # another table, another ETag
+    assert rollup.get(freq="day").headers["ETag"] != etag
+    # and another version of the data
+    dataset = rollup.registry.dataset(DEFAULT_USER)
+    dataset.append_rows(sample_rows(501).iloc[-1:])
+    response = rollup.get(freq="month", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_since_with_a_time_zone_is_converted_to_utc(rollup):
+    since = rollup.rows.index[250]
+    naive = rollup.get(freq="day", since=since.isoformat())
+    in_sydney = since.tz_localize("UTC").tz_convert("Australia/Sydney")
+    aware = rollup.get(freq="day", since=in_sydney.isoformat())
+    assert aware.status_code == 200
+    assert aware.json == naive.json
+    assert len(naive.json["buckets"]) < len(rollup.get(freq="day").json["buckets"])
+
+
+@pytest.mark.parametrize(
+    "args,status",
+    [
+        (dict(freq="year"), 400),
+        (dict(freq="day", since="yesterday-ish"), 400),
+        (dict(freq="day", labels="WEIGHT,MASS"), 400),
+        (dict(freq="day", user="nobody"), 404),
+    ],
+)
+def test_bad_requests(rollup, args, status):
+    assert rollup.get(**args).status_code == status
@@ -0,0 +1,49 @@
+import numpy as np
+
+from lib.fixtures import sample_rows
+from lib.sqlite_store import MeasurementDB
+
+
+def test_replace_and_insert_new(tmp_path):
+    db = MeasurementDB(str(tmp_path / "measurements.db"))
+    rows = sample_rows(1000)
+    db.replace_user("a", rows.iloc[:900])
+    db.replace_user("b", rows.iloc[:10])
+    # the stored rows are not inserted again
+    new = db.insert_new("a", rows.iloc[800:])
+    assert new.TIMESTAMP.tolist() == rows.TIMESTAMP.iloc[900:].tolist()
+    timestamps, values = db.query("a", ["WEIGHT", "BODY_FAT"])
+    np.testing.assert_array_equal(timestamps, rows.TIMESTAMP)
+    np.testing.assert_allclose(values, rows[["WEIGHT", "BODY_FAT"]].astype(float))
+    # replaced, not appended
+    db.replace_user("a", rows.iloc[:5])
+    assert len(db.query("a", ["WEIGHT"])[0]) == 5
+    assert len(db.query("b", ["WEIGHT"])[0]) == 10
+
+
+def test_reads_bounded_by_a_generation(tmp_path):
+    db = MeasurementDB(str(tmp_path / "measurements.db"))
+    rows = sample_rows(100)
+    assert db.generation("a") == 0
+    db.replace_user("a", rows.iloc[:50])
+    generation = db.generation("a")
+    db.insert_new("a", rows.iloc[50:])
+    assert db.generation("a") == generation + 1
+    assert len(db.query("a", ["WEIGHT"], generation=generation)[0]) == 50
+    assert len(db.query("a", ["WEIGHT"])[0]) == 100
+    last = rows.TIMESTAMP.iloc[49]
+    assert db.last_before("a", rows.index[-1], generation) == last
+    expected = rows.WEIGHT.iloc[:50].astype(float)
+    assert db.min_max("a", "WEIGHT", generation=generation) == (
+        expected.min(),
+        expected.max(),
+    )
+
+
+def test_queries_of_a_user_without_rows(tmp_path):
+    db = MeasurementDB(str(tmp_path / "measurements.db"))
+    timestamps, values = db.query("a", ["WEIGHT"])
+    assert timestamps.shape == (0,) and values.shape == (0, 1)
+    assert len(db.query_df("a", ["WEIGHT"], limit=1, desc=True)) == 0
+    assert np.isnan(db.min_max("a", "WEIGHT")).all()
+    assert db.last_before("a", "2020-01-01") is None
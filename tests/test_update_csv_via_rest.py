@@ -0,0 +1,190 @@
+import gzip
+import os
+import zlib
+from types import SimpleNamespace
+
+import flask
+import pytest
+
+from lib.dataset_registry import DEFAULT_USER, DatasetRegistry
+from lib.fixtures import SAMPLE_CSV
+from lib.update_csv_via_rest import build_route, zstandard
+
+with open(SAMPLE_CSV) as f:
+    SAMPLE = f.read()
+HEADER, *ROWS = SAMPLE.splitlines()
+COLUMNS = HEADER.split(",")
+
+
+def with_values(row, **values):
+    fields = row.split(",")
+    for column, value in values.items():
+        fields[COLUMNS.index(column)] = value
+    return ",".join(fields)
+
+
+def csv_text(*rows, header=HEADER):
+    return "\n".join([header, *rows]) + "\n"
+
+
+def deflate(data):
+    compressor = zlib.compressobj()
+    return compressor.compress(data) + compressor.flush()
+
+
+COMPRESSORS = {"gzip": gzip.compress, "deflate": deflate}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = zstandard.ZstdCompressor().compress
+
+
+@pytest.fixture
+def upload(tmp_path):
+    registry = DatasetRegistry(str(tmp_path / "mifit.csv"), str(tmp_path / "users"))
+    app = SimpleNamespace(server=flask.Flask(__name__))
+    updated = []
+    build_route(app, registry, on_update=updated.append)
+    client = app.server.test_client()
+
+    def post(text, headers=None, **args):
+        return client.post("/update_csv", query_string=args, data=text, headers=headers)
+
+    return SimpleNamespace(
+        post=post, registry=registry, updated=updated, tmp_path=tmp_path
+    )
+
+
+def temporary_files(upload):
+    # of uploads that were not stored
+    return [
+        name
+        for _, _, names in os.walk(upload.tmp_path)
+        for name in names
+        if name.startswith(".upload-")
+    ]
+
+
+def test_replace(upload):
+    assert upload.post(csv_text(*ROWS[:-10])).status_code == 200
+    assert len(upload.registry.get(DEFAULT_USER).df) == len(ROWS) - 10
+    assert upload.post(csv_text(*ROWS)).status_code == 200
+    dataset = upload.registry.dataset(DEFAULT_USER)
+    assert len(dataset.snapshot(wait=True).df) == len(ROWS)
+    assert upload.updated == [DEFAULT_USER, DEFAULT_USER]
+    assert not temporary_files(upload)
+
+
+def test_append(upload):
+    assert upload.post(csv_text(*ROWS[:-10])).status_code == 200
+    # the stored rows are dropped
+    response = upload.post(csv_text(*ROWS[-20:]), mode="append")
+    assert response.json == {"appended": 10}
+    assert len(upload.registry.get(DEFAULT_USER).df) == len(ROWS)
+    assert upload.updated == [DEFAULT_USER, DEFAULT_USER]
+    assert not temporary_files(upload)
+
+
+@pytest.mark.parametrize("encoding", sorted(COMPRESSORS))
+def test_compressed_body(upload, encoding):
+    response = upload.post(
+        COMPRESSORS[encoding](SAMPLE.encode()), headers={"Content-Encoding": encoding}
+    )
+    assert response.status_code == 200
+    assert len(upload.registry.get(DEFAULT_USER).df) == len(ROWS)
+
+
+@pytest.mark.parametrize("mode", ["replace", "append"])
+@pytest.mark.parametrize("encoding", sorted(COMPRESSORS))
+def test_truncated_body_is_rejected(upload, mode, encoding):
+    assert upload.post(csv_text(*ROWS[:-10])).status_code == 200
+    csv_name = upload.registry.dataset(DEFAULT_USER).csv_name
+    with open(csv_name) as f:
+        before = f.read()
+    body = COMPRESSORS[encoding](SAMPLE.encode())
+    # cut off at the end of a row, such that what was received parses
+    response = upload.post(
+        body[: len(body) // 2], headers={"Content-Encoding": encoding}, mode=mode
+    )
+    assert response.status_code == 400
+    assert "truncated" in response.get_data(as_text=True)
+    with open(csv_name) as f:
+        assert f.read() == before
+    assert not temporary_files(upload)
+
+
+def test_unsupported_encoding(upload):
+    response = upload.post(SAMPLE, headers={"Content-Encoding": "br"})
+    assert response.status_code == 415
+
+
+@pytest.mark.parametrize("mode", ["replace", "append"])
+@pytest.mark.parametrize(
+    "text,error",
+    [
+        ("", "empty csv"),
+        (
+            csv_text(ROWS[0], header=HEADER.replace("WEIGHT", "MASS")),
+            "missing ['WEIGHT']",
+        ),
+        (csv_text(with_values(ROWS[0], _id="")), "_id must be an integer"),
+        (csv_text(with_values(ROWS[0], TIMESTAMP="")), "TIMESTAMP must be an integer"),
+        (csv_text(with_values(ROWS[0], WEIGHT="heavy")), "WEIGHT must be a number"),
+        (csv_text(ROWS[0] + ",1"), "expected"),
+    ],
+)
+def test_invalid_uploads_are_rejected(upload, mode, text, error):
+    assert upload.post(csv_text(*ROWS[:-10])).status_code == 200
+    csv_name = upload.registry.dataset(DEFAULT_USER).csv_name
+    with open(csv_name) as f:
+        before = f.read()
+    response = upload.post(text, mode=mode)
+    assert response.status_code == 400
+    assert error in response.get_data(as_text=True)
+    with open(csv_name) as f:
+        assert f.read() == before
+    assert not temporary_files(upload)
+
+
+@pytest.mark.parametrize("encoding", [None, "gzip"])
+def test_split_by_user_id(upload, encoding):
+    rows = [
+        with_values(row, USER_ID="42" if i % 3 == 0 else "7")
+        for i, row in enumerate(ROWS)
+    ]
+    compress = COMPRESSORS[encoding] if encoding else lambda data: data
+    headers = {"Content-Encoding": encoding} if encoding else None
+
+    def post(text, **args):
+        return upload.post(compress(text.encode()), headers, split="USER_ID", **args)
+
+    response = post(csv_text(*rows[:-10]))
+    n_42 = sum(i % 3 == 0 for i in range(len(ROWS) - 10))
+    assert response.json == {"stored": {"42": n_42, "7": len(ROWS) - 10 - n_42}}
+    response = post(csv_text(*rows), mode="append")
+    appended = response.json["appended"]
+    assert appended["42"] + appended["7"] == 10
+    assert sorted(upload.registry.users()) == ["42", "7"]
+    total = sum(len(upload.registry.get(user).df) for user in ("42", "7"))
+    assert total == len(ROWS)
+    assert sorted(upload.updated) == ["42", "42", "7", "7"]
+    assert not temporary_files(upload)
+
+
+@pytest.mark.parametrize("mode", ["replace", "append"])
+def test_split_stores_nothing_if_a_row_is_invalid(upload, mode):
+    rows = [
+        with_values(row, USER_ID="42" if i % 3 == 0 else "7")
+        for i, row in enumerate(ROWS)
+    ]
+    rows[-1] = with_values(rows[-1], WEIGHT="heavy")
+    response = upload.post(csv_text(*rows), split="USER_ID", mode=mode)
+    assert response.status_code == 400
+    assert upload.registry.users() == []
+    assert not temporary_files(upload)
+
+
+def test_split_rejects_invalid_users(upload):
+    response = upload.post(
+        csv_text(with_values(ROWS[0], USER_ID="../x")), split="USER_ID"
+    )
+    assert response.status_code == 400
+    assert upload.registry.users() == []